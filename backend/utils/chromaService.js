@@ -3,7 +3,7 @@ const axios = require('axios');
 const CHROMA_SERVICE_URL = 'http://localhost:8000';
 
 
-exports.addDocuments = async function addDocuments(collectionName, documents) {
+exports.addDocuments = async function addDocuments(collectionName, documents, childId) {
     try {
         // Format documents to match ChromaDB expectations
         const formattedDocuments = documents.map(doc => ({
@@ -14,7 +14,9 @@ exports.addDocuments = async function addDocuments(collectionName, documents) {
 
         const response = await axios.post(`${CHROMA_SERVICE_URL}/add_documents`, {
             collection: collectionName,
-            documents: formattedDocuments
+            documents: formattedDocuments,
+            // Gives every summary a stable id, so re-sending a journal is idempotent
+            child_id: childId
         });
         return response.data;
     } catch (error) {
@@ -50,5 +52,22 @@ exports.query = async function query(collectionName, queryText) {
     }
 };
 
+exports.queryBatch = async function queryBatch(collectionName, queries, options = {}) {
+    try {
+        const response = await axios.post(`${CHROMA_SERVICE_URL}/query_batch`, {
+            collection: collectionName,
+            queries,
+            n_results: options.nResults || 1,
+            where: options.where
+        });
 
- 
\ No newline at end of file
+        // One entry per query, in the order the queries were given
+        return response.data.results.map(result => ({
+            found: result.found,
+            results: result.results
+        }));
+    } catch (error) {
+        console.error('Error querying collection in batch:', error.response?.data || error);
+        throw error;
+    }
+};
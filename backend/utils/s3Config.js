@@ -133,7 +133,7 @@ async function searchJournalEntries(question, childId) {
         let context = await query(collectionName, question);
         if(!context.found){
             console.log("Adding documents to collection");
-            vectorDocument = await addDocuments(collectionName, journalEntries);
+            vectorDocument = await addDocuments(collectionName, journalEntries, childId);
             context = await query(collectionName, question);
         }
 
@@ -0,0 +1,155 @@
+"""Compile the WHO reference tables in downloads/ into one memory-mappable bundle.
+
+Every *.json / *.jsonx table is parsed once, given a canonical name
+
+    {indicator}/{sex}/{kind}/{range}     e.g. wfa/boys/z/expanded, bmi/girls/p/0-2y
+
+and written as a column-major float64 matrix into bundle/who_tables-{hash}.bin.
+bundle/manifest.json names that file and records each table's byte offset,
+shape and column names, so readers can np.memmap the file and slice columns
+without copying.
+
+Usage:
+    python build_who_bundle.py [--source downloads] [--out bundle]
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+
+import numpy as np
+
+BUNDLE_PREFIX = "who_tables"
+MANIFEST_FILE = "manifest.json"
+BUNDLE_VERSION = 1
+ALIGNMENT = 64
+
+# Upstream spells BMI-for-age both "bfa" and "bmi"
+INDICATOR_ALIASES = {"bfa": "bmi"}
+
+# File name patterns of the WHO downloads, including their typos
+PATTERNS = [
+    # wfa-boys-zscore-expanded-tables, ssfa-boys-zscore-expanded-table, wfa-boys-percentiles-expanded-tables
+    (re.compile(r"^(?P<ind>[a-z]+)-(?P<sex>boys|girls)-(?P<kind>zscore|percentiles)-expanded-tables?$"), None),
+    # wfa_boys_0-to-5-years_zscores, bmi_boys_0-to-2-years_zcores
+    (re.compile(r"^(?P<ind>[a-z]+)_(?P<sex>boys|girls)_(?P<a>\d+)-to-(?P<b>\d+)-(?P<unit>weeks|years)_z(?:s)?cores$"), "z"),
+    # hcfa-boys-0-13-zscores, acfa-boys-3-5-zscores
+    (re.compile(r"^(?P<ind>[a-z]+)-(?P<sex>boys|girls)-(?P<a>\d+)-(?P<b>\d+)-zscores$"), "z"),
+    # tab_wfa_boys_p_0_5, tab-ssfa-boys-p-3-5
+    (re.compile(r"^tab[_-](?P<ind>[a-z]+)[_-](?P<sex>boys|girls)[_-]p[_-](?P<a>\d+)[_-](?P<b>\d+)$"), "p"),
+]
+
+# Row order key per table, whichever of these the table has
+X_COLUMNS = ("Day", "Week", "Month", "Age", "Length", "Height")
+
+
+def canonical_name(file_name):
+    """Return the canonical table name for a download, or None if it is not a table."""
+    stem = re.sub(r"\.jsonx?$", "", file_name)
+    for pattern, kind in PATTERNS:
+        match = pattern.match(stem)
+        if not match:
+            continue
+        parts = match.groupdict()
+        indicator = INDICATOR_ALIASES.get(parts["ind"], parts["ind"])
+        if kind is None:
+            kind = "z" if parts["kind"] == "zscore" else "p"
+            age_range = "expanded"
+        else:
+            # The 0-13 tables are in weeks, everything else in years
+            unit = parts.get("unit") or ("weeks" if parts["b"] == "13" else "years")
+            age_range = f"{parts['a']}-{parts['b']}{unit[0]}"
+        return f"{indicator}/{parts['sex']}/{kind}/{age_range}"
+    return None
+
+
+def load_rows(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    # Converted workbooks are {sheet: rows}; every WHO workbook has one sheet
+    if isinstance(data, dict):
+        data = next(iter(data.values()))
+    return data
+
+
+def to_matrix(rows):
+    # Some sheets pad headers ("M       "), and rows may mix padded and clean keys
+    rows = [{key.strip(): value for key, value in row.items()} for row in rows]
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    x_column = next((c for c in X_COLUMNS if c in columns), columns[0])
+    rows = sorted(rows, key=lambda row: row[x_column])
+    matrix = np.array([[float(row.get(c, "nan")) for row in rows] for c in columns], dtype="<f8")
+    return columns, x_column, np.ascontiguousarray(matrix)
+
+
+def build(source_dir, out_dir):
+    tables = {}
+    for file_name in sorted(os.listdir(source_dir)):
+        name = canonical_name(file_name)
+        if name is None:
+            continue
+        if name in tables:
+            raise ValueError(f"{file_name} and {tables[name]['source']} both map to {name}")
+        rows = load_rows(os.path.join(source_dir, file_name))
+        if not rows:
+            print(f"Skipping empty table {file_name}")
+            continue
+        columns, x_column, matrix = to_matrix(rows)
+        tables[name] = {"source": file_name, "columns": columns, "x": x_column, "matrix": matrix}
+
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_path = os.path.join(out_dir, f"{BUNDLE_PREFIX}.bin.tmp")
+    manifest = {"version": BUNDLE_VERSION, "dtype": "<f8", "built_at": time.time(), "tables": {}}
+    digest = hashlib.sha256()
+
+    with open(tmp_path, "wb") as f:
+        offset = 0
+        for name, table in tables.items():
+            padding = -offset % ALIGNMENT
+            f.write(b"\0" * padding)
+            offset += padding
+            data = table["matrix"].tobytes()
+            f.write(data)
+            digest.update(data)
+            manifest["tables"][name] = {
+                "offset": offset,
+                "rows": table["matrix"].shape[1],
+                "columns": table["columns"],
+                "x": table["x"],
+                "source": table["source"],
+            }
+            offset += len(data)
+    manifest["sha256"] = digest.hexdigest()
+    manifest["size"] = offset
+
+    # Each build gets its own file name, and the manifest naming it is swapped
+    # in last: readers open the manifest and then exactly the file it names,
+    # so they never pair a new bundle with an old manifest or the other way round
+    bundle_file = f"{BUNDLE_PREFIX}-{manifest['sha256'][:16]}.bin"
+    bundle_path = os.path.join(out_dir, bundle_file)
+    manifest["file"] = bundle_file
+    os.replace(tmp_path, bundle_path)
+
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    # Mapped bundles stay readable after unlinking, so older builds can go
+    for old in os.listdir(out_dir):
+        if old.startswith(BUNDLE_PREFIX) and old.endswith(".bin") and old != bundle_file:
+            os.remove(os.path.join(out_dir, old))
+
+    print(f"Wrote {len(tables)} tables, {offset / 1e6:.1f} MB, to {bundle_path}")
+    return manifest
+
+
+if __name__ == "__main__":
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Compile the WHO growth tables into a binary bundle")
+    parser.add_argument("--source", default=os.path.join(here, "downloads"))
+    parser.add_argument("--out", default=os.path.join(here, "bundle"))
+    args = parser.parse_args()
+    build(args.source, args.out)
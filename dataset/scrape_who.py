@@ -1,52 +1,238 @@
-import requests
-from bs4 import BeautifulSoup
-import pandas as pd
+"""Fetch the WHO child growth standard workbooks and convert them to JSON.
+
+Indicator pages come from who_sources.json. Workbooks linked from every page
+are downloaded concurrently over one pooled session, skipped when the server
+reports them unchanged (ETag / Last-Modified remembered in
+downloads/.fetch_state.json), and converted to JSON in a process pool.
+Every output file is written to a temporary name and renamed into place.
+
+Usage:
+    python scrape_who.py [--base-url URL] [--only wfa bmi] [--force]
+
+--base-url points the fetcher at a local stand-in server serving the same
+paths, e.g. fixture workbooks behind `python -m http.server`.
+"""
 import os
 import json
+import hashlib
+import argparse
+import tempfile
+import threading
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
-# WHO URL
-url = 'https://www.who.int/tools/child-growth-standards/standards/triceps-skinfold-for-age'
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup
 
-# Create a folder to store downloads
-os.makedirs('downloads', exist_ok=True)
+HERE = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = '.fetch_state.json'
 
-# Step 1: Get HTML content
-response = requests.get(url)
-soup = BeautifulSoup(response.content, 'html.parser')
 
-# Step 2: Find all links to Excel files
-xls_links = []
-for link in soup.find_all('a', href=True):
-    href = link['href']
-    if '.xls' in href or '.xlsx' in href:
-        full_url = href if href.startswith('http') else f"https://www.who.int{href}"
-        xls_links.append(full_url)
+def load_config(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
 
-# Step 3: Download and convert each Excel file to JSON
-for i, link in enumerate(xls_links):
-    print(f"Downloading: {link}")
-    file_name = urllib.parse.urlparse(link).path.split("/")[-1]
-    file_path = os.path.join('downloads', file_name)
 
-    # Download file
-    r = requests.get(link)
-    with open(file_path, 'wb') as f:
-        f.write(r.content)
+def make_session(pool_size):
+    # One pooled session shared by all download threads keeps connections alive
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
-    # Load Excel file using pandas
+
+def atomic_write(path, data):
+    """Write bytes to path via a temporary file in the same directory."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
     try:
-        df = pd.read_excel(file_path, sheet_name=None)  # Get all sheets
-        json_data = {}
-        for sheet, data in df.items():
-            json_data[sheet] = data.dropna().to_dict(orient='records')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def json_name(file_path):
+    # Kept from the original scraper so existing consumers find their files:
+    # "x.xlsx" becomes "x.jsonx" and "x.xls" becomes "x.json"
+    return file_path.replace('.xls', '.json').replace('.xlsx', '.json')
+
+
+def find_workbook_links(session, page_url, timeout):
+    """Return absolute URLs of the Excel files linked from an indicator page."""
+    response = session.get(page_url, timeout=timeout)
+    response.raise_for_status()
+    soup = BeautifulSoup(response.content, 'html.parser')
+    links = []
+    for link in soup.find_all('a', href=True):
+        href = link['href']
+        if '.xls' in href:
+            links.append(urllib.parse.urljoin(page_url, href))
+    return links
+
+
+def download(session, url, out_dir, previous, force, timeout):
+    """Download a workbook unless the server says it has not changed.
+
+    Returns:
+        (file_path, state entry, changed)
+    """
+    file_name = urllib.parse.unquote(urllib.parse.urlparse(url).path.split('/')[-1])
+    file_path = os.path.join(out_dir, file_name)
+
+    headers = {}
+    if previous and not force and os.path.exists(file_path):
+        if previous.get('etag'):
+            headers['If-None-Match'] = previous['etag']
+        if previous.get('last_modified'):
+            headers['If-Modified-Since'] = previous['last_modified']
+
+    response = session.get(url, headers=headers, timeout=timeout)
+    if response.status_code == 304:
+        return file_path, previous, False
+    response.raise_for_status()
+
+    content = response.content
+    digest = hashlib.sha256(content).hexdigest()
+    entry = {
+        'file': file_name,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'sha256': digest,
+    }
+    # Servers without validators still resend identical bytes; don't rewrite those
+    if previous and previous.get('sha256') == digest and os.path.exists(file_path) and not force:
+        return file_path, entry, False
+
+    atomic_write(file_path, content)
+    return file_path, entry, True
+
+
+def convert_workbook(file_path):
+    """Convert every sheet of a workbook to JSON; runs in a worker process."""
+    # Imported here so only the worker processes pay for pandas
+    import pandas as pd
+
+    df = pd.read_excel(file_path, sheet_name=None)  # Get all sheets
+    json_data = {}
+    for sheet, data in df.items():
+        json_data[sheet] = data.dropna().to_dict(orient='records')
+
+    json_file = json_name(file_path)
+    atomic_write(json_file, json.dumps(json_data, indent=2, ensure_ascii=False).encode('utf-8'))
+    return json_file
+
+
+def fetch(config, out_dir, base_url=None, only=None, force=False, workers=8, processes=None, timeout=60):
+    """Fetch and convert the workbooks of the configured indicators.
+
+    Args:
+        config: Parsed who_sources.json
+        out_dir: Directory for workbooks, JSON files and the fetch state
+        base_url: Overrides config["base_url"], e.g. for a local test server
+        only: Indicator keys to fetch, defaults to all of them
+        force: Ignore the stored validators and download everything
+        workers: Concurrent downloads
+        processes: Conversion processes, defaults to the CPU count
+        timeout: Per-request timeout in seconds
+
+    Returns:
+        Counts of downloaded, unchanged, converted and failed files
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    base_url = (base_url or config['base_url']).rstrip('/') + '/'
+    indicators = {key: path for key, path in config['indicators'].items() if not only or key in only}
+
+    state_path = os.path.join(out_dir, STATE_FILE)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+    state_lock = threading.Lock()
+
+    summary = {'downloaded': 0, 'unchanged': 0, 'converted': 0, 'failed': 0}
+    session = make_session(workers)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool, ProcessPoolExecutor(max_workers=processes) as converters:
+        # Step 1: collect workbook links from every indicator page
+        pages = {
+            pool.submit(find_workbook_links, session, urllib.parse.urljoin(base_url, path.lstrip('/')), timeout): key
+            for key, path in indicators.items()
+        }
+        links = []
+        for future in as_completed(pages):
+            try:
+                links.extend(future.result())
+            except Exception as e:
+                print(f"Error reading page for {pages[future]}: {e}")
+                summary['failed'] += 1
+        links = list(dict.fromkeys(links))
+
+        # Step 2: download concurrently, handing changed workbooks to the converters
+        downloads = {
+            pool.submit(download, session, url, out_dir, state.get(url), force, timeout): url
+            for url in links
+        }
+        conversions = {}
+        for future in as_completed(downloads):
+            url = downloads[future]
+            try:
+                file_path, entry, changed = future.result()
+            except Exception as e:
+                print(f"Error downloading {url}: {e}")
+                summary['failed'] += 1
+                continue
+
+            with state_lock:
+                state[url] = entry
+            if changed or not os.path.exists(json_name(file_path)):
+                print(f"Downloaded: {url}")
+                summary['downloaded'] += 1
+                conversions[converters.submit(convert_workbook, file_path)] = file_path
+            else:
+                summary['unchanged'] += 1
+
+        # Step 3: wait for the conversions
+        for future in as_completed(conversions):
+            try:
+                print(f"Saved JSON: {future.result()}")
+                summary['converted'] += 1
+            except Exception as e:
+                print(f"Error processing {os.path.basename(conversions[future])}: {e}")
+                summary['failed'] += 1
+                # Forget the validators so the next run retries this workbook
+                with state_lock:
+                    for url, entry in list(state.items()):
+                        if entry and entry.get('file') == os.path.basename(conversions[future]):
+                            state.pop(url)
+
+    atomic_write(state_path, json.dumps(state, indent=2, sort_keys=True).encode('utf-8'))
+    print(f"Done: {summary}")
+    return summary
 
-        # Save JSON
-        json_file = file_path.replace('.xls', '.json').replace('.xlsx', '.json')
-        with open(json_file, 'w', encoding='utf-8') as jf:
-            json.dump(json_data, jf, indent=2, ensure_ascii=False)
 
-        print(f"Saved JSON: {json_file}")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fetch WHO growth standard workbooks and convert them to JSON')
+    parser.add_argument('--config', default=os.path.join(HERE, 'who_sources.json'))
+    parser.add_argument('--out', default=os.path.join(HERE, 'downloads'))
+    parser.add_argument('--base-url', default=os.getenv('WHO_BASE_URL'))
+    parser.add_argument('--only', nargs='*', help='Indicator keys from the config, e.g. wfa bmi')
+    parser.add_argument('--force', action='store_true', help='Download even if unchanged')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
 
-    except Exception as e:
-        print(f"Error processing {file_name}: {e}")
+    fetch(
+        load_config(args.config),
+        args.out,
+        base_url=args.base_url,
+        only=args.only,
+        force=args.force,
+        workers=args.workers,
+        processes=args.processes,
+    )
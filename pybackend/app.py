@@ -1,10 +1,25 @@
 import os
 import json
-from fastapi import FastAPI, HTTPException
+import asyncio
+import logging
+from contextlib import aclosing, asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from typing import TYPE_CHECKING, Optional
 from dotenv import load_dotenv
 from child_journal_rag import ChildJournalRAG  # Assuming the class is in child_journal_rag.py
-from langchain_community.vectorstores import FAISS
+from journal_loader import JournalLoadError
+from llm_scheduler import LLMOverloaded
+from rag_cache import RAGCache
+from concurrency import SingleFlight, load_executor, run_blocking
+from metrics import metrics_payload, register_stats, track_request
+from warmup import Readiness, startup_mode, warm_up
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
@@ -12,46 +27,159 @@ load_dotenv()
 # Retrieve credentials from environment variables
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# Initialize RAG system; models load in the background warm-up
+rag = ChildJournalRAG()
+readiness = Readiness()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Answer liveness probes right away and warm up behind them, unless asked to block
+    warmup = asyncio.create_task(warm_up(rag, get_vector_store, readiness))
+    if startup_mode() == "eager":
+        await warmup
+    yield
+    warmup.cancel()
+    if rag.shared_index is not None:
+        rag.shared_index.close()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.middleware("http")(track_request)
 
-# Initialize RAG system
-rag = ChildJournalRAG()
+# Cache vector stores to avoid redundant processing, bounded by RAG_CACHE_* settings
+vector_store_cache = RAGCache.from_env(name="vector_stores")
 
-# Cache vector stores to avoid redundant processing
-vector_store_cache = {}
+# Concurrent cold requests for the same child share a single load
+vector_store_loads = SingleFlight()
+
+register_stats("vector_stores", vector_store_cache.stats)
+register_stats("sessions", rag.sessions.stats)
+register_stats("journals", rag.journals.stats)
+if rag.answer_cache is not None:
+    register_stats("semantic_answers", rag.answer_cache.stats)
+if rag.shared_index is not None:
+    register_stats("shared_index", rag.shared_index.stats)
 
 class QueryRequest(BaseModel):
     child_id: str
     query: str
+    session_id: Optional[str] = None
+
+async def get_vector_store(child_id: str) -> "FAISS":
+    """Return a child's vector store from the cache, loading it on a miss."""
+    vector_store = vector_store_cache.get(child_id)
+    if vector_store is None:
+        vector_store = await vector_store_loads.do(child_id, lambda: load_vector_store(child_id))
+    return vector_store
+
+async def load_vector_store(child_id: str) -> "FAISS":
+    """Load the persisted index, or build it from the journal, off the event loop."""
+    try:
+        vector_store = await run_blocking(load_executor, rag.get_vector_store, child_id)
+    except JournalLoadError as e:
+        # S3 is failing, which is not the same as the child having no journal
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    if vector_store is None:
+        raise HTTPException(status_code=404, detail="Journal not found")
+    vector_store_cache.put(child_id, vector_store)  # Cache it
+    return vector_store
 
 @app.post("/query")
 async def query_journal(request: QueryRequest):
     """Endpoint to query the child's journal using RAG."""
     try:
-        print(request)
-        print(os.getenv("AWS_BUCKET_NAME"))
-        print(os.getenv("GEMINI_API_KEY"))
-        
         # Check cache for existing vector store
-        if request.child_id in vector_store_cache:
-            vector_store = vector_store_cache[request.child_id]
-        else:
-            # Load journal data
-            journal_data = rag.load_journal_from_s3(request.child_id)
-            if not journal_data:
-                raise HTTPException(status_code=404, detail="Journal not found")
-
-            # Prepare documents and create vector store
-            documents = rag.prepare_documents(journal_data)
-            vector_store = rag.create_vector_store(documents)
-            vector_store_cache[request.child_id] = vector_store  # Cache it
+        vector_store = await get_vector_store(request.child_id)
 
         # Setup the RAG chain
         chain = rag.setup_rag_chain(vector_store)
 
         # Query the journal
-        response = rag.query_journal(chain, request.query)
+        # Requests without a session id are answered as standalone questions
+        session = rag.sessions.get(request.child_id, request.session_id) if request.session_id else None
+        response = await rag.aquery_journal(chain, request.query, session, request.child_id)
         return response
+    except HTTPException:
+        raise
+    except LLMOverloaded as e:
+        # Shed before waiting on a saturated model; clients should retry later
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
+        logger.error(f"Error processing query for child {request.child_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+def format_sse(event: str, data) -> str:
+    """Encode one server-sent event; data is JSON so newlines in tokens survive."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/query/stream")
+async def stream_query(request: QueryRequest, http_request: Request):
+    """Stream an answer as server-sent events.
+    
+    Emits a `sources` event with the retrieved chunks' metadata, one `token`
+    event per chunk of the Gemini answer and a final `done` event. Stops
+    generating as soon as the client disconnects.
+    """
+    vector_store = await get_vector_store(request.child_id)
+    session = rag.sessions.get(request.child_id, request.session_id) if request.session_id else None
+
+    async def events():
+        try:
+            async with aclosing(rag.astream_answer(vector_store, request.query, session, request.child_id)) as stream:
+                async for event in stream:
+                    if await http_request.is_disconnected():
+                        logger.info(f"Client disconnected, stopping answer for child {request.child_id}")
+                        return
+                    yield format_sse(event["event"], event["data"])
+            yield format_sse("done", {})
+        except Exception as e:
+            logger.error(f"Error while streaming answer: {e}")
+            yield format_sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Report hit/miss/eviction counters of the vector store cache."""
+    return vector_store_cache.stats()
+
+@app.get("/embeddings/stats")
+async def embeddings_stats():
+    """Report batching, throughput and queue depth of the shared embedder."""
+    return rag.embeddings.stats()
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """Report queue depth, in-flight calls and shed/coalesced counts of the LLM scheduler."""
+    return rag.llm_scheduler.stats() if rag.llm_scheduler else {"enabled": False}
+
+@app.delete("/cache/{child_id}")
+async def invalidate_cache(child_id: str):
+    """Drop a child's cached vector store and answers, e.g. after their journal changed."""
+    rag.invalidate_child(child_id)
+    return {"child_id": child_id, "invalidated": vector_store_cache.invalidate(child_id)}
+
+@app.get("/answers/stats")
+async def answer_cache_stats():
+    """Report hit rates of the semantic answer cache."""
+    return rag.answer_cache.stats() if rag.answer_cache else {"enabled": False}
+
+@app.get("/metrics")
+async def metrics():
+    """Expose stage latencies, request latencies and cache counters to Prometheus."""
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process is up and serving requests."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_probe():
+    """Readiness probe: 200 once the models and hot children are loaded, 503 before."""
+    return JSONResponse(readiness.snapshot(), status_code=200 if readiness.ready else 503)
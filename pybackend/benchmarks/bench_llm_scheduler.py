@@ -0,0 +1,142 @@
+"""Burst load against a simulated rate-limited LLM, with and without the scheduler.
+
+The fake provider answers after a fixed latency and returns 429 once more
+than --provider-concurrency calls overlap, like Gemini under a burst. The
+same burst (a share of it duplicate questions) is sent straight to the
+provider and then through ScheduledChatModel, and the outcomes, latencies
+and scheduler counters are printed.
+
+Usage (from pybackend/):
+    python benchmarks/bench_llm_scheduler.py
+    python benchmarks/bench_llm_scheduler.py --requests 200 --max-in-flight 4 --queue-timeout 2
+"""
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import threading
+from pathlib import Path
+from typing import Any, List, Optional
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+_lock = threading.Lock()
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class FakeRateLimitedChatModel(BaseChatModel):
+    """Chat model with a fixed latency that rejects calls beyond a concurrency limit."""
+
+    latency: float = 0.2
+    max_concurrency: int = 4
+    calls: int = 0
+    rejected: int = 0
+    active: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-rate-limited"
+
+    def _admit(self):
+        with _lock:
+            self.calls += 1
+            if self.active >= self.max_concurrency:
+                self.rejected += 1
+                raise RateLimitError("429 Resource has been exhausted (e.g. check quota).")
+            self.active += 1
+
+    def _done(self):
+        with _lock:
+            self.active -= 1
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"Answer to: {messages[-1].content}"))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self._admit()
+        try:
+            time.sleep(self.latency)
+            return self._result(messages)
+        finally:
+            self._done()
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self._admit()
+        try:
+            await asyncio.sleep(self.latency)
+            return self._result(messages)
+        finally:
+            self._done()
+
+
+async def burst(model: BaseChatModel, requests: int, distinct: int):
+    async def one(i):
+        started = time.perf_counter()
+        try:
+            await model.ainvoke([HumanMessage(content=f"What did the child do in month {i % distinct}?")])
+            return "ok", time.perf_counter() - started
+        except Exception as e:
+            return type(e).__name__, time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(requests)))
+    return results, time.perf_counter() - started
+
+
+def report(name: str, results, seconds: float, provider: FakeRateLimitedChatModel):
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    latencies = sorted(latency for outcome, latency in results if outcome == "ok")
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(f"\n{name}")
+    print(f"  outcomes           {outcomes}")
+    print(f"  provider calls     {provider.calls} ({provider.rejected} answered 429)")
+    if latencies:
+        print(f"  ok latency         p50 {statistics.median(latencies) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms")
+    print(f"  wall time          {seconds:.2f} s")
+
+
+def main():
+    from llm_scheduler import LLMScheduler, ScheduledChatModel
+
+    parser = argparse.ArgumentParser(description="Compare a request burst with and without the LLM scheduler")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--distinct", type=int, default=60, help="Distinct questions in the burst; the rest are repeats")
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated provider latency in seconds")
+    parser.add_argument("--provider-concurrency", type=int, default=4, help="Overlapping calls before the provider answers 429")
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--max-queue", type=int, default=100)
+    parser.add_argument("--queue-timeout", type=float, default=10)
+    args = parser.parse_args()
+
+    direct = FakeRateLimitedChatModel(latency=args.latency, max_concurrency=args.provider_concurrency)
+    results, seconds = asyncio.run(burst(direct, args.requests, args.distinct))
+    report("Direct", results, seconds, direct)
+
+    provider = FakeRateLimitedChatModel(latency=args.latency, max_concurrency=args.provider_concurrency)
+    scheduler = LLMScheduler(
+        max_in_flight=args.max_in_flight,
+        max_queue=args.max_queue,
+        queue_timeout=args.queue_timeout,
+        backoff_seconds=args.latency,
+    )
+    scheduled = ScheduledChatModel(model=provider, scheduler=scheduler)
+    results, seconds = asyncio.run(burst(scheduled, args.requests, args.distinct))
+    report("Scheduled", results, seconds, provider)
+    print(f"  scheduler          {scheduler.stats()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""Stage-level benchmarks of the ChildJournalRAG pipeline.
+
+Runs fully offline: S3 is replaced by moto's in-process stand-in, answers
+come from a fake chat model, and embeddings are deterministic fakes unless
+--embeddings minilm is given (which needs the model in the local
+HuggingFace cache). Each stage is timed over synthetic journals of 12, 60
+and 600 monthly summaries, then run once more under tracemalloc for its
+peak Python memory.
+
+Usage (from pybackend/):
+    python benchmarks/bench_rag.py                      # run, write results, compare to baseline
+    python benchmarks/bench_rag.py --update-baseline    # run and store the results as the new baseline
+    python benchmarks/bench_rag.py --sizes 12 60 --repeats 3 --fail-on-regression
+
+The baseline is benchmarks/baseline.json and is meant to be committed;
+results/ only holds the latest run.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import platform
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+# Offline defaults; must be set before the RAG module creates its clients
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ.setdefault("AWS_ACCESS_KEY", "benchmark")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("AWS_BUCKET_NAME", "benchmark-journals")
+os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+
+DEFAULT_SIZES = (12, 60, 600)
+DEFAULT_RESULTS = HERE / "results" / "latest.json"
+# Outside results/, which is ignored, so the baseline can be committed
+DEFAULT_BASELINE = HERE / "baseline.json"
+QUERY = "How has the child's reading developed over the last months?"
+
+ACTIVITIES = [
+    "started walking without support", "read picture books every evening", "learned to count to ten",
+    "had a mild fever for two days", "played with other children at the park", "began saying short sentences",
+    "tried new vegetables at dinner", "slept through the night", "drew circles with crayons",
+    "visited the grandparents", "built towers from blocks", "sang songs from daycare",
+]
+
+
+def synthetic_journal(size):
+    """Monthly summaries of realistic length (a few chunks each), oldest first."""
+    journal = []
+    for i in range(size):
+        sentences = [
+            f"In this month the child {ACTIVITIES[(i + j) % len(ACTIVITIES)]}."
+            for j in range(6)
+        ]
+        summary = " ".join(sentences * 8) + f" Entry {i}."
+        journal.append({"month": str(i % 12 + 1), "year": str(2015 + i // 12), "summary": summary})
+    return journal
+
+
+def make_embeddings(kind):
+    if kind == "minilm":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+    return DeterministicFakeEmbedding(size=384)
+
+
+def measure(fn, repeats):
+    """Time fn over repeats runs, then once more for its peak Python memory."""
+    # Untimed first call so lazy imports and cold caches don't skew the median
+    fn()
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "min_ms": round(min(timings), 3),
+        "max_ms": round(max(timings), 3),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def run_size(rag, s3, size, repeats):
+    from child_journal_rag import RETRIEVAL_K
+
+    child_id = f"bench-{size}"
+    journal = synthetic_journal(size)
+    s3.put_object(Bucket=rag.bucket_name, Key=f"summaries/{child_id}.json", Body=json.dumps(journal))
+
+    documents = rag.prepare_documents(journal)
+    texts = [doc.page_content for doc in documents]
+    vector_store = rag.create_vector_store(documents)
+    chain = rag.setup_rag_chain(vector_store)
+
+    def cold_load():
+        rag.index_store.delete(child_id)
+        rag.get_vector_store(child_id)
+
+    stages = {
+        "load_journal_from_s3": lambda: rag.load_journal_from_s3(child_id),
+        "prepare_documents": lambda: rag.prepare_documents(journal),
+        "embed_documents": lambda: rag.embeddings.embed_documents(texts),
+        "create_vector_store": lambda: rag.create_vector_store(documents),
+        "mmr_search": lambda: vector_store.max_marginal_relevance_search(QUERY, k=RETRIEVAL_K),
+        "query_journal": lambda: rag.query_journal(chain, QUERY),
+        "aquery_journal": lambda: asyncio.run(rag.aquery_journal(chain, QUERY)),
+        "get_vector_store_cold": cold_load,
+        # The last cold load left the persisted index in place
+        "get_vector_store_warm": lambda: rag.get_vector_store(child_id),
+    }
+
+    results = {"summaries": size, "chunks": len(documents), "stages": {}}
+    for name, fn in stages.items():
+        results["stages"][name] = measure(fn, repeats)
+        print(f"  {size:>4} summaries  {name:<24} {results['stages'][name]['median_ms']:>10.2f} ms")
+    return results
+
+
+def run(sizes, repeats, embeddings_kind):
+    from moto import mock_aws
+    from langchain_core.language_models import FakeListChatModel
+
+    with mock_aws(), tempfile.TemporaryDirectory() as index_dir:
+        import boto3
+        from child_journal_rag import ChildJournalRAG
+        from index_store import FAISSIndexStore
+
+        s3 = boto3.client("s3", region_name=os.environ["AWS_REGION"])
+        s3.create_bucket(Bucket=os.environ["AWS_BUCKET_NAME"])
+
+        rag = ChildJournalRAG(
+            index_store=FAISSIndexStore(index_dir),
+            chat_model=FakeListChatModel(responses=["The child reads picture books every evening."]),
+            embeddings=make_embeddings(embeddings_kind),
+        )
+        try:
+            results = {str(size): run_size(rag, s3, size, repeats) for size in sizes}
+        finally:
+            rag.embeddings.close()
+
+    return {
+        "meta": {
+            "created_at": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "embeddings": embeddings_kind,
+            "repeats": repeats,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Print median-time ratios against the baseline and return the regressions."""
+    if baseline["meta"].get("embeddings") != current["meta"]["embeddings"]:
+        print("Baseline used different embeddings; ratios are not comparable")
+
+    regressions = []
+    print(f"\n{'size':>6} {'stage':<24} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for size, result in current["results"].items():
+        base_result = baseline["results"].get(size)
+        if base_result is None:
+            continue
+        for stage, timing in result["stages"].items():
+            base = base_result["stages"].get(stage)
+            if base is None or not base["median_ms"]:
+                continue
+            ratio = timing["median_ms"] / base["median_ms"]
+            flag = ""
+            if ratio > threshold:
+                flag = "  REGRESSION"
+                regressions.append((size, stage, ratio))
+            print(f"{size:>6} {stage:<24} {base['median_ms']:>10.2f} {timing['median_ms']:>10.2f} {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def write_json(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the journal RAG pipeline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--embeddings", choices=("fake", "minilm"), default="fake")
+    parser.add_argument("--output", type=Path, default=DEFAULT_RESULTS)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Median slowdown ratio counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on regressions")
+    args = parser.parse_args()
+
+    current = run(args.sizes, args.repeats, args.embeddings)
+    write_json(args.output, current)
+    print(f"\nResults written to {args.output}")
+
+    if args.update_baseline:
+        write_json(args.baseline, current)
+        print(f"Baseline updated at {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one")
+        return 0
+
+    with open(args.baseline) as f:
+        regressions = compare(current, json.load(f), args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} stage(s) slower than {args.threshold}x the baseline")
+        return 1 if args.fail_on_regression else 0
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
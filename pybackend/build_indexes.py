@@ -0,0 +1,243 @@
+"""Build the indexes of every child with a journal ahead of their queries.
+
+After a model change or a data migration, indexes would otherwise be
+rebuilt one child at a time inside user requests. This lists summaries/
+in the bucket and builds the indexes in a pool of processes, each
+embedding the chunks of a batch of children at once, and writes them
+where the query services load them (FAISS_INDEX_DIR, or SHARED_INDEX_DIR
+with VECTOR_INDEX_MODE=shared). Finished children are appended to a
+checkpoint file, so an interrupted run picks up where it stopped. A child
+only counts as done for the journal version, embeddings and index mode
+it was built with, so changed journals and model switches are rebuilt
+without --restart:
+
+    python build_indexes.py --workers 4
+    python build_indexes.py --force --embeddings-backend onnx   # after switching models
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT = "index_build_checkpoint.jsonl"
+# Statuses that need no retry when the build is resumed
+DONE_STATUSES = ("built", "current", "missing")
+
+_rag = None
+
+
+def read_checkpoint(path: Path, embeddings_id: str, index_mode: str, force: bool = False) -> Dict[str, str]:
+    """Journal ETag of each child an earlier run already handled with these settings.
+
+    Records of other embeddings or index modes are ignored, and with force
+    so are records of runs that did not force rebuilds. A child's last
+    matching record wins, so a later failure makes it due again.
+    """
+    done: Dict[str, str] = {}
+    if not path.exists():
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by the interruption itself
+                continue
+            if (
+                record.get("embeddings") != embeddings_id
+                or record.get("index_mode") != index_mode
+                or (force and not record.get("forced"))
+            ):
+                continue
+            if record.get("status") in DONE_STATUSES:
+                done[record["child_id"]] = record.get("etag")
+            else:
+                done.pop(record["child_id"], None)
+    return done
+
+
+def todo_children(
+    children: Iterable[Tuple[str, str]], done: Dict[str, str], limit: Optional[int] = None
+) -> Iterator[Tuple[str, str]]:
+    """Children whose current journal version is not in the checkpoint yet."""
+    todo = 0
+    for child_id, etag in children:
+        if done.get(child_id) == etag:
+            continue
+        if limit is not None and todo >= limit:
+            return
+        todo += 1
+        yield child_id, etag
+
+
+def batches(children: Iterable[Tuple[str, str]], size: int) -> Iterator[Dict[str, str]]:
+    batch = {}
+    for child_id, etag in children:
+        batch[child_id] = etag
+        if len(batch) >= size:
+            yield batch
+            batch = {}
+    if batch:
+        yield batch
+
+
+def _init_worker(embeddings_model: str, embeddings_backend: Optional[str], index_mode: Optional[str], threads: int):
+    global _rag
+    # Without a cap every worker would start one math thread per core
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "ONNX_INTRA_OP_THREADS"):
+        os.environ[name] = str(threads)
+    from child_journal_rag import ChildJournalRAG
+
+    _rag = ChildJournalRAG(
+        embeddings_model=embeddings_model,
+        embeddings_backend=embeddings_backend,
+        index_mode=index_mode,
+    )
+
+
+def _build_batch(etags: Dict[str, str], force: bool) -> Dict[str, Dict[str, str]]:
+    try:
+        results = _rag.build_indexes(list(etags), etags=etags, force=force)
+    except Exception as e:
+        # One bad batch must not take the whole run down; its children are retried on resume
+        logger.exception("Index build batch failed")
+        results = {child_id: f"failed: {e}" for child_id in etags}
+    return {child_id: {"status": status, "etag": etags[child_id]} for child_id, status in results.items()}
+
+
+def run(
+    workers: int,
+    batch_size: int,
+    checkpoint: Path,
+    force: bool = False,
+    limit: Optional[int] = None,
+    embeddings_model: str = "all-MiniLM-L6-v2",
+    embeddings_backend: Optional[str] = None,
+    index_mode: Optional[str] = None,
+) -> Dict[str, int]:
+    """Build the indexes of every child in the bucket not yet in the checkpoint.
+
+    Args:
+        workers: Processes building indexes, each with its own embeddings model
+        batch_size: Children whose chunks a worker embeds together
+        checkpoint: JSONL file recording each finished child
+        force: Rebuild indexes that are already current
+        limit: Stop after this many children, for trial runs
+        embeddings_model: Embeddings model the indexes are built with
+        embeddings_backend: 'huggingface' or 'onnx', defaults to EMBEDDINGS_BACKEND
+        index_mode: 'per_child' or 'shared', defaults to VECTOR_INDEX_MODE
+
+    Returns:
+        Number of children per status, plus the elapsed seconds
+    """
+    from child_journal_rag import embeddings_identifier
+    from journal_loader import S3JournalLoader
+
+    # Shared index shards lock their files, so workers may write to the same shards
+    index_mode = (index_mode or os.getenv("VECTOR_INDEX_MODE", "per_child")).lower()
+
+    backend = (embeddings_backend or os.getenv("EMBEDDINGS_BACKEND", "huggingface")).lower()
+    # Written with every record, so the checkpoint only resumes builds of the same kind
+    settings = {"embeddings": embeddings_identifier(backend, embeddings_model), "index_mode": index_mode, "forced": force}
+    done = read_checkpoint(checkpoint, settings["embeddings"], index_mode, force)
+    if done:
+        logger.info(f"Resuming: {len(done)} children already done in {checkpoint}")
+    children = todo_children(S3JournalLoader(max_pool_connections=4).list_children(), done, limit)
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    counts: Dict[str, int] = {}
+    handled = 0
+    started = time.monotonic()
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        # Forked workers would inherit the parent's S3 client and threads
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(embeddings_model, embeddings_backend, index_mode, threads),
+    )
+    with pool, open(checkpoint, "a") as log:
+        # Listing pages are consumed as batches finish, so the queue stays short
+        pending = set()
+        for batch in batches(children, batch_size):
+            if len(pending) >= workers * 2:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                handled += _record(finished, log, counts, settings)
+                _report_progress(handled, started)
+            pending.add(pool.submit(_build_batch, batch, force))
+        for future in pending:
+            handled += _record([future], log, counts, settings)
+        _report_progress(handled, started)
+
+    counts["seconds"] = round(time.monotonic() - started, 1)
+    return counts
+
+
+def _record(futures, log, counts: Dict[str, int], settings: Dict) -> int:
+    handled = 0
+    for future in futures:
+        for child_id, record in future.result().items():
+            status = record["status"]
+            if status.startswith("failed"):
+                logger.warning(f"Child {child_id}: {status}")
+                status = "failed"
+            counts[status] = counts.get(status, 0) + 1
+            log.write(json.dumps({"child_id": child_id, **record, **settings}) + "\n")
+            handled += 1
+    log.flush()
+    return handled
+
+
+def _report_progress(handled: int, started: float):
+    seconds = time.monotonic() - started
+    logger.info(f"{handled} children in {seconds:.1f}s ({handled / seconds if seconds else 0:.2f} children/s)")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build the indexes of every child with a journal in S3")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=16, help="Children embedded together per worker task")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="Progress file to resume from")
+    parser.add_argument("--restart", action="store_true", help="Ignore the progress of earlier runs")
+    parser.add_argument("--force", action="store_true", help="Rebuild indexes that are already current")
+    parser.add_argument("--limit", type=int, default=None, help="Build at most this many children")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--embeddings-backend", default=None, choices=("huggingface", "onnx"))
+    parser.add_argument("--index-mode", default=None, choices=("per_child", "shared"))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    checkpoint = Path(args.checkpoint)
+    if args.restart and checkpoint.exists():
+        checkpoint.unlink()
+
+    counts = run(
+        workers=max(1, args.workers),
+        batch_size=max(1, args.batch_size),
+        checkpoint=checkpoint,
+        force=args.force,
+        limit=args.limit,
+        embeddings_model=args.model,
+        embeddings_backend=args.embeddings_backend,
+        index_mode=args.index_mode,
+    )
+    seconds = counts.pop("seconds")
+    handled = sum(counts.values())
+    print(json.dumps(counts))
+    print(f"{handled} children in {seconds:.1f}s ({handled / seconds if seconds else 0:.2f} children/s)")
+    return 1 if counts.get("failed") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
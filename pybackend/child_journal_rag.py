@@ -1,74 +1,469 @@
-import json
-from typing import List, Dict
+import time
+import hashlib
+import logging
+import functools
+from typing import TYPE_CHECKING, AsyncIterator, Iterable, List, Dict, Optional, Set, Tuple
 import os
 from dotenv import load_dotenv
 from pathlib import Path
-import boto3
-from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.vectorstores import VectorStore
 
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import ChatPromptTemplate
+from index_store import FAISSIndexStore
+from journal_loader import JournalLoadError, JournalNotFound, S3JournalLoader
+from llm_scheduler import PRIORITY_BACKGROUND, LLMOverloaded, LLMScheduler, ScheduledChatModel
+from shared_index import ChildVectorStore, SharedVectorIndex
+from retrievers import MMRRetriever, known_query_embedding
+from time_retrieval import TimeAwareRetriever, forget_period_index, parse_date_range
+from embedding_batcher import BatchingEmbeddings, LazyEmbeddings
+from session_memory import SessionHistory, SessionMemoryStore, session_summaries_enabled
+from semantic_cache import SemanticAnswerCache
+from metrics import STAGE_SECONDS, StageTimingCallback, record_lookup, stage
+
+# langchain_community, langchain.chains, the Gemini client and
+# sentence-transformers take seconds to import, so they are imported where
+# first used; warm_up() pulls them in off the request path.
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
 
 load_dotenv()
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-pro",
-    google_api_key=os.getenv("GEMINI_API_KEY"),
-    temperature=0.7
-)
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def get_default_llm() -> BaseChatModel:
+    """Create the shared Gemini client on first use."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model="gemini-pro",
+        google_api_key=os.getenv("GEMINI_API_KEY"),
+        temperature=0.7
+    )
+
+
+def __getattr__(name: str):
+    # `child_journal_rag.llm` used to be created at import; keep it reachable
+    if name == "llm":
+        return get_default_llm()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def load_huggingface_embeddings(model_name: str) -> Embeddings:
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+
+def load_onnx_embeddings(model_name: str) -> Embeddings:
+    from onnx_embeddings import OnnxEmbeddings, default_model_dir
+
+    return OnnxEmbeddings(model_dir=str(default_model_dir(model_name)))
+
+
+EMBEDDINGS_BACKENDS = ("huggingface", "onnx")
+
+
+def load_embeddings(backend: str, model_name: str) -> Embeddings:
+    """Load embeddings_model with one of EMBEDDINGS_BACKENDS."""
+    if backend == "onnx":
+        return load_onnx_embeddings(model_name)
+    return load_huggingface_embeddings(model_name)
+
+
+def embeddings_identifier(backend: str, model_name: str) -> str:
+    """Identify the vectors load_embeddings(backend, model_name) produces, without loading it."""
+    if backend == "onnx":
+        from onnx_embeddings import default_model_dir, model_identifier
+
+        # Includes the model file, so int8 and fp32 indexes are kept apart
+        return model_identifier(default_model_dir(model_name))
+    return f"{backend}:{model_name}"
+
+# Create a prompt template compatible with Gemini
+ANSWER_PROMPT = ChatPromptTemplate.from_messages([
+    ("human", """Here is some context to help answer the question:
+            {context}
+            
+            Question: {question}
+            
+            Please answer based on the context provided. If you can't find the answer in the context, just say you don't know.""")
+])
+
+# Number of chunks retrieved (by MMR) as context for an answer
+RETRIEVAL_K = 3
+
+# per_child: one FAISS index per child; shared: all children in one sharded index
+INDEX_MODES = ("per_child", "shared")
+
+# mmr: search the whole index; time_aware: restrict to the months a question names
+RETRIEVAL_MODES = ("mmr", "time_aware")
+
+def journal_entry_key(entry: Dict) -> str:
+    """Identify a monthly summary by its month/year and a hash of its text.
+
+    The journal is append-only, but the same month can be summarized more
+    than once, so month and year alone are not unique.
+    """
+    content_hash = hashlib.sha256(entry['summary'].encode('utf-8')).hexdigest()[:16]
+    return f"{entry['year']}-{entry['month']}-{content_hash}"
+
 
 class ChildJournalRAG:
-    def __init__(self, embeddings_model: str = "all-MiniLM-L6-v2"):
+    def __init__(
+        self,
+        embeddings_model: str = "all-MiniLM-L6-v2",
+        index_store: Optional[FAISSIndexStore] = None,
+        chat_model: Optional[BaseChatModel] = None,
+        embeddings: Optional[Embeddings] = None,
+        embeddings_backend: Optional[str] = None,
+        index_mode: Optional[str] = None,
+        journal_loader: Optional[S3JournalLoader] = None,
+        retrieval_mode: Optional[str] = None
+    ):
         """Initialize the RAG system for child journal analysis.
         
         Args:
-            bucket_name: Name of the S3 bucket containing journal data
             embeddings_model: Name of the HuggingFace embeddings model to use
+            index_store: On-disk store for built indexes, defaults to FAISS_INDEX_DIR
+            chat_model: Chat model answering questions, defaults to the shared Gemini client
+            embeddings: Embeddings model to use instead of loading embeddings_model
+            embeddings_backend: How embeddings_model is run, 'huggingface' (PyTorch) or 'onnx'
+                (exported with onnx_embeddings.py); defaults to EMBEDDINGS_BACKEND or 'huggingface'
+            index_mode: 'per_child' FAISS indexes or one 'shared' sharded index filtered by child,
+                defaults to VECTOR_INDEX_MODE or 'per_child'
+            journal_loader: Loader for the journals in S3, defaults to a pooled client on AWS_BUCKET_NAME
+            retrieval_mode: 'mmr' over the whole index or 'time_aware' pre-filtering by the months
+                a question names, defaults to RETRIEVAL_MODE or 'mmr'
         """
-        self.s3 = boto3.client(
-            's3',
-            aws_access_key_id=os.getenv('AWS_ACCESS_KEY'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-            region_name=os.getenv('AWS_REGION')
+        self.journals = journal_loader or S3JournalLoader()
+        self.s3 = self.journals.s3
+        self.bucket_name = self.journals.bucket_name
+        self._chat_model = chat_model
+        # Every LLM call queues here for a slot, bounded by LLM_* settings
+        self.llm_scheduler = LLMScheduler.from_env()
+        backend = (embeddings_backend or os.getenv("EMBEDDINGS_BACKEND", "huggingface")).lower()
+        if backend not in EMBEDDINGS_BACKENDS:
+            raise ValueError(f"Unknown embeddings backend {backend!r}, expected one of {', '.join(EMBEDDINGS_BACKENDS)}")
+        # Persisted indexes are only reused with the embeddings they were built with
+        self.embeddings_id = (
+            embeddings_identifier(backend, embeddings_model) if embeddings is None
+            else getattr(embeddings, "identifier", None) or type(embeddings).__name__
+        )
+        # Shared across requests so concurrent queries and index builds batch together;
+        # the model itself is loaded on first use or by warm_up()
+        self.embeddings = BatchingEmbeddings(
+            embeddings or LazyEmbeddings(functools.partial(load_embeddings, backend, embeddings_model))
+        )
+        # Conversation history per child/session instead of one shared buffer
+        self.sessions = SessionMemoryStore.from_env(
+            summarizer=self._background_llm() if session_summaries_enabled() else None
         )
-        self.bucket_name = os.getenv("AWS_BUCKET_NAME")
-        self.embeddings = HuggingFaceEmbeddings(model_name=embeddings_model)
-        self.text_splitter = RecursiveCharacterTextSplitter(
+        # Answers to earlier standalone questions, per child and journal version
+        self.answer_cache = SemanticAnswerCache.from_env()
+        self.index_store = index_store or FAISSIndexStore(embeddings_id=self.embeddings_id)
+
+        self.index_mode = (index_mode or os.getenv("VECTOR_INDEX_MODE", "per_child")).lower()
+        if self.index_mode not in INDEX_MODES:
+            raise ValueError(f"Unknown index mode {self.index_mode!r}, expected one of {', '.join(INDEX_MODES)}")
+        self.shared_index = (
+            SharedVectorIndex.from_env(embeddings_id=self.embeddings_id) if self.index_mode == "shared" else None
+        )
+        self.retrieval_mode = (retrieval_mode or os.getenv("RETRIEVAL_MODE", "mmr")).lower()
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {self.retrieval_mode!r}, expected one of {', '.join(RETRIEVAL_MODES)}")
+
+    @functools.cached_property
+    def llm(self) -> BaseChatModel:
+        model = self._chat_model or get_default_llm()
+        if self.llm_scheduler is None:
+            return model
+        return ScheduledChatModel(model=model, scheduler=self.llm_scheduler)
+
+    def _background_llm(self) -> BaseChatModel:
+        # Summaries can wait; questions from parents go first
+        if isinstance(self.llm, ScheduledChatModel):
+            return self.llm.with_priority(PRIORITY_BACKGROUND)
+        return self.llm
+
+    @functools.cached_property
+    def text_splitter(self):
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        return RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200,
             separators=["\n\n", "\n", " ", ""]
         )
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
+
+    def warm_up(self):
+        """Load the embedding model, chat client and chain classes before the first request.
+
+        Blocking; run it on an executor at startup so the service can accept
+        liveness probes meanwhile.
+        """
+        with stage("warmup"):
+            # Loads the model and runs one forward pass through the batcher
+            self.embeddings.embed_query("warm up")
+            self.llm
+            self.text_splitter
+            from langchain.chains import ConversationalRetrievalChain  # noqa: F401
+            from langchain_community.vectorstores import FAISS  # noqa: F401
         
-    def load_journal_from_s3(self, child_id: str) -> Dict:
+    def load_journal_from_s3(self, child_id: str) -> List[Dict]:
         """Load a child's journal from S3.
         
         Args:
             child_id: Unique identifier for the child
             
         Returns:
-            Dict containing the journal data
+            List of the journal's monthly summaries
+
+        Raises:
+            JournalNotFound: The child has no journal
+            JournalLoadError: The journal could not be read
         """
+        journal_data, _ = self._load_journal_object(child_id)
+        return journal_data
+
+    def _load_journal_object(self, child_id: str) -> Tuple[List[Dict], str]:
+        """Load a child's journal and the ETag of the object it was read from."""
+        with stage("s3_load"):
+            return self.journals.load(child_id)
+
+    def get_journal_etag(self, child_id: str) -> Optional[str]:
+        """Return the ETag of a child's journal without downloading it, or None if it has none."""
         try:
-            print(self.bucket_name)
-            response = self.s3.get_object(
-                Bucket=self.bucket_name,
-                Key=f"summaries/{child_id}.json"
-            )
-            journal_data = json.loads(response['Body'].read().decode('utf-8'))
-            return journal_data
-        except Exception as e:
-            print(f"Error loading journal: {e}")
-            return {}
+            with stage("s3_head"):
+                return self.journals.head(child_id)
+        except JournalNotFound:
+            return None
+
+    def prefetch_journals(self, child_ids: List[str]) -> Dict:
+        """Download several children's journals concurrently ahead of their first query."""
+        with stage("s3_prefetch"):
+            return self.journals.prefetch(child_ids)
+
+    def get_vector_store(self, child_id: str) -> Optional[VectorStore]:
+        """Return a child's vector store, reusing the persisted index when current.
+        
+        The journal is only downloaded when no index has been persisted for its
+        current ETag, and then only its new or changed entries are embedded.
+        
+        Args:
+            child_id: Unique identifier for the child
+            
+        Returns:
+            FAISS vector store (a view of the shared index in shared mode), or None if the child has no journal
+        """
+        if self.shared_index is not None:
+            return self.get_shared_vector_store(child_id)
+
+        etag = self.get_journal_etag(child_id)
+        if etag:
+            with stage("index_load"):
+                vector_store = self.index_store.load(child_id, etag, self.embeddings)
+            record_lookup("persisted_index", vector_store is not None)
+            if vector_store is not None:
+                self._set_journal_version(child_id, etag)
+                return vector_store
+
+        try:
+            journal_data, etag = self._load_journal_object(child_id)
+        except JournalNotFound:
+            return None
+        if not journal_data:
+            return None
+
+        # Journals only grow, so patch the previous index instead of re-embedding all of it
+        vector_store = self.index_store.load_latest(child_id, self.embeddings)
+        if vector_store is not None:
+            with stage("index_update"):
+                vector_store = self.update_vector_store(vector_store, journal_data)
+        else:
+            documents = self.prepare_documents(journal_data)
+            vector_store = self.create_vector_store(documents)
+        if etag:
+            with stage("index_save"):
+                self.index_store.save(child_id, etag, vector_store)
+        self._set_journal_version(child_id, etag)
+        return vector_store
+
+    def get_shared_vector_store(self, child_id: str) -> Optional[ChildVectorStore]:
+        """Return a child's view of the shared index, syncing it with the journal first.
+
+        The view holds no vectors itself, so it costs next to nothing to cache
+        and a warm child only needs the journal's ETag checked.
+
+        Args:
+            child_id: Unique identifier for the child
+
+        Returns:
+            Vector store restricted to the child, or None if the child has no journal
+        """
+        etag = self.get_journal_etag(child_id)
+        current = etag is not None and self.shared_index.version(child_id) == etag
+        record_lookup("shared_index", current)
+        if not current:
+            try:
+                journal_data, etag = self._load_journal_object(child_id)
+            except JournalNotFound:
+                return None
+            if not journal_data:
+                return None
+            with stage("index_update"):
+                self.sync_shared_index(child_id, journal_data)
+            self.shared_index.set_version(child_id, etag)
+        self._set_journal_version(child_id, etag)
+        return ChildVectorStore(self.shared_index, child_id, self.embeddings)
+
+    def sync_shared_index(self, child_id: str, journal_data: List[Dict]):
+        """Bring a child's chunks in the shared index in line with the journal.
+
+        Like update_vector_store, only new or changed entries are embedded and
+        chunks of entries no longer in the journal are removed.
+        """
+        stale_keys, new_entries = self._shared_index_changes(child_id, journal_data)
+
+        removed = self.shared_index.remove(child_id, entry_keys=stale_keys) if stale_keys else 0
+        if new_entries:
+            documents = self.prepare_documents(new_entries)
+            with stage("embed"):
+                vectors = self.embeddings.embed_documents([doc.page_content for doc in documents])
+            self.shared_index.add(child_id, documents, vectors)
+
+        logger.info(f"Shared index update for child {child_id}: {len(new_entries)} entries added, {removed} chunks removed")
+
+    def _shared_index_changes(self, child_id: str, journal_data: List[Dict]) -> Tuple[Set[str], List[Dict]]:
+        """Entry keys to drop from and journal entries to add to a child's part of the shared index."""
+        indexed = set(self.shared_index.entry_keys(child_id))
+        wanted = {journal_entry_key(entry): entry for entry in journal_data}
+        stale_keys = indexed - wanted.keys()
+        new_entries = [entry for entry_key, entry in wanted.items() if entry_key not in indexed]
+        return stale_keys, new_entries
+
+    def build_indexes(
+        self,
+        child_ids: Iterable[str],
+        etags: Optional[Dict[str, str]] = None,
+        force: bool = False
+    ) -> Dict[str, str]:
+        """Build the persisted indexes of several children ahead of their queries.
+
+        Used by build_indexes.py after a model change or data migration. The
+        chunks of every child that needs building are embedded in one batch
+        rather than child by child, then written where get_vector_store looks
+        for them: the index store, or the shared index in shared mode.
+
+        Args:
+            child_ids: Children to build
+            etags: Journal ETags already known from listing the bucket; children
+                missing here are looked up with a HEAD request
+            force: Rebuild even indexes that are current, e.g. after re-exporting a model
+
+        Returns:
+            Per child 'built', 'current' (left as is), 'missing' (no journal) or 'failed: <reason>'
+        """
+        etags = etags or {}
+        results: Dict[str, str] = {}
+        # (child_id, etag, chunks to add, entry keys to drop) per child to build
+        pending: List[Tuple[str, str, List[Document], Set[str]]] = []
+
+        for child_id in child_ids:
+            try:
+                etag = etags.get(child_id) or self.get_journal_etag(child_id)
+                if etag is None:
+                    results[child_id] = "missing"
+                    continue
+                if not force and self._index_current(child_id, etag):
+                    results[child_id] = "current"
+                    continue
+                journal_data, etag = self._load_journal_object(child_id)
+            except JournalNotFound:
+                results[child_id] = "missing"
+                continue
+            except JournalLoadError as e:
+                results[child_id] = f"failed: {e}"
+                continue
+            if not journal_data:
+                results[child_id] = "missing"
+                continue
+
+            stale_keys: Set[str] = set()
+            if self.shared_index is None:
+                entries = journal_data
+            elif force:
+                # Rebuilt from scratch, so every chunk of the child goes
+                self.shared_index.remove(child_id)
+                entries = journal_data
+            else:
+                stale_keys, entries = self._shared_index_changes(child_id, journal_data)
+            pending.append((child_id, etag, self.prepare_documents(entries) if entries else [], stale_keys))
+
+        texts = [doc.page_content for _, _, documents, _ in pending for doc in documents]
+        with stage("embed"):
+            vectors = self.embeddings.embed_documents(texts) if texts else []
+
+        offset = 0
+        for child_id, etag, documents, stale_keys in pending:
+            child_vectors = vectors[offset:offset + len(documents)]
+            offset += len(documents)
+            try:
+                if self.shared_index is not None:
+                    if stale_keys:
+                        self.shared_index.remove(child_id, entry_keys=stale_keys)
+                    if documents:
+                        self.shared_index.add(child_id, documents, child_vectors)
+                    self.shared_index.set_version(child_id, etag)
+                else:
+                    with stage("index_save"):
+                        self.index_store.save(child_id, etag, self._faiss_from_vectors(documents, child_vectors))
+            except Exception as e:
+                results[child_id] = f"failed: {e}"
+                continue
+            results[child_id] = "built"
+        return results
+
+    def recent_children(self, limit: int) -> List[str]:
+        """Child ids worth preloading, most recent first.
+
+        Per-child FAISS indexes are ranked by last use; the shared index only
+        records when each child was last synced, so it ranks by that instead.
+        """
+        if self.shared_index is not None:
+            return self.shared_index.recent_children(limit)
+        return self.index_store.recent_children(limit)
+
+    def _index_current(self, child_id: str, etag: str) -> bool:
+        if self.shared_index is not None:
+            return self.shared_index.version(child_id) == etag
+        return self.index_store.has(child_id, etag)
+
+    def _set_journal_version(self, child_id: str, etag: Optional[str]):
+        # Cached answers from an older journal must not outlive it
+        if self.answer_cache is not None:
+            self.answer_cache.set_version(child_id, etag)
+
+    def invalidate_child(self, child_id: str):
+        """Forget cached answers for a child, e.g. after their journal changed."""
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(child_id)
+
+    def _use_answer_cache(self, child_id: Optional[str], session: Optional[SessionHistory], query: str) -> bool:
+        # Follow-up questions depend on the conversation, so only standalone
+        # questions are answered from or stored in the cache
+        return (
+            self.answer_cache is not None
+            and child_id is not None
+            and (session is None or not session.turns)
+            # Questions about different months embed almost alike, so dated
+            # questions must not share answers when retrieval depends on the date
+            and not (self.retrieval_mode == "time_aware" and parse_date_range(query) is not None)
+        )
 
     def prepare_documents(self, journal_data: List[Dict]) -> List[Document]:
         """Convert journal data into documents for the vector store.
@@ -79,25 +474,37 @@ class ChildJournalRAG:
         Returns:
             List of Document objects
         """
+        with stage("split"):
+            return self._split_entries(journal_data)
+
+    def _split_entries(self, journal_data: List[Dict]) -> List[Document]:
         documents = []
+        seen_keys = set()
         
         for entry in journal_data:
-            # Create a document with the monthly summary
-            doc = Document(
-                page_content=entry['summary'],
-                metadata={
-                    "month": entry['month'],
-                    "year": entry['year'],
-                    "type": "monthly_summary"
-                }
-            )
-            documents.append(doc)
+            entry_key = journal_entry_key(entry)
+            if entry_key in seen_keys:
+                continue
+            seen_keys.add(entry_key)
+
+            # Split the monthly summary into chunks with stable ids, so the
+            # index can later be updated per entry instead of rebuilt
+            chunks = self.text_splitter.split_text(entry['summary'])
+            for i, chunk in enumerate(chunks):
+                documents.append(Document(
+                    id=f"{entry_key}:{i}",
+                    page_content=chunk,
+                    metadata={
+                        "month": entry['month'],
+                        "year": entry['year'],
+                        "type": "monthly_summary",
+                        "entry_key": entry_key
+                    }
+                ))
             
-        # Split documents into smaller chunks
-        split_docs = self.text_splitter.split_documents(documents)
-        return split_docs
+        return documents
 
-    def create_vector_store(self, documents: List[Document]) -> FAISS:
+    def create_vector_store(self, documents: List[Document]) -> "FAISS":
         """Create a FAISS vector store from the documents.
         
         Args:
@@ -106,47 +513,241 @@ class ChildJournalRAG:
         Returns:
             FAISS vector store
         """
-        vector_store = FAISS.from_documents(documents, self.embeddings)
-        return vector_store
+        # Embedded separately so the two stages show up apart in the metrics
+        texts = [doc.page_content for doc in documents]
+        with stage("embed"):
+            vectors = self.embeddings.embed_documents(texts)
+        return self._faiss_from_vectors(documents, vectors)
+
+    def _faiss_from_vectors(self, documents: List[Document], vectors: List[List[float]]) -> "FAISS":
+        from langchain_community.vectorstores import FAISS
+
+        with stage("index_build"):
+            return FAISS.from_embeddings(
+                list(zip([doc.page_content for doc in documents], vectors)),
+                self.embeddings,
+                metadatas=[doc.metadata for doc in documents],
+                ids=[doc.id for doc in documents]
+            )
 
-    def setup_rag_chain(self, vector_store: FAISS):
-        """Set up the RAG chain with Gemini LLM."""
+    def update_vector_store(self, vector_store: "FAISS", journal_data: List[Dict]) -> "FAISS":
+        """Bring an existing vector store in line with the journal.
         
-        # Create a prompt template compatible with Gemini
-        prompt = ChatPromptTemplate.from_messages([
-            ("human", """Here is some context to help answer the question:
-            {context}
-            
-            Question: {question}
+        Only entries that are new or whose text changed are embedded; chunks
+        of entries no longer in the journal are removed.
+        
+        Args:
+            vector_store: Writable FAISS vector store built by this class
+            journal_data: List of dictionaries containing journal entries
             
-            Please answer based on the context provided. If you can't find the answer in the context, just say you don't know.""")
-        ])
+        Returns:
+            The updated FAISS vector store
+        """
+        indexed: Dict[str, List[str]] = {}
+        for doc_id in vector_store.index_to_docstore_id.values():
+            doc = vector_store.docstore.search(doc_id)
+            entry_key = doc.metadata.get("entry_key") if isinstance(doc, Document) else None
+            indexed.setdefault(entry_key, []).append(doc_id)
+
+        wanted = {journal_entry_key(entry): entry for entry in journal_data}
+        stale_ids = [
+            doc_id
+            for entry_key, doc_ids in indexed.items() if entry_key not in wanted
+            for doc_id in doc_ids
+        ]
+        new_entries = [entry for entry_key, entry in wanted.items() if entry_key not in indexed]
+
+        if stale_ids:
+            vector_store.delete(stale_ids)
+        if new_entries:
+            documents = self.prepare_documents(new_entries)
+            vector_store.add_documents(documents, ids=[doc.id for doc in documents])
+        if stale_ids or new_entries:
+            # Deleting renumbers the FAISS positions the period index points at
+            forget_period_index(vector_store)
+
+        logger.info(f"Index update: {len(new_entries)} entries added, {len(stale_ids)} chunks removed")
+        return vector_store
+
+    def get_retriever(self, vector_store: VectorStore):
+        """Retriever for a child's vector store in the configured retrieval mode."""
+        if self.retrieval_mode == "time_aware":
+            return TimeAwareRetriever(vector_store=vector_store, k=RETRIEVAL_K)
+        return MMRRetriever(vector_store=vector_store, k=RETRIEVAL_K)
+
+    def setup_rag_chain(self, vector_store: VectorStore):
+        """Set up the RAG chain with Gemini LLM.
+        
+        The chain holds no memory; chat history is passed per call from the
+        caller's session, so one chain can serve every session of a child.
+        """
+        from langchain.chains import ConversationalRetrievalChain
         
         chain = ConversationalRetrievalChain.from_llm(
-            llm=llm,
-            retriever=vector_store.as_retriever(
-                search_type="mmr",
-                search_kwargs={"k": 3}
-            ),
-            memory=self.memory,
+            llm=self.llm,
+            retriever=self.get_retriever(vector_store),
             return_source_documents=True,
-            combine_docs_chain_kwargs={"prompt": prompt},
-            memory_key="chat_history",
+            combine_docs_chain_kwargs={"prompt": ANSWER_PROMPT},
             output_key="answer"
         )
         
         return chain
 
-    def query_journal(self, chain, query: str) -> Dict:
-        """Query the journal using the RAG chain."""
+    def query_journal(
+        self,
+        chain,
+        query: str,
+        session: Optional[SessionHistory] = None,
+        child_id: Optional[str] = None
+    ) -> Dict:
+        """Query the journal using the RAG chain.
+        
+        Args:
+            chain: Chain from setup_rag_chain
+            query: The parent's question
+            session: Conversation history to condense the question against and extend
+            child_id: Child the chain belongs to; enables the semantic answer cache
+        """
+        try:
+            embedding = None
+            if self._use_answer_cache(child_id, session, query):
+                with stage("embed_query"):
+                    embedding = self.embeddings.embed_query(query)
+                cached = self.answer_cache.lookup(child_id, embedding)
+                if cached is not None:
+                    if session is not None:
+                        session.add_turn(query, cached["answer"])
+                    return cached
+
+            # On a cache miss the retriever searches with the embedding computed above
+            with known_query_embedding(query, embedding):
+                result = chain.invoke(
+                    {"question": query, "chat_history": session.messages() if session else []},
+                    config={"callbacks": [StageTimingCallback()]}
+                )
+            if isinstance(result, dict) and "answer" in result:
+                if session is not None:
+                    session.add_turn(query, result["answer"])
+                response = {
+                    "answer": result["answer"],
+                    "sources": [doc.metadata for doc in result.get("source_documents", [])]
+                }
+                if embedding is not None:
+                    self.answer_cache.store(child_id, embedding, response)
+                return response
+            return {"error": "Unexpected response format"}
+        except LLMOverloaded:
+            # Shed load visibly so the service can answer 503 instead of an error body
+            raise
+        except Exception as e:
+            print(f"Error during query: {e}")
+            return {"error": str(e)}
+
+    async def aquery_journal(
+        self,
+        chain,
+        query: str,
+        session: Optional[SessionHistory] = None,
+        child_id: Optional[str] = None
+    ) -> Dict:
+        """Query the journal without blocking the event loop.
+        
+        Uses the chain's async path: the question is embedded through the
+        batching embedder and Gemini is called with its async client.
+        """
         try:
-            result = chain.invoke({"question": query})
+            embedding = None
+            if self._use_answer_cache(child_id, session, query):
+                with stage("embed_query"):
+                    embedding = await self.embeddings.aembed_query(query)
+                cached = self.answer_cache.lookup(child_id, embedding)
+                if cached is not None:
+                    if session is not None:
+                        await session.aadd_turn(query, cached["answer"])
+                    return cached
+
+            with known_query_embedding(query, embedding):
+                result = await chain.ainvoke(
+                    {"question": query, "chat_history": session.messages() if session else []},
+                    config={"callbacks": [StageTimingCallback()]}
+                )
             if isinstance(result, dict) and "answer" in result:
-                return {
+                if session is not None:
+                    await session.aadd_turn(query, result["answer"])
+                response = {
                     "answer": result["answer"],
                     "sources": [doc.metadata for doc in result.get("source_documents", [])]
                 }
+                if embedding is not None:
+                    self.answer_cache.store(child_id, embedding, response)
+                return response
             return {"error": "Unexpected response format"}
+        except LLMOverloaded:
+            # Shed load visibly so the service can answer 503 instead of an error body
+            raise
         except Exception as e:
             print(f"Error during query: {e}")
-            return {"error": str(e)}
\ No newline at end of file
+            return {"error": str(e)}
+
+    async def astream_answer(
+        self,
+        vector_store: VectorStore,
+        query: str,
+        session: Optional[SessionHistory] = None,
+        child_id: Optional[str] = None
+    ) -> AsyncIterator[Dict]:
+        """Answer a question, yielding the sources first and then answer tokens.
+        
+        Retrieval and prompt match setup_rag_chain, so the streamed answer is
+        the one /query would give for a standalone question. Closing the
+        iterator early stops the LLM stream and with it token generation.
+        
+        Args:
+            vector_store: The child's FAISS vector store
+            query: The parent's question
+            session: Conversation history the completed answer is added to
+            child_id: Child the vector store belongs to; enables the semantic answer cache
+            
+        Yields:
+            {"event": "sources", "data": [metadata, ...]} once, then
+            {"event": "token", "data": text} per streamed chunk
+        """
+        embedding = None
+        if self._use_answer_cache(child_id, session, query):
+            with stage("embed_query"):
+                embedding = await self.embeddings.aembed_query(query)
+            cached = self.answer_cache.lookup(child_id, embedding)
+            if cached is not None:
+                yield {"event": "sources", "data": cached["sources"]}
+                yield {"event": "token", "data": cached["answer"]}
+                if session is not None:
+                    await session.aadd_turn(query, cached["answer"])
+                return
+
+        with stage("retrieval"), known_query_embedding(query, embedding):
+            docs = await self.get_retriever(vector_store).ainvoke(query)
+        sources = [doc.metadata for doc in docs]
+        yield {"event": "sources", "data": sources}
+
+        messages = ANSWER_PROMPT.format_messages(
+            context="\n\n".join(doc.page_content for doc in docs),
+            question=query
+        )
+        answer = []
+        # Timed by hand: a span must not stay current across the yields below
+        started = time.perf_counter()
+        try:
+            async for chunk in self.llm.astream(messages):
+                if chunk.content:
+                    if not answer:
+                        STAGE_SECONDS.labels("llm_first_token").observe(time.perf_counter() - started)
+                    answer.append(chunk.content)
+                    yield {"event": "token", "data": chunk.content}
+        finally:
+            STAGE_SECONDS.labels("llm").observe(time.perf_counter() - started)
+
+        # Only completed answers become part of the conversation and the cache
+        if session is not None:
+            await session.aadd_turn(query, "".join(answer))
+        if embedding is not None:
+            self.answer_cache.store(child_id, embedding, {"answer": "".join(answer), "sources": sources})
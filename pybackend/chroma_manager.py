@@ -1,6 +1,10 @@
 import chromadb
 import os
+import time
+import random
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from chromadb.config import Settings
 
 # Configure logging
@@ -10,28 +14,78 @@ class ChromaManager:
     def __init__(self):
         self.chroma_host = os.environ.get("CHROMA_HOST", "localhost")
         self.chroma_port = int(os.environ.get("CHROMA_PORT", 8000))
+        self.pool_size = int(os.environ.get("CHROMA_POOL_SIZE", 16))
+        self.max_retries = int(os.environ.get("CHROMA_MAX_RETRIES", 3))
+        self.retry_backoff = float(os.environ.get("CHROMA_RETRY_BACKOFF", 0.2))
         self.client = self._create_client()
+        # Collection handles are reused so each operation is a single round trip
+        self._collections = {}
+        self._collections_lock = threading.Lock()
+        # Bulk operations send their chunks concurrently over the pooled connections
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="chroma")
 
     def _create_client(self):
         try:
-            client = chromadb.HttpClient(host=self.chroma_host, port=self.chroma_port, settings=Settings(
-                chroma_client_auth_provider="chromadb.auth.basic.BasicAuthClientProvider",
-                chroma_client_auth_credentials="username:password"
-            ))
+            settings = {
+                "chroma_client_auth_provider": "chromadb.auth.basic.BasicAuthClientProvider",
+                "chroma_client_auth_credentials": "username:password"
+            }
+            # Keep-alive connection pool, on chromadb versions that support tuning it
+            if "chroma_http_max_connections" in getattr(Settings, "model_fields", getattr(Settings, "__fields__", {})):
+                settings["chroma_http_max_connections"] = self.pool_size
+                settings["chroma_http_keepalive_secs"] = 60.0
+            client = chromadb.HttpClient(host=self.chroma_host, port=self.chroma_port, settings=Settings(**settings))
             logging.info("Connected to ChromaDB server")
             return client
         except Exception as e:
             logging.error(f"Failed to connect to ChromaDB: {e}")
             raise
 
+    def _with_retry(self, operation, description):
+        """Run an operation, retrying transient failures with exponential backoff and jitter.
+
+        Invalid requests (bad ids, metadata, arguments) fail immediately.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return operation()
+            except (ValueError, TypeError, KeyError):
+                raise
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt) * (0.5 + random.random())
+                logging.warning(f"{description} failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def _max_batch_size(self):
+        # Older chromadb exposes the limit as a property, newer ones as a method
+        getter = getattr(self.client, "get_max_batch_size", None)
+        return getter() if getter else self.client.max_batch_size
+
     def get_collection(self, collection_name):
+        collection = self._collections.get(collection_name)
+        if collection is not None:
+            return collection
         try:
-            collection = self.client.get_or_create_collection(name=collection_name)
+            with self._collections_lock:
+                collection = self._collections.get(collection_name)
+                if collection is None:
+                    collection = self._with_retry(
+                        lambda: self.client.get_or_create_collection(name=collection_name),
+                        f"Getting collection '{collection_name}'"
+                    )
+                    self._collections[collection_name] = collection
             return collection
         except Exception as e:
             logging.error(f"Failed to get or create collection: {e}")
             return None
 
+    def forget_collection(self, collection_name):
+        """Drop a cached handle, e.g. after the collection was deleted on the server."""
+        with self._collections_lock:
+            self._collections.pop(collection_name, None)
+
     def add_documents(self, collection_name, documents):
         collection = self.get_collection(collection_name)
         if not collection:
@@ -42,10 +96,9 @@ class ChromaManager:
             texts = [doc['text'] for doc in documents]
             metadatas = [doc.get('metadata', {}) for doc in documents]
 
-            collection.add(
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids
+            self._with_retry(
+                lambda: collection.add(documents=texts, metadatas=metadatas, ids=ids),
+                f"Adding documents to '{collection_name}'"
             )
             logging.info(f"Added {len(documents)} documents to collection '{collection_name}'")
             return True
@@ -63,12 +116,10 @@ class ChromaManager:
             text = document['text']
             metadata = document.get('metadata', {})
 
-            # ChromaDB doesn't support direct updates, so delete and re-add
-            self.delete_documents(collection_name, [doc_id])
-            collection.add(
-                documents=[text],
-                metadatas=[metadata],
-                ids=[doc_id]
+            # Upsert replaces the document in one round trip
+            self._with_retry(
+                lambda: collection.upsert(documents=[text], metadatas=[metadata], ids=[doc_id]),
+                f"Updating document '{doc_id}'"
             )
             logging.info(f"Updated document '{doc_id}' in collection '{collection_name}'")
             return True
@@ -82,7 +133,10 @@ class ChromaManager:
             return False
 
         try:
-            collection.delete(ids=ids)
+            self._with_retry(
+                lambda: collection.delete(ids=ids),
+                f"Deleting documents from '{collection_name}'"
+            )
             logging.info(f"Deleted {len(ids)} documents from collection '{collection_name}'")
             return True
         except Exception as e:
@@ -95,15 +149,98 @@ class ChromaManager:
             return None
 
         try:
-            results = collection.query(
-                query_texts=[query_text],
-                n_results=n_results
+            results = self._with_retry(
+                lambda: collection.query(query_texts=[query_text], n_results=n_results),
+                f"Querying '{collection_name}'"
             )
             return results
         except Exception as e:
             logging.error(f"Failed to query collection: {e}")
             return None
 
+    def _run_chunked(self, items, operation, description):
+        """Split items into max-batch-size chunks and run them concurrently, in order."""
+        if not items:
+            return []
+        batch_size = self._max_batch_size()
+        chunks = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+        futures = [
+            self._executor.submit(self._with_retry, lambda chunk=chunk: operation(chunk), description)
+            for chunk in chunks
+        ]
+        return [future.result() for future in futures]
+
+    def bulk_upsert(self, collection_name, documents):
+        """Upsert any number of documents using as few round trips as the batch limit allows."""
+        collection = self.get_collection(collection_name)
+        if not collection:
+            return False
+
+        try:
+            self._run_chunked(
+                documents,
+                lambda chunk: collection.upsert(
+                    documents=[doc['text'] for doc in chunk],
+                    metadatas=[doc.get('metadata', {}) for doc in chunk],
+                    ids=[doc['id'] for doc in chunk]
+                ),
+                f"Upserting documents into '{collection_name}'"
+            )
+            logging.info(f"Upserted {len(documents)} documents into collection '{collection_name}'")
+            return True
+        except Exception as e:
+            logging.error(f"Failed to upsert documents: {e}")
+            return False
+
+    def bulk_delete(self, collection_name, ids):
+        """Delete any number of documents in batch-limit sized chunks."""
+        collection = self.get_collection(collection_name)
+        if not collection:
+            return False
+
+        try:
+            self._run_chunked(
+                list(ids),
+                lambda chunk: collection.delete(ids=chunk),
+                f"Deleting documents from '{collection_name}'"
+            )
+            logging.info(f"Deleted {len(ids)} documents from collection '{collection_name}'")
+            return True
+        except Exception as e:
+            logging.error(f"Failed to delete documents: {e}")
+            return False
+
+    def bulk_query(self, collection_name, query_texts, n_results=1, where=None):
+        """Run many queries with one embedding batch and request per chunk.
+
+        Returns:
+            Chroma query results merged across chunks, one entry per query text
+        """
+        collection = self.get_collection(collection_name)
+        if not collection:
+            return None
+
+        try:
+            chunk_results = self._run_chunked(
+                list(query_texts),
+                lambda chunk: collection.query(query_texts=chunk, n_results=n_results, where=where),
+                f"Querying '{collection_name}'"
+            )
+            merged = {}
+            for results in chunk_results:
+                for key, values in results.items():
+                    if key == "included":
+                        merged[key] = values
+                    elif isinstance(values, list):
+                        merged.setdefault(key, []).extend(values)
+            return merged
+        except Exception as e:
+            logging.error(f"Failed to query collection: {e}")
+            return None
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
 # Example usage (assuming you have set CHROMA_HOST and CHROMA_PORT environment variables)
 if __name__ == '__main__':
     chroma_manager = ChromaManager()
@@ -1,40 +1,219 @@
+import os
+import time
+import hashlib
+import threading
+
 import chromadb
-from flask import Flask, request, jsonify
+from chromadb.api.types import Documents, EmbeddingFunction
+from flask import Flask, request, jsonify, g
+from langchain_core.embeddings import Embeddings
+
+from embedding_batcher import BatchingEmbeddings, LazyEmbeddings
+
+class ChromaEmbeddingFunction(EmbeddingFunction):
+    """Adapt a LangChain Embeddings object to Chroma's embedding function protocol."""
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    def __call__(self, input: Documents):
+        return self.embeddings.embed_documents(list(input))
 
 app = Flask(__name__)
 chroma_client = chromadb.PersistentClient(path="./chroma_data")
 
+def load_embedding_model():
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+
+# Same MiniLM model as Chroma's default; concurrent requests share forward passes.
+# Loaded by warm_up() in the background so the probes answer meanwhile
+embeddings = BatchingEmbeddings(LazyEmbeddings(load_embedding_model))
+embedding_function = ChromaEmbeddingFunction(embeddings)
+
+# Upper bound on n_results so one request cannot ask for a whole collection
+MAX_N_RESULTS = 50
+
+# Collections holding several children's summaries; adding to them needs a
+# child_id, or children's summaries of the same month would replace each other
+SHARED_COLLECTIONS = set(filter(None, os.getenv("CHROMA_SHARED_COLLECTIONS", "childJournal").split(",")))
+
+# Collection handles are cheap to keep and save a lookup per request
+collections = {}
+collections_lock = threading.Lock()
+
+# At most this many data requests run at once; the rest wait up to
+# CHROMA_QUEUE_TIMEOUT seconds for a slot and are then turned away with a 503
+MAX_CONCURRENT_REQUESTS = int(os.getenv("CHROMA_MAX_CONCURRENT", 8))
+QUEUE_TIMEOUT = float(os.getenv("CHROMA_QUEUE_TIMEOUT", 2))
+request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# Probes and stats must answer even when every slot is taken
+UNTHROTTLED_PATHS = {'/', '/healthz', '/readyz', '/stats'}
+
+readiness = {
+    "embedding_model": False,
+    "collections_loaded": 0,
+    "warmup_seconds": None,
+    "error": None,
+}
+rejected_requests = 0
+# Waitress serves requests on several threads, so the counter needs a lock
+stats_lock = threading.Lock()
+
+def max_batch_size():
+    # Older chromadb exposes the limit as a property, newer ones as a method
+    getter = getattr(chroma_client, 'get_max_batch_size', None)
+    return getter() if getter else chroma_client.max_batch_size
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def is_shared_collection(name, collection):
+    if name in SHARED_COLLECTIONS:
+        return True
+    # Any summary tagged with a child means several children may write here
+    tagged = collection.get(where={"child_id": {"$ne": ""}}, limit=1, include=[])
+    return bool(tagged['ids'])
+
+def legacy_duplicates(collection, formatted):
+    """Ids of summaries stored under the old positional ids doc_{month}_{year}_{i}.
+
+    Those records carry no child id, so a stored summary is only taken for
+    an old copy of one being added when its month, year and text all match.
+    """
+    wanted = {}
+    for doc_text, metadata in formatted.values():
+        wanted.setdefault((metadata['month'], metadata['year']), set()).add(doc_text)
+
+    legacy = []
+    periods = list(wanted)
+    for start in range(0, len(periods), 100):
+        clauses = [{"$and": [{"month": month}, {"year": year}]} for month, year in periods[start:start + 100]]
+        where = clauses[0] if len(clauses) == 1 else {"$or": clauses}
+        stored = collection.get(where=where, include=['documents', 'metadatas'])
+        for doc_id, doc_text, metadata in zip(stored['ids'], stored['documents'], stored['metadatas']):
+            metadata = metadata or {}
+            # Records written since ids became stable carry a content hash
+            if 'content_hash' in metadata or not doc_id.startswith('doc_'):
+                continue
+            if doc_text in wanted.get((metadata.get('month'), metadata.get('year')), ()):
+                legacy.append(doc_id)
+    return legacy
+
+def get_collection(name):
+    collection = collections.get(name)
+    if collection is None:
+        with collections_lock:
+            collection = collections.get(name)
+            if collection is None:
+                collection = chroma_client.get_or_create_collection(name=name, embedding_function=embedding_function)
+                collections[name] = collection
+    return collection
+
+def warm_up():
+    """Load the embedding model and open every collection before serving traffic.
+
+    Runs in a background thread at startup; /readyz reports ready once it
+    has finished, so the first real query does not pay for model loading.
+    """
+    started = time.monotonic()
+    try:
+        embeddings.embed_query("warm up")
+        readiness["embedding_model"] = True
+
+        for collection in chroma_client.list_collections():
+            # chromadb < 0.6 returns Collection objects, newer versions names
+            name = getattr(collection, 'name', collection)
+            get_collection(name).count()
+            readiness["collections_loaded"] += 1
+    except Exception as e:
+        readiness["error"] = str(e)
+        print(f"Warm-up failed: {str(e)}")
+    readiness["warmup_seconds"] = round(time.monotonic() - started, 3)
+
+def is_ready():
+    return readiness["embedding_model"] and readiness["warmup_seconds"] is not None and not readiness["error"]
+
+@app.before_request
+def acquire_request_slot():
+    global rejected_requests
+    if request.path in UNTHROTTLED_PATHS:
+        return None
+    if not request_slots.acquire(timeout=QUEUE_TIMEOUT):
+        with stats_lock:
+            rejected_requests += 1
+        response = jsonify({"error": "Server is busy, retry shortly"})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+    g.request_slot = True
+    return None
+
+@app.teardown_request
+def release_request_slot(exc):
+    if g.pop('request_slot', False):
+        request_slots.release()
+
 @app.route('/', methods=['GET'])
 def get_collections():
     return jsonify({"status": "Chroma server is running"})
 
+@app.route('/healthz', methods=['GET'])
+def liveness():
+    return jsonify({"status": "alive"})
+
+@app.route('/readyz', methods=['GET'])
+def readiness_check():
+    body = {"ready": is_ready(), **readiness}
+    return jsonify(body), 200 if body["ready"] else 503
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    return jsonify({
+        "embeddings": embeddings.stats(),
+        "max_concurrent_requests": MAX_CONCURRENT_REQUESTS,
+        "rejected_requests": rejected_requests,
+        "collections_open": len(collections),
+    })
+
 @app.route('/create_collection', methods=['POST'])
 def create_collection():
 
     collection_name = request.json['name']
     if not collection_name:
         return jsonify({"error": "Collection name is required"}), 400
-    collection = chroma_client.create_collection(name=collection_name)
+    collection = chroma_client.create_collection(name=collection_name, embedding_function=embedding_function)
+    collections[collection_name] = collection
     return jsonify({"status": "Collection created"})
 
 
 
 @app.route('/add_documents', methods=['POST'])
 def add_documents():
+    """Upsert monthly summaries, skipping the ones already stored unchanged.
+
+    Ids are stable per child, month and year, so re-sending a journal is
+    idempotent: only new or edited summaries are embedded and written.
+    Copies of the same summaries stored under the positional ids used
+    before are removed. Collections shared by several children require a
+    child_id.
+    """
     try:
         collection_name = request.json['collection']
         documents = request.json['documents']
+        child_id = request.json.get('child_id')
         
-        # print("Received documents:", documents)  # Debug log
-        
-        collection = chroma_client.get_or_create_collection(name=collection_name)
-        
-        # Format documents for ChromaDB
-        docs = []
-        ids = []
-        metadatas = []
+        collection = get_collection(collection_name)
+        if not child_id and is_shared_collection(collection_name, collection):
+            return jsonify({
+                "error": f"child_id is required for collection '{collection_name}', which holds several children's summaries"
+            }), 400
         
-        for i, doc in enumerate(documents):
+        # Format documents for ChromaDB; a later summary of the same month replaces an earlier one
+        formatted = {}
+        for doc in documents:
             # Extract the summary as the main document text
             doc_text = doc.get('summary', '')
             
@@ -42,22 +221,46 @@ def add_documents():
             metadata = {
                 'month': doc.get('month', ''),
                 'year': doc.get('year', ''),
+                'content_hash': content_hash(doc_text),
             }
-            
-            docs.append(doc_text)
-            ids.append(f"doc_{doc.get('month')}_{doc.get('year')}_{i}")
-            metadatas.append(metadata)
-        
-        # Add to collection
-        collection.add(
-            documents=docs,
-            metadatas=metadatas,
-            ids=ids
-        )
+            if child_id:
+                metadata['child_id'] = child_id
+                doc_id = f"{child_id}_{doc.get('month')}_{doc.get('year')}"
+            else:
+                doc_id = f"doc_{doc.get('month')}_{doc.get('year')}"
+            formatted[doc_id] = (doc_text, metadata)
+
+        # Compare against what is stored so unchanged summaries skip embedding
+        ids = list(formatted)
+        existing = collection.get(ids=ids, include=['metadatas']) if ids else {'ids': [], 'metadatas': []}
+        stored_hashes = {
+            doc_id: (metadata or {}).get('content_hash')
+            for doc_id, metadata in zip(existing['ids'], existing['metadatas'])
+        }
+        changed = [
+            doc_id for doc_id in ids
+            if stored_hashes.get(doc_id) != formatted[doc_id][1]['content_hash']
+        ]
+
+        # Stay under Chroma's limit on records per write
+        batch_size = max_batch_size()
+        legacy = legacy_duplicates(collection, formatted) if formatted else []
+        for start in range(0, len(legacy), batch_size):
+            collection.delete(ids=legacy[start:start + batch_size])
+        for start in range(0, len(changed), batch_size):
+            batch_ids = changed[start:start + batch_size]
+            collection.upsert(
+                documents=[formatted[doc_id][0] for doc_id in batch_ids],
+                metadatas=[formatted[doc_id][1] for doc_id in batch_ids],
+                ids=batch_ids
+            )
         
         return jsonify({
             "status": "Documents added successfully",
-            "count": len(docs)
+            "count": len(ids),
+            "upserted": len(changed),
+            "unchanged": len(ids) - len(changed),
+            "legacy_removed": len(legacy)
         })
         
     except KeyError as e:
@@ -72,10 +275,8 @@ def add_documents():
 
 @app.route('/query', methods=['POST'])
 def query_collection():
-    print("Querying collection")
-    print(request.json)
-    collection_name = request.json['collection']
-    query_text = request.json['query']
+    collection_name = request.json.get('collection')
+    query_text = request.json.get('query')
     
     if not collection_name:
         return jsonify({"error": "Collection name is required"}), 400
@@ -83,21 +284,14 @@ def query_collection():
         return jsonify({"error": "Query text is required"}), 400
     
     try:
-        collection = chroma_client.get_or_create_collection(name=collection_name)
-        
-        if collection.count() == 0:
-            return jsonify({
-                "found": False,
-                "message": "Collection exists but has no documents",
-                "results": None
-            })
+        collection = get_collection(collection_name)
 
         results = collection.query(
             query_texts=[query_text],
             n_results=1  # Change to 1 to get only the most relevant result
         )
 
-        if not results['documents'] or len(results['documents']) == 0:
+        if not results['documents'] or not results['documents'][0]:
             return jsonify({
                 "found": False,
                 "message": "No matching documents found",
@@ -117,9 +311,87 @@ def query_collection():
         print(f"Error during query: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/query_batch', methods=['POST'])
+def query_collection_batch():
+    """Run many queries against one collection in a single Chroma call.
+
+    Body: collection, and either queries (texts, embedded in one batch) or
+    query_embeddings (precomputed vectors); optionally n_results and a
+    metadata where filter. Returns one result list per query, in order.
+    """
+    body = request.json or {}
+    collection_name = body.get('collection')
+    queries = body.get('queries')
+    query_embeddings = body.get('query_embeddings')
+    where = body.get('where') or None
+
+    if not collection_name:
+        return jsonify({"error": "Collection name is required"}), 400
+    if not queries and not query_embeddings:
+        return jsonify({"error": "Either queries or query_embeddings is required"}), 400
+    if queries and query_embeddings:
+        return jsonify({"error": "Pass either queries or query_embeddings, not both"}), 400
+
+    try:
+        n_results = int(body.get('n_results', 1))
+    except (TypeError, ValueError):
+        return jsonify({"error": "n_results must be an integer"}), 400
+    if not 1 <= n_results <= MAX_N_RESULTS:
+        return jsonify({"error": f"n_results must be between 1 and {MAX_N_RESULTS}"}), 400
+
+    try:
+        collection = get_collection(collection_name)
+        if queries:
+            results = collection.query(query_texts=queries, n_results=n_results, where=where)
+        else:
+            results = collection.query(query_embeddings=query_embeddings, n_results=n_results, where=where)
+
+        distances = results.get('distances') or [[None] * len(ids) for ids in results['ids']]
+        batch = []
+        for ids, documents, metadatas, dists in zip(
+            results['ids'], results['documents'], results['metadatas'], distances
+        ):
+            matches = [
+                {"id": doc_id, "document": document, "metadata": metadata, "distance": distance}
+                for doc_id, document, metadata, distance in zip(ids, documents, metadatas, dists)
+            ]
+            batch.append({"found": bool(matches), "results": matches})
+
+        return jsonify({"results": batch})
+    except Exception as e:
+        print(f"Error during batch query: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+def serve():
+    """Run the server, concurrently with waitress unless CHROMA_SERVER_MODE=dev.
+
+    Everything stays in one process with a thread pool: PersistentClient
+    must not be shared across processes, and the threads share the one
+    embedding model and batcher.
+    """
+    host = os.getenv("CHROMA_HOST", "127.0.0.1")
+    port = int(os.getenv("CHROMA_PORT", 8000))
+    threading.Thread(target=warm_up, name="chroma-warmup", daemon=True).start()
 
+    if os.getenv("CHROMA_SERVER_MODE", "production").lower() == "dev":
+        app.run(host=host, port=port, threaded=True)
+        return
 
+    from waitress import serve as waitress_serve
+    # More threads than slots so excess requests reach the semaphore and get
+    # a fast 503 instead of queueing silently inside waitress
+    threads = int(os.getenv("CHROMA_SERVER_THREADS", MAX_CONCURRENT_REQUESTS * 2))
+    print(f"Serving Chroma on {host}:{port} with {threads} threads, {MAX_CONCURRENT_REQUESTS} concurrent requests")
+    waitress_serve(
+        app,
+        host=host,
+        port=port,
+        threads=threads,
+        connection_limit=int(os.getenv("CHROMA_CONNECTION_LIMIT", 200)),
+        channel_timeout=int(os.getenv("CHROMA_CHANNEL_TIMEOUT", 120)),
+    )
 
 
 if __name__ == '__main__':
-    app.run(port=8000) 
\ No newline at end of file
+    serve() 
\ No newline at end of file
@@ -0,0 +1,43 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+# Journal loads mix boto3 I/O with FAISS work and waiting on the embedding
+# batcher; all of them release the GIL, so a bounded thread pool is enough and
+# avoids pickling indexes across processes.
+load_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("RAG_LOAD_WORKERS", 8)),
+    thread_name_prefix="rag-load"
+)
+
+
+async def run_blocking(executor: Executor, fn: Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking callable on an executor without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+class SingleFlight:
+    def __init__(self):
+        """Collapse concurrent async loads of the same key into one.
+
+        The first caller for a key starts the load as a task; callers arriving
+        while it runs await the same task. The task is shielded, so a caller
+        that disconnects does not cancel the load for everyone else.
+        """
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def inflight(self) -> int:
+        return len(self._inflight)
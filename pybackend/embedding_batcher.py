@@ -0,0 +1,255 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import itertools
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class LazyEmbeddings(Embeddings):
+    def __init__(self, factory: Callable[[], Embeddings]):
+        """Embeddings whose model is only created on first use.
+
+        Lets services start answering health checks before a model such as
+        MiniLM (and torch with it) has been imported and loaded.
+
+        Args:
+            factory: Creates the actual embeddings model
+        """
+        self.factory = factory
+        self._embeddings: Optional[Embeddings] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._embeddings is not None
+
+    def load(self) -> Embeddings:
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    started = time.monotonic()
+                    self._embeddings = self.factory()
+                    logger.info(f"Loaded embeddings model in {time.monotonic() - started:.2f}s")
+        return self._embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.load().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.load().embed_query(text)
+
+
+# Lower is embedded first; queries should not wait behind a whole index build
+PRIORITY_QUERY = 0
+PRIORITY_DOCUMENTS = 1
+# Queued by close(), after everything else
+_PRIORITY_STOP = 2
+
+_sequence = itertools.count()
+
+
+class _EmbeddingRequest:
+    __slots__ = ("texts", "priority", "seq", "future", "enqueued_at")
+
+    def __init__(self, texts: List[str], priority: int):
+        self.texts = texts
+        self.priority = priority
+        self.seq = next(_sequence)
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other: "_EmbeddingRequest") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class BatchingEmbeddings(Embeddings):
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+    ):
+        """Embeddings wrapper that coalesces concurrent calls into shared batches.
+
+        Calls from any thread (or coroutine, via the async methods) are queued
+        and a single worker thread runs them through the wrapped model in
+        batches of at most max_batch_size texts, waiting at most max_wait_ms
+        for a batch to fill. Queued queries are batched before queued
+        documents, so a query waits for at most the batch already running
+        rather than for every chunk of an index build.
+
+        Queries are embedded with embed_documents alongside documents, which is
+        only valid for models without query-specific prompts such as MiniLM.
+
+        Args:
+            embeddings: The embeddings model doing the actual work
+            max_batch_size: Largest number of texts per forward pass, defaults to EMBEDDINGS_MAX_BATCH or 64
+            max_wait_ms: Longest time a request waits for others to join, defaults to EMBEDDINGS_MAX_WAIT_MS or 5
+        """
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size or int(os.getenv("EMBEDDINGS_MAX_BATCH", 64))
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else float(os.getenv("EMBEDDINGS_MAX_WAIT_MS", 5))) / 1000
+
+        self._queue: "queue.PriorityQueue[_EmbeddingRequest]" = queue.PriorityQueue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._batches = 0
+        self._texts = 0
+        self._errors = 0
+        self._cancelled = 0
+        self._busy_seconds = 0.0
+        self._wait_seconds = 0.0
+        self._max_batch_seen = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        futures = self._submit(texts, PRIORITY_DOCUMENTS)
+        return [vector for future in futures for vector in future.result()]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit([text], PRIORITY_QUERY)[0].result()[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # A cancelled caller cancels its still-queued requests, which the worker then skips
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in self._submit(texts, PRIORITY_DOCUMENTS)))
+        return [vector for result in results for vector in result]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        result = await asyncio.wrap_future(self._submit([text], PRIORITY_QUERY)[0])
+        return result[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return batching, throughput and queue-depth counters."""
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_depth": self._queue.qsize(),
+                "requests": self._requests,
+                "batches": self._batches,
+                "texts": self._texts,
+                "errors": self._errors,
+                "cancelled": self._cancelled,
+                "avg_batch_size": self._texts / self._batches if self._batches else 0.0,
+                "max_batch_seen": self._max_batch_seen,
+                "avg_queue_wait_ms": 1000 * self._wait_seconds / self._requests if self._requests else 0.0,
+                "texts_per_second": self._texts / self._busy_seconds if self._busy_seconds else 0.0,
+            }
+
+    def close(self):
+        """Stop the worker thread once the queued requests are done."""
+        with self._worker_lock:
+            if self._worker is not None:
+                self._queue.put(_EmbeddingRequest([], _PRIORITY_STOP))
+                self._worker.join()
+                self._worker = None
+
+    def _submit(self, texts: List[str], priority: int) -> List[Future]:
+        self._ensure_worker()
+        texts = list(texts)
+        # Split oversized calls (e.g. index builds) so queries can be batched between their chunks
+        requests = [
+            _EmbeddingRequest(texts[i:i + self.max_batch_size], priority)
+            for i in range(0, len(texts), self.max_batch_size)
+        ]
+        for request in requests:
+            self._queue.put(request)
+        return [request.future for request in requests]
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def _start(self, request: _EmbeddingRequest) -> bool:
+        """Claim a dequeued request; False if its caller cancelled it while queued."""
+        # Once running, the future can no longer be cancelled under the worker
+        if request.future.set_running_or_notify_cancel():
+            return True
+        with self._stats_lock:
+            self._cancelled += 1
+        return False
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first.priority == _PRIORITY_STOP:
+                return
+            if not self._start(first):
+                continue
+
+            batch = [first]
+            size = len(first.texts)
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request.priority == _PRIORITY_STOP:
+                    stop = True
+                    break
+                if size + len(request.texts) > self.max_batch_size:
+                    # Back in line; a query arriving meanwhile still goes before it
+                    self._queue.put(request)
+                    break
+                if self._start(request):
+                    batch.append(request)
+                    size += len(request.texts)
+
+            try:
+                self._run_batch(batch, size)
+            except Exception as e:
+                # The worker serves every caller in the process and must survive any one batch
+                logger.exception(f"Embedding worker failed on a batch of {size} texts: {e}")
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+            if stop:
+                return
+
+    def _run_batch(self, batch: List[_EmbeddingRequest], size: int):
+        started = time.monotonic()
+        texts = [text for request in batch for text in request.texts]
+        try:
+            vectors = self.embeddings.embed_documents(texts)
+        except Exception as e:
+            logger.error(f"Embedding batch of {size} texts failed: {e}")
+            with self._stats_lock:
+                self._errors += 1
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        finished = time.monotonic()
+        STAGE_SECONDS.labels("embed_batch").observe(finished - started)
+        offset = 0
+        for request in batch:
+            request.future.set_result(vectors[offset:offset + len(request.texts)])
+            offset += len(request.texts)
+
+        with self._stats_lock:
+            self._requests += len(batch)
+            self._batches += 1
+            self._texts += size
+            self._max_batch_seen = max(self._max_batch_seen, size)
+            self._busy_seconds += finished - started
+            self._wait_seconds += sum(started - request.enqueued_at for request in batch)
@@ -0,0 +1,123 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from growth_engine import GrowthEngine, LMSTable, normalize_sex
+
+SD_LINES = ("SD3neg", "SD2neg", "SD1neg", "SD0", "SD1", "SD2", "SD3")
+SD_VALUES = (-3, -2, -1, 0, 1, 2, 3)
+
+DEFAULT_POINTS = 200
+MAX_POINTS = 2000
+
+
+class _Curves:
+    __slots__ = ("x", "values", "etag")
+
+    def __init__(self, x: np.ndarray, values: np.ndarray, etag: str):
+        self.x = x
+        self.values = values
+        self.etag = etag
+
+
+class GrowthCurves:
+    def __init__(self, engine: GrowthEngine, max_cached_slices: int = 1024):
+        """Reference SD curves for growth charts, precomputed once per table.
+
+        Every indicator and sex gets SD3neg..SD3 at each table row (every
+        day from 0 to 1856, or every 0.1 cm for weight-for-length/height),
+        computed from L/M/S. Requests take a downsampled window of those
+        arrays; the encoded responses are cached, so repeated chart loads
+        are dictionary hits.
+
+        Args:
+            engine: Growth engine holding the LMS tables
+            max_cached_slices: Encoded slices kept in the LRU cache
+        """
+        self.curves: Dict[Tuple[str, str], _Curves] = {}
+        for (indicator, sex), table in engine.tables.items():
+            values = np.vstack([LMSTable.cutoff(table.L, table.M, table.S, z) for z in SD_VALUES])
+            values = np.round(values, 3).astype(np.float32)
+            etag = hashlib.sha1(table.x.tobytes() + values.tobytes()).hexdigest()[:16]
+            self.curves[(indicator, sex)] = _Curves(table.x, values, etag)
+
+        self.max_cached_slices = max_cached_slices
+        self._slices: "OrderedDict[tuple, Tuple[str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(
+        self,
+        indicator: str,
+        sex: str,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        points: int = DEFAULT_POINTS,
+    ) -> Tuple[str, bytes]:
+        """Return the ETag and compact JSON of a window of an indicator's curves.
+
+        Args:
+            indicator: One of wfa, lhfa, wfl, wfh or bmi
+            sex: 'male'/'female' or 'boys'/'girls'
+            start: First age in days (or length/height in cm), defaults to the table start
+            end: Last age in days (or length/height in cm), defaults to the table end
+            points: Most points returned per curve; the window is evenly downsampled to fit
+
+        Returns:
+            (etag, body) where body is JSON with an "x" array and one array per SD line
+        """
+        sex = normalize_sex(sex)
+        curves = self.curves.get((indicator, sex))
+        if curves is None:
+            raise KeyError(f"No curves for {indicator}")
+        if not 2 <= points <= MAX_POINTS:
+            raise ValueError(f"points must be between 2 and {MAX_POINTS}")
+
+        lo = 0 if start is None else int(np.searchsorted(curves.x, start, side="left"))
+        hi = len(curves.x) if end is None else int(np.searchsorted(curves.x, end, side="right"))
+        if lo >= hi:
+            raise ValueError("Empty window")
+
+        key = (indicator, sex, lo, hi, points)
+        with self._lock:
+            cached = self._slices.get(key)
+            if cached is not None:
+                self._slices.move_to_end(key)
+                self._hits += 1
+                return cached
+            self._misses += 1
+
+        # Evenly spaced rows, always including both ends of the window
+        count = hi - lo
+        rows = np.unique(np.linspace(lo, hi - 1, min(points, count)).round().astype(np.int64))
+        body = {
+            "indicator": indicator,
+            "sex": sex,
+            "x": np.round(curves.x[rows], 1).tolist(),
+        }
+        for line, values in zip(SD_LINES, curves.values[:, rows]):
+            body[line] = np.round(values.astype(np.float64), 3).tolist()
+        encoded = json.dumps(body, separators=(",", ":")).encode("utf-8")
+        etag = f'"{curves.etag}-{lo}-{hi}-{points}"'
+
+        with self._lock:
+            self._slices[key] = (etag, encoded)
+            while len(self._slices) > self.max_cached_slices:
+                self._slices.popitem(last=False)
+        return etag, encoded
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "tables": len(self.curves),
+                "cached_slices": len(self._slices),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,209 @@
+import os
+import json
+import math
+import logging
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from who_bundle import WHOBundle
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TABLES_DIR = Path(__file__).resolve().parent.parent / "dataset" / "downloads"
+
+# indicator -> (expanded table file stem, x column, WHO restricted-tail adjustment)
+# Weight and BMI are skewed, so WHO replaces the LMS tails beyond +/-3 SD by a
+# linear extension; length/height has L = 1 and is used as is.
+INDICATORS: Dict[str, Tuple[str, str, bool]] = {
+    "wfa": ("wfa", "Day", True),
+    "lhfa": ("lhfa", "Day", False),
+    "wfl": ("wfl", "Length", True),
+    "wfh": ("wfh", "Height", True),
+    "bmi": ("bfa", "Day", True),
+}
+
+SEXES = {"male": "boys", "boy": "boys", "boys": "boys", "m": "boys",
+         "female": "girls", "girl": "girls", "girls": "girls", "f": "girls"}
+
+# WHO measures recumbent length before two years and standing height after
+LENGTH_AGE_LIMIT_DAYS = 730
+
+_erf = np.vectorize(math.erf, otypes=[np.float64])
+
+
+def normalize_sex(sex: str) -> str:
+    """Map the app's 'male'/'female' (and table names) onto 'boys'/'girls'."""
+    try:
+        return SEXES[sex.strip().lower()]
+    except (KeyError, AttributeError):
+        raise ValueError(f"Unknown sex: {sex!r}")
+
+
+def z_to_percentile(z: np.ndarray) -> np.ndarray:
+    return 50.0 * (1.0 + _erf(np.asarray(z, dtype=np.float64) / math.sqrt(2.0)))
+
+
+class LMSTable:
+    def __init__(self, x: np.ndarray, L: np.ndarray, M: np.ndarray, S: np.ndarray, restricted: bool):
+        """LMS parameters of one indicator and sex as contiguous float64 arrays.
+
+        Args:
+            x: Ascending age in days, or length/height in cm
+            L: Box-Cox power
+            M: Median
+            S: Coefficient of variation
+            restricted: Apply the WHO restricted-tail adjustment beyond +/-3 SD
+        """
+        self.x = np.ascontiguousarray(x, dtype=np.float64)
+        self.L = np.ascontiguousarray(L, dtype=np.float64)
+        self.M = np.ascontiguousarray(M, dtype=np.float64)
+        self.S = np.ascontiguousarray(S, dtype=np.float64)
+        self.restricted = restricted
+
+    @classmethod
+    def from_rows(cls, rows, x_column: str, restricted: bool) -> "LMSTable":
+        rows = sorted(rows, key=lambda row: row[x_column])
+        return cls(
+            x=np.array([row[x_column] for row in rows]),
+            L=np.array([row["L"] for row in rows]),
+            M=np.array([row["M"] for row in rows]),
+            S=np.array([row["S"] for row in rows]),
+            restricted=restricted,
+        )
+
+    def lms_at(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Linearly interpolate L, M and S; NaN outside the table's range."""
+        x = np.asarray(x, dtype=np.float64)
+        outside = (x < self.x[0]) | (x > self.x[-1]) | np.isnan(x)
+        L, M, S = (np.interp(x, self.x, column) for column in (self.L, self.M, self.S))
+        for column in (L, M, S):
+            column[outside] = np.nan
+        return L, M, S
+
+    @staticmethod
+    def cutoff(L: np.ndarray, M: np.ndarray, S: np.ndarray, z: float) -> np.ndarray:
+        """Measurement value at z-score z."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(L == 0, M * np.exp(S * z), M * np.power(1 + L * S * z, 1 / np.where(L == 0, 1, L)))
+
+    def zscores(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Z-scores of measurements y taken at x; NaN where x or y is unusable."""
+        y = np.asarray(y, dtype=np.float64)
+        L, M, S = self.lms_at(x)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            y = np.where(y > 0, y, np.nan)
+            safe_L = np.where(L == 0, 1, L)
+            z = np.where(L == 0, np.log(y / M) / S, (np.power(y / M, L) - 1) / (safe_L * S))
+
+            if self.restricted:
+                sd3pos = self.cutoff(L, M, S, 3)
+                sd23pos = sd3pos - self.cutoff(L, M, S, 2)
+                sd3neg = self.cutoff(L, M, S, -3)
+                sd23neg = self.cutoff(L, M, S, -2) - sd3neg
+                z = np.where(z > 3, 3 + (y - sd3pos) / sd23pos, z)
+                z = np.where(z < -3, -3 + (y - sd3neg) / sd23neg, z)
+        return z
+
+
+class GrowthEngine:
+    def __init__(self, tables_dir: Optional[str] = None, bundle: Optional[WHOBundle] = None):
+        """Batch WHO z-score and percentile calculator.
+
+        Uses the daily expanded WHO tables (age in days, or length/height
+        in 0.1 cm steps) and answers whole arrays of measurements with
+        NumPy, interpolating between table rows. Tables come from the
+        compiled WHO bundle when it has been built, as zero-copy views of
+        the memory-mapped file, and are parsed from JSON otherwise.
+
+        Args:
+            tables_dir: Directory with the WHO JSON tables, defaults to WHO_TABLES_DIR or dataset/downloads
+            bundle: Compiled tables, defaults to the bundle in WHO_BUNDLE_DIR or dataset/bundle
+        """
+        self.tables_dir = Path(tables_dir or os.getenv("WHO_TABLES_DIR", DEFAULT_TABLES_DIR))
+        bundle = bundle or WHOBundle()
+        use_bundle = bundle.exists()
+        self.tables: Dict[Tuple[str, str], LMSTable] = {}
+        for indicator, (stem, x_column, restricted) in INDICATORS.items():
+            for sex in ("boys", "girls"):
+                if use_bundle:
+                    table = self._bundle_table(bundle, indicator, sex, restricted)
+                else:
+                    table = self._load_table(stem, sex, x_column, restricted)
+                self.tables[(indicator, sex)] = table
+        source = bundle.bundle_dir if use_bundle else self.tables_dir
+        logger.info(f"Loaded {len(self.tables)} WHO LMS tables from {source}")
+
+    @staticmethod
+    def _bundle_table(bundle: WHOBundle, indicator: str, sex: str, restricted: bool) -> LMSTable:
+        table = bundle.table(f"{indicator}/{sex}/z/expanded")
+        return LMSTable(table.x, table.column("L"), table.column("M"), table.column("S"), restricted)
+
+    def _load_table(self, stem: str, sex: str, x_column: str, restricted: bool) -> LMSTable:
+        # Upstream names are inconsistent: "-zscore-expanded-table" vs "-tables"
+        matches = sorted(self.tables_dir.glob(f"{stem}-{sex}-zscore-expanded-table*.json*"))
+        if not matches:
+            raise FileNotFoundError(f"No expanded z-score table for {stem}/{sex} in {self.tables_dir}")
+        with open(matches[0]) as f:
+            data = json.load(f)
+        rows = next(iter(data.values())) if isinstance(data, dict) else data
+        return LMSTable.from_rows(rows, x_column, restricted)
+
+    def zscores(self, indicator: str, sex: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Z-scores for one indicator over arrays of measurements.
+
+        Args:
+            indicator: One of wfa, lhfa, wfl, wfh or bmi
+            sex: Array of 'boys'/'girls' per measurement
+            x: Age in days, or length/height in cm for wfl/wfh
+            y: Weight in kg, length/height in cm or BMI
+
+        Returns:
+            Array of z-scores, NaN where the measurement is out of the table's range
+        """
+        sex = np.asarray(sex)
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        z = np.full(x.shape, np.nan)
+        for table_sex in ("boys", "girls"):
+            mask = sex == table_sex
+            if mask.any():
+                z[mask] = self.tables[(indicator, table_sex)].zscores(x[mask], y[mask])
+        return z
+
+    def assess(
+        self,
+        sex: np.ndarray,
+        age_days: np.ndarray,
+        weight_kg: np.ndarray,
+        height_cm: np.ndarray,
+    ) -> Dict[str, Dict[str, np.ndarray]]:
+        """Compute every applicable indicator for arrays of measurements.
+
+        Missing weights or heights are passed as NaN. Weight-for-length is
+        used under two years and weight-for-height from then on.
+
+        Returns:
+            Mapping of indicator to {"z": array, "percentile": array}
+        """
+        sex = np.array([normalize_sex(s) for s in sex])
+        age_days = np.asarray(age_days, dtype=np.float64)
+        weight_kg = np.asarray(weight_kg, dtype=np.float64)
+        height_cm = np.asarray(height_cm, dtype=np.float64)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            bmi = weight_kg / np.square(height_cm / 100)
+
+        under_two = age_days < LENGTH_AGE_LIMIT_DAYS
+        zscores = {
+            "wfa": self.zscores("wfa", sex, age_days, weight_kg),
+            "lhfa": self.zscores("lhfa", sex, age_days, height_cm),
+            "wfl": np.where(under_two, self.zscores("wfl", sex, height_cm, weight_kg), np.nan),
+            "wfh": np.where(~under_two, self.zscores("wfh", sex, height_cm, weight_kg), np.nan),
+            "bmi": self.zscores("bmi", sex, age_days, bmi),
+        }
+        return {
+            indicator: {"z": z, "percentile": z_to_percentile(z)}
+            for indicator, z in zscores.items()
+        }
@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import shutil
+import pickle
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional
+
+import faiss
+from langchain_core.embeddings import Embeddings
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.pkl"
+META_FILE = "meta.json"
+# How long a replaced index version stays on disk for readers that resolved it before the swap
+SUPERSEDED_GRACE_SECONDS = 60
+
+
+class FAISSIndexStore:
+    def __init__(self, root: Optional[str] = None, mmap: bool = True, embeddings_id: Optional[str] = None):
+        """On-disk store of per-child FAISS indexes keyed by the journal's S3 ETag.
+
+        Each child gets a directory holding the index of its current journal
+        version, reached through a symlink named after the ETag:
+
+            {root}/{child_id}/{etag_key} -> .v-{etag_key}-{suffix}
+            {root}/{child_id}/.v-{etag_key}-{suffix}/index.faiss
+            {root}/{child_id}/.v-{etag_key}-{suffix}/docstore.pkl
+            {root}/{child_id}/.v-{etag_key}-{suffix}/meta.json
+
+        Args:
+            root: Directory for the indexes, defaults to FAISS_INDEX_DIR or ./faiss_indexes
+            mmap: Open indexes memory-mapped and read-only instead of reading them into memory
+            embeddings_id: Embeddings backend and model the indexes are built with; indexes
+                recorded with a different one are treated as missing
+        """
+        self.root = Path(root or os.getenv("FAISS_INDEX_DIR", "./faiss_indexes"))
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.mmap = mmap
+        self.embeddings_id = embeddings_id
+
+    @staticmethod
+    def etag_key(etag: str) -> str:
+        """Turn an S3 ETag into a short, filesystem-safe directory name."""
+        return hashlib.sha1(etag.strip('"').encode("utf-8")).hexdigest()[:16]
+
+    def _child_dir(self, child_id: str) -> Path:
+        # Child ids are Mongo ObjectIds, but never trust them as path components
+        safe_id = "".join(c for c in child_id if c.isalnum() or c in "-_")
+        return self.root / safe_id
+
+    def path_for(self, child_id: str, etag: str) -> Path:
+        return self._child_dir(child_id) / self.etag_key(etag)
+
+    def has(self, child_id: str, etag: str) -> bool:
+        return self._usable(self.path_for(child_id, etag))
+
+    def _usable(self, path: Path) -> bool:
+        """Whether path holds a complete index built with this store's embeddings."""
+        try:
+            with open(path / META_FILE) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        # Indexes from before embeddings were recorded were all built with the default model
+        recorded = meta.get("embeddings")
+        return self.embeddings_id is None or recorded is None or recorded == self.embeddings_id
+
+    def load(self, child_id: str, etag: str, embeddings: Embeddings) -> Optional["FAISS"]:
+        """Load the index persisted for this exact journal version.
+
+        Args:
+            child_id: Unique identifier for the child
+            etag: ETag of the journal object the index must match
+            embeddings: Embeddings used to embed queries against the index
+
+        Returns:
+            FAISS vector store, or None if no matching index is on disk
+        """
+        # Resolved once, so a concurrent save swapping the link cannot mix two versions
+        path = self.path_for(child_id, etag).resolve()
+        if not self._usable(path):
+            return None
+
+        try:
+            vector_store = self._read(path, embeddings, self.mmap)
+        except Exception as e:
+            logger.warning(f"Discarding unreadable index for child {child_id}: {e}")
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+        # The meta file's mtime doubles as last-use time for recent_children()
+        try:
+            os.utime(path / META_FILE)
+        except OSError:
+            pass
+        return vector_store
+
+    def recent_children(self, limit: int) -> List[str]:
+        """Return up to limit child ids whose indexes were used most recently."""
+        used = []
+        for child_dir in self.root.iterdir():
+            if not child_dir.is_dir():
+                continue
+            for path in child_dir.iterdir():
+                meta = path / META_FILE
+                if path.name.startswith(".") or not meta.exists():
+                    continue
+                try:
+                    with open(meta) as f:
+                        used.append((meta.stat().st_mtime, json.load(f)["child_id"]))
+                except (OSError, ValueError, KeyError):
+                    continue
+        used.sort(reverse=True)
+        return [child_id for _, child_id in used[:limit]]
+
+    def load_latest(self, child_id: str, embeddings: Embeddings) -> Optional["FAISS"]:
+        """Load whichever index version is persisted for a child, fully in memory.
+
+        Used as the starting point for incremental updates, so the index is
+        read writable rather than memory-mapped.
+        """
+        child_dir = self._child_dir(child_id)
+        if not child_dir.exists():
+            return None
+
+        for path in child_dir.iterdir():
+            if path.name.startswith(".") or not self._usable(path):
+                continue
+            path = path.resolve()
+            try:
+                return self._read(path, embeddings, mmap=False)
+            except Exception as e:
+                logger.warning(f"Discarding unreadable index for child {child_id}: {e}")
+                shutil.rmtree(path, ignore_errors=True)
+        return None
+
+    def save(self, child_id: str, etag: str, vector_store: "FAISS") -> Path:
+        """Persist an index for a journal version, replacing any older version.
+
+        The index is written to a new version directory and the ETag's
+        symlink is then atomically repointed to it, so concurrent readers
+        see either the old or the new index, never a partial or missing one.
+        Replaced versions are removed by later saves once they have been
+        superseded for SUPERSEDED_GRACE_SECONDS.
+        """
+        child_dir = self._child_dir(child_id)
+        child_dir.mkdir(parents=True, exist_ok=True)
+        final_path = self.path_for(child_id, etag)
+
+        tmp_path = Path(tempfile.mkdtemp(dir=child_dir, prefix=".tmp-"))
+        try:
+            faiss.write_index(vector_store.index, str(tmp_path / INDEX_FILE))
+            with open(tmp_path / DOCSTORE_FILE, "wb") as f:
+                pickle.dump((vector_store.docstore, vector_store.index_to_docstore_id), f)
+            with open(tmp_path / META_FILE, "w") as f:
+                json.dump({
+                    "child_id": child_id,
+                    "etag": etag,
+                    "vectors": vector_store.index.ntotal,
+                    "embeddings": self.embeddings_id,
+                    "created_at": time.time()
+                }, f)
+
+            version_path = child_dir / f".v-{final_path.name}-{tmp_path.name[len('.tmp-'):]}"
+            os.rename(tmp_path, version_path)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        previous = final_path.resolve() if final_path.is_symlink() else None
+        link_path = child_dir / f".tmp-link-{version_path.name}"
+        os.symlink(version_path.name, link_path)
+        if final_path.is_dir() and not final_path.is_symlink():
+            # Index saved before versions were linked; it cannot be swapped atomically
+            shutil.rmtree(final_path)
+        os.replace(link_path, final_path)
+
+        # Superseded versions stay for a grace period, for readers still opening their files
+        superseded = [previous] if previous is not None else []
+        for stale in child_dir.iterdir():
+            if stale.is_symlink() and stale != final_path and not stale.name.startswith(".tmp-"):
+                # A link to an older journal version marks a superseded index too
+                superseded.append(stale.resolve())
+                stale.unlink()
+        for path in superseded:
+            if path != version_path.resolve():
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+        for stale in child_dir.iterdir():
+            if stale.is_symlink() or stale.name.startswith(".tmp-") or stale == version_path:
+                continue
+            try:
+                expired = time.time() - stale.stat().st_mtime > SUPERSEDED_GRACE_SECONDS
+            except OSError:
+                continue
+            if expired:
+                shutil.rmtree(stale, ignore_errors=True)
+
+        logger.info(f"Persisted index for child {child_id} at {final_path}")
+        return final_path
+
+    def delete(self, child_id: str):
+        """Remove every persisted index version for a child."""
+        shutil.rmtree(self._child_dir(child_id), ignore_errors=True)
+
+    def _read(self, path: Path, embeddings: Embeddings, mmap: bool) -> "FAISS":
+        from langchain_community.vectorstores import FAISS
+
+        index_path = str(path / INDEX_FILE)
+        if mmap:
+            try:
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                # Older faiss builds can only mmap some index types
+                index = faiss.read_index(index_path)
+        else:
+            index = faiss.read_index(index_path)
+
+        with open(path / DOCSTORE_FILE, "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+
+        return FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id
+        )
@@ -0,0 +1,221 @@
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from rag_cache import RAGCache
+
+try:
+    import ijson
+    JSON_ERRORS = (ValueError, ijson.JSONError)
+except ImportError:  # Streaming parse is optional; large journals are then parsed in one go
+    ijson = None
+    JSON_ERRORS = (ValueError,)
+
+logger = logging.getLogger(__name__)
+
+# Not NoSuchBucket: a missing bucket is a misconfiguration, not a child without a journal
+NOT_FOUND_CODES = ("NoSuchKey", "404")
+JOURNAL_PREFIX = "summaries/"
+
+
+class JournalNotFound(Exception):
+    """The child has no journal in the bucket."""
+
+
+class JournalLoadError(Exception):
+    """The journal exists or may exist, but could not be read."""
+
+
+class _CachedJournal:
+    __slots__ = ("journal", "etag", "size")
+
+    def __init__(self, journal: List[Dict], etag: str, size: int):
+        self.journal = journal
+        self.etag = etag
+        self.size = size
+
+
+class S3JournalLoader:
+    def __init__(
+        self,
+        bucket_name: Optional[str] = None,
+        s3_client=None,
+        max_pool_connections: Optional[int] = None,
+        stream_threshold: Optional[int] = None,
+        cache: Optional[RAGCache] = None,
+    ):
+        """Load children's journals (summaries/{child_id}.json) from S3.
+
+        Journals that were read before are revalidated with a conditional
+        GET (If-None-Match with the cached ETag), so an unchanged journal
+        costs a 304 instead of a download and parse. Large journals are
+        parsed while streaming when ijson is installed. A missing journal
+        raises JournalNotFound and every other failure JournalLoadError,
+        so callers can tell a 404 from an outage.
+
+        Args:
+            bucket_name: Bucket holding the journals, defaults to AWS_BUCKET_NAME
+            s3_client: S3 client to use instead of creating a pooled one
+            max_pool_connections: HTTP connections kept open to S3, defaults to S3_MAX_POOL_CONNECTIONS or 32
+            stream_threshold: Journals above this many bytes are stream-parsed, defaults to S3_STREAM_JSON_BYTES or 1 MiB
+            cache: Cache of parsed journals, defaults to S3_JOURNAL_CACHE_* settings
+        """
+        self.bucket_name = bucket_name or os.getenv("AWS_BUCKET_NAME")
+        self.max_pool_connections = max_pool_connections or int(os.getenv("S3_MAX_POOL_CONNECTIONS", 32))
+        self.s3 = s3_client or boto3.client(
+            's3',
+            aws_access_key_id=os.getenv('AWS_ACCESS_KEY'),
+            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+            region_name=os.getenv('AWS_REGION'),
+            config=Config(
+                max_pool_connections=self.max_pool_connections,
+                connect_timeout=float(os.getenv("S3_CONNECT_TIMEOUT", 2)),
+                read_timeout=float(os.getenv("S3_READ_TIMEOUT", 10)),
+                retries={"total_max_attempts": int(os.getenv("S3_MAX_ATTEMPTS", 3)), "mode": "adaptive"},
+                tcp_keepalive=True,
+            )
+        )
+        self.stream_threshold = (
+            stream_threshold if stream_threshold is not None else int(os.getenv("S3_STREAM_JSON_BYTES", 1024 * 1024))
+        )
+        self.cache = cache or RAGCache(
+            max_bytes=int(os.getenv("S3_JOURNAL_CACHE_BYTES", 64 * 1024 * 1024)),
+            max_entries=int(os.getenv("S3_JOURNAL_CACHE_ENTRIES", 1000)),
+            ttl_seconds=float(os.getenv("S3_JOURNAL_CACHE_TTL_SECONDS", 24 * 3600)),
+            sizeof=lambda cached: cached.size,
+            name="journals",
+        )
+        self._lock = threading.Lock()
+        self._not_modified = 0
+        self._downloads = 0
+        self._downloaded_bytes = 0
+
+    @staticmethod
+    def key(child_id: str) -> str:
+        return f"{JOURNAL_PREFIX}{child_id}.json"
+
+    def list_children(self, page_size: int = 1000) -> Iterator[Tuple[str, str]]:
+        """Yield (child_id, ETag) for every journal in the bucket, one listing page at a time.
+
+        Raises:
+            JournalLoadError: The bucket could not be listed
+        """
+        paginator = self.s3.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=self.bucket_name, Prefix=JOURNAL_PREFIX, PaginationConfig={"PageSize": page_size}
+        )
+        try:
+            for page in pages:
+                for obj in page.get("Contents", ()):
+                    name = obj["Key"][len(JOURNAL_PREFIX):]
+                    if name.endswith(".json") and "/" not in name:
+                        yield name[:-len(".json")], obj["ETag"]
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            raise JournalLoadError(f"Could not list journals in {self.bucket_name}: {code} {e}") from e
+        except BotoCoreError as e:
+            raise JournalLoadError(f"Could not reach S3 to list journals: {e}") from e
+
+    def head(self, child_id: str) -> str:
+        """Return the ETag of a child's journal without downloading it."""
+        try:
+            response = self.s3.head_object(Bucket=self.bucket_name, Key=self.key(child_id))
+        except ClientError as e:
+            raise self._error(child_id, e) from e
+        except BotoCoreError as e:
+            raise JournalLoadError(f"Could not reach S3 for child {child_id}: {e}") from e
+        return response['ETag']
+
+    def load(self, child_id: str) -> Tuple[List[Dict], str]:
+        """Return a child's journal and its ETag, downloading it only if it changed.
+
+        The returned list may be shared with the cache and must not be modified.
+        """
+        cached = self.cache.get(child_id)
+        request = {"Bucket": self.bucket_name, "Key": self.key(child_id)}
+        if cached is not None:
+            request["IfNoneMatch"] = cached.etag
+
+        try:
+            response = self.s3.get_object(**request)
+            journal = self._parse(response['Body'], response.get('ContentLength', 0))
+        except ClientError as e:
+            if cached is not None and e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 304:
+                with self._lock:
+                    self._not_modified += 1
+                return cached.journal, cached.etag
+            raise self._error(child_id, e) from e
+        except BotoCoreError as e:
+            raise JournalLoadError(f"Could not reach S3 for child {child_id}: {e}") from e
+        except JSON_ERRORS as e:
+            raise JournalLoadError(f"Journal of child {child_id} is not valid JSON: {e}") from e
+
+        size = response.get('ContentLength', 0)
+        with self._lock:
+            self._downloads += 1
+            self._downloaded_bytes += size
+        etag = response['ETag']
+        # Parsed objects take several times the JSON size in memory
+        self.cache.put(child_id, _CachedJournal(journal, etag, size * 4))
+        return journal, etag
+
+    def _parse(self, body, size: int) -> List[Dict]:
+        if ijson is not None and size > self.stream_threshold:
+            # Entries are built as the body streams in instead of after a full read
+            return list(ijson.items(body, "item", use_float=True))
+        return json.loads(body.read())
+
+    @staticmethod
+    def _error(child_id: str, e: ClientError) -> Exception:
+        code = e.response.get("Error", {}).get("Code")
+        if code in NOT_FOUND_CODES:
+            return JournalNotFound(f"No journal for child {child_id}")
+        return JournalLoadError(f"Could not load journal of child {child_id}: {code} {e}")
+
+    def prefetch(self, child_ids: Iterable[str], max_workers: Optional[int] = None) -> Dict[str, Union[str, Exception]]:
+        """Load several journals concurrently into the cache.
+
+        Args:
+            child_ids: Children whose journals to load
+            max_workers: Concurrent downloads, at most the connection pool size
+
+        Returns:
+            The ETag loaded per child, or the exception its load raised
+        """
+        child_ids = list(dict.fromkeys(child_ids))
+        if not child_ids:
+            return {}
+        workers = min(max_workers or self.max_pool_connections, self.max_pool_connections, len(child_ids))
+
+        def load_one(child_id):
+            try:
+                return self.load(child_id)[1]
+            except (JournalNotFound, JournalLoadError) as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="journal-prefetch") as pool:
+            results = dict(zip(child_ids, pool.map(load_one, child_ids)))
+        failed = sum(isinstance(result, Exception) for result in results.values())
+        logger.info(f"Prefetched {len(child_ids) - failed}/{len(child_ids)} journals")
+        return results
+
+    def invalidate(self, child_id: str) -> bool:
+        return self.cache.invalidate(child_id)
+
+    def stats(self) -> Dict:
+        stats = self.cache.stats()
+        with self._lock:
+            stats.update({
+                "not_modified": self._not_modified,
+                "downloads": self._downloads,
+                "downloaded_bytes": self._downloaded_bytes,
+                "streaming_parser": ijson is not None,
+            })
+        return stats
@@ -0,0 +1,510 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import hashlib
+import functools
+import logging
+import threading
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Set
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+from metrics import LLM_CALLS, LLM_IN_FLIGHT, LLM_QUEUE_DEPTH, LLM_QUEUE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class LLMOverloaded(Exception):
+    """The call was shed: the queue is full or it could not start before its deadline."""
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """Whether an error from a chat model is the provider's rate limit (HTTP 429)."""
+    if getattr(error, "status_code", None) == 429 or getattr(error, "code", None) == 429:
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return "429" in text or "resourceexhausted" in text or "resource exhausted" in text or "rate limit" in text
+
+
+def estimate_tokens(messages: List[BaseMessage]) -> int:
+    """Rough prompt size in tokens, about four characters per token."""
+    return sum(len(str(message.content)) for message in messages) // 4 + 1
+
+
+class _Ticket:
+    __slots__ = ("priority", "seq", "tokens", "deadline", "queued_at", "state", "grant")
+
+    def __init__(self, priority: int, seq: int, tokens: int, deadline: float, grant: Callable[[Optional[Exception]], None]):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.deadline = deadline
+        self.queued_at = time.monotonic()
+        # waiting -> granted | expired
+        self.state = "waiting"
+        self.grant = grant
+
+    def __lt__(self, other: "_Ticket") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        max_in_flight: int = 4,
+        tokens_per_minute: int = 0,
+        max_queue: int = 100,
+        queue_timeout: float = 10,
+        expected_output_tokens: int = 256,
+        max_retries: int = 3,
+        backoff_seconds: float = 1.0,
+    ):
+        """Admission control for calls to a rate-limited chat model.
+
+        Calls wait in a bounded priority queue for one of max_in_flight
+        slots and, with a token budget, for enough tokens in a bucket that
+        refills at tokens_per_minute. A call that cannot start within its
+        queue timeout, or arrives while the queue is full, fails at once
+        with LLMOverloaded instead of piling up. A 429 from the provider
+        pauses all admissions for an exponentially growing backoff and
+        puts the call back in the queue. Identical calls in flight at the
+        same time are coalesced into one.
+
+        Args:
+            max_in_flight: Calls running at once
+            tokens_per_minute: Token budget (prompt estimate plus expected output), 0 for none
+            max_queue: Calls allowed to wait; further calls are rejected
+            queue_timeout: Default seconds a call may wait for a slot
+            expected_output_tokens: Output tokens charged per call before its real usage is known
+            max_retries: Retries of a call after rate-limit errors
+            backoff_seconds: First backoff after a rate-limit error, doubled per retry
+        """
+        self.max_in_flight = max_in_flight
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.expected_output_tokens = expected_output_tokens
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+
+        self._lock = threading.Lock()
+        self._queue: List[_Ticket] = []
+        self._seq = 0
+        self._waiting = 0
+        self._in_flight = 0
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self._timer_at = 0.0
+        self._inflight_calls: Dict[str, Future] = {}
+        # Coalesced async calls, referenced until done since their callers may go away
+        self._call_tasks: Set[asyncio.Task] = set()
+        self._counts = {outcome: 0 for outcome in ("admitted", "coalesced", "rejected", "expired", "rate_limited", "failed")}
+
+    @classmethod
+    def from_env(cls) -> Optional["LLMScheduler"]:
+        """Create a scheduler from LLM_* environment variables, or None if LLM_SCHEDULER_ENABLED is off."""
+        if os.getenv("LLM_SCHEDULER_ENABLED", "true").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            max_in_flight=int(os.getenv("LLM_MAX_IN_FLIGHT", 4)),
+            tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", 0)),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", 100)),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", 10)),
+            expected_output_tokens=int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", 256)),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", 3)),
+            backoff_seconds=float(os.getenv("LLM_BACKOFF_SECONDS", 1.0)),
+        )
+
+    # Admission
+
+    def _count(self, outcome: str):
+        self._counts[outcome] += 1
+        LLM_CALLS.labels(outcome).inc()
+
+    def _submit(self, tokens: int, priority: int, timeout: Optional[float], grant) -> _Ticket:
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                self._count("rejected")
+                raise LLMOverloaded(f"LLM queue is full ({self.max_queue} calls waiting)")
+            self._seq += 1
+            timeout = self.queue_timeout if timeout is None else timeout
+            ticket = _Ticket(priority, self._seq, tokens, time.monotonic() + timeout, grant)
+            heapq.heappush(self._queue, ticket)
+            self._waiting += 1
+            ready = self._dispatch()
+        self._notify(ready)
+        return ticket
+
+    def _dispatch(self) -> List[tuple]:
+        """Grant slots to queued calls in priority order; call with the lock held."""
+        now = time.monotonic()
+        if self.tokens_per_minute:
+            self._tokens = min(
+                self.tokens_per_minute,
+                self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60,
+            )
+            self._refilled_at = now
+
+        ready = []
+        while self._queue:
+            ticket = self._queue[0]
+            if ticket.state != "waiting":
+                heapq.heappop(self._queue)
+                continue
+            if ticket.deadline <= now:
+                heapq.heappop(self._queue)
+                self._expire(ticket)
+                ready.append((ticket, LLMOverloaded("LLM call could not start before its deadline")))
+                continue
+            if self._in_flight >= self.max_in_flight:
+                break
+            cost = min(ticket.tokens, self.tokens_per_minute)
+            start_at = self._paused_until
+            if self.tokens_per_minute and self._tokens < cost:
+                start_at = max(start_at, now + (cost - self._tokens) * 60 / self.tokens_per_minute)
+            if start_at > ticket.deadline:
+                # Shed now rather than after the caller waited out its whole deadline
+                heapq.heappop(self._queue)
+                self._expire(ticket)
+                ready.append((ticket, LLMOverloaded("LLM budget exhausted until after the call's deadline")))
+                continue
+            if start_at > now:
+                self._wake_at(start_at)
+                break
+
+            heapq.heappop(self._queue)
+            ticket.state = "granted"
+            self._waiting -= 1
+            self._in_flight += 1
+            if self.tokens_per_minute:
+                self._tokens -= cost
+            self._count("admitted")
+            LLM_QUEUE_SECONDS.observe(now - ticket.queued_at)
+            ready.append((ticket, None))
+
+        LLM_QUEUE_DEPTH.set(self._waiting)
+        LLM_IN_FLIGHT.set(self._in_flight)
+        return ready
+
+    def _expire(self, ticket: _Ticket):
+        ticket.state = "expired"
+        self._waiting -= 1
+        self._count("expired")
+
+    def _wake_at(self, at: float):
+        # One timer, for the earliest time the head of the queue could start
+        if self._timer is not None and self._timer_at <= at:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_at = at
+        self._timer = threading.Timer(max(at - time.monotonic(), 0), self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            ready = self._dispatch()
+        self._notify(ready)
+
+    @staticmethod
+    def _notify(ready: List[tuple]):
+        for ticket, error in ready:
+            ticket.grant(error)
+
+    def _give_up(self, ticket: _Ticket) -> bool:
+        """Withdraw a waiting call at its deadline. False if it was granted meanwhile."""
+        with self._lock:
+            if ticket.state == "granted":
+                return False
+            if ticket.state == "waiting":
+                self._expire(ticket)
+                LLM_QUEUE_DEPTH.set(self._waiting)
+            return True
+
+    def acquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE, timeout: Optional[float] = None) -> _Ticket:
+        """Block until the call may start; raises LLMOverloaded if it may not."""
+        granted = threading.Event()
+        errors: List[Exception] = []
+
+        def grant(error):
+            if error is not None:
+                errors.append(error)
+            granted.set()
+
+        ticket = self._submit(tokens, priority, timeout, grant)
+        if not granted.wait(max(ticket.deadline - time.monotonic(), 0)) and self._give_up(ticket):
+            raise LLMOverloaded("LLM call could not start before its deadline")
+        if errors:
+            raise errors[0]
+        return ticket
+
+    async def aacquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE, timeout: Optional[float] = None) -> _Ticket:
+        """Wait without blocking the event loop until the call may start."""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def grant(error):
+            def resolve():
+                if not granted.done():
+                    granted.set_exception(error) if error is not None else granted.set_result(None)
+            loop.call_soon_threadsafe(resolve)
+
+        ticket = self._submit(tokens, priority, timeout, grant)
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), max(ticket.deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            if self._give_up(ticket):
+                raise LLMOverloaded("LLM call could not start before its deadline")
+        except asyncio.CancelledError:
+            # The caller went away; free the slot if it was granted meanwhile
+            if not self._give_up(ticket):
+                self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: _Ticket, used_tokens: Optional[int] = None):
+        """Free a call's slot, correcting the token budget by its real usage."""
+        with self._lock:
+            self._in_flight -= 1
+            if self.tokens_per_minute and used_tokens is not None:
+                self._tokens -= used_tokens - ticket.tokens
+            ready = self._dispatch()
+        self._notify(ready)
+
+    def rate_limited(self, attempt: int) -> float:
+        """Pause all admissions after a 429 and return the pause in seconds."""
+        backoff = min(self.backoff_seconds * 2 ** attempt, 30) * random.uniform(0.8, 1.2)
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + backoff)
+            # The budget was evidently overestimated; start refilling from empty
+            if self.tokens_per_minute:
+                self._tokens = min(self._tokens, 0)
+            self._count("rate_limited")
+        logger.warning(f"LLM rate limited, pausing new calls for {backoff:.1f}s")
+        return backoff
+
+    @contextmanager
+    def slot(self, tokens: int, priority: int = PRIORITY_INTERACTIVE, timeout: Optional[float] = None) -> Iterator[_Ticket]:
+        ticket = self.acquire(tokens, priority, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def aslot(self, tokens: int, priority: int = PRIORITY_INTERACTIVE, timeout: Optional[float] = None):
+        ticket = await self.aacquire(tokens, priority, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    # Running calls
+
+    def run(self, call: Callable[[], AIMessage], tokens: int, priority: int = PRIORITY_INTERACTIVE, timeout: Optional[float] = None) -> AIMessage:
+        """Run a chat model call under the scheduler, retrying it after rate-limit errors."""
+        for attempt in range(self.max_retries + 1):
+            ticket = self.acquire(tokens, priority, timeout)
+            used = None
+            try:
+                message = call()
+                used = _used_tokens(message)
+                return message
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    self.record_failure()
+                    raise
+                # Back in the queue; the pause keeps it (and everyone else) waiting
+                self.rate_limited(attempt)
+            finally:
+                self.release(ticket, used)
+
+    async def arun(self, call: Callable[[], Awaitable[AIMessage]], tokens: int, priority: int = PRIORITY_INTERACTIVE, timeout: Optional[float] = None) -> AIMessage:
+        for attempt in range(self.max_retries + 1):
+            ticket = await self.aacquire(tokens, priority, timeout)
+            used = None
+            try:
+                message = await call()
+                used = _used_tokens(message)
+                return message
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    self.record_failure()
+                    raise
+                self.rate_limited(attempt)
+            finally:
+                self.release(ticket, used)
+
+    def record_failure(self):
+        with self._lock:
+            self._count("failed")
+
+    def coalesce(self, key: str, call: Callable[[], Any]) -> Any:
+        """Run call, or wait for the identical call already running under key."""
+        with self._lock:
+            future = self._inflight_calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight_calls[key] = Future()
+                # A running future cannot be cancelled by one of its waiters
+                future.set_running_or_notify_cancel()
+            else:
+                self._count("coalesced")
+        if not leader:
+            return future.result()
+        try:
+            result = call()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight_calls.pop(key, None)
+
+    async def acoalesce(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Async coalesce; the call runs as its own task, so a cancelled caller cancels it for nobody else."""
+        with self._lock:
+            future = self._inflight_calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight_calls[key] = Future()
+                future.set_running_or_notify_cancel()
+            else:
+                self._count("coalesced")
+        if not leader:
+            # The future is running, so a cancelled follower only stops waiting on it
+            return await asyncio.wrap_future(future)
+        task = asyncio.ensure_future(call())
+        self._call_tasks.add(task)
+        task.add_done_callback(functools.partial(self._finish_call, key, future))
+        return await asyncio.shield(task)
+
+    def _finish_call(self, key: str, future: Future, task: asyncio.Task):
+        self._call_tasks.discard(task)
+        with self._lock:
+            self._inflight_calls.pop(key, None)
+        if task.cancelled():
+            future.set_exception(asyncio.CancelledError())
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "queued": self._waiting,
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "tokens_per_minute": self.tokens_per_minute,
+                "tokens_available": round(self._tokens, 1) if self.tokens_per_minute else None,
+                "paused_seconds": round(max(self._paused_until - time.monotonic(), 0), 3),
+                **self._counts,
+            }
+
+
+def _used_tokens(message: AIMessage) -> Optional[int]:
+    usage = getattr(message, "usage_metadata", None)
+    return usage.get("total_tokens") if usage else None
+
+
+class ScheduledChatModel(BaseChatModel):
+    """Chat model running every call of a wrapped model through an LLMScheduler.
+
+    Non-streaming calls with identical messages and options that overlap
+    in time are sent once and share the answer. Streams are admitted like
+    any call but never coalesced, and are only retried after a rate-limit
+    error if nothing had been streamed yet.
+    """
+
+    model: BaseChatModel
+    scheduler: LLMScheduler
+    priority: int = PRIORITY_INTERACTIVE
+    queue_timeout: Optional[float] = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @property
+    def _llm_type(self) -> str:
+        return f"scheduled-{self.model._llm_type}"
+
+    def with_priority(self, priority: int) -> "ScheduledChatModel":
+        """A view of this model whose calls queue with another priority, sharing the scheduler."""
+        return ScheduledChatModel(model=self.model, scheduler=self.scheduler, priority=priority, queue_timeout=self.queue_timeout)
+
+    def _tokens(self, messages: List[BaseMessage]) -> int:
+        return estimate_tokens(messages) + self.scheduler.expected_output_tokens
+
+    def _key(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict) -> str:
+        payload = repr((self.model._llm_type, [(m.type, m.content) for m in messages], stop, sorted(kwargs.items())))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        def call():
+            return self.scheduler.run(
+                lambda: self.model.invoke(messages, stop=stop, **kwargs),
+                self._tokens(messages), self.priority, self.queue_timeout,
+            )
+        message = self.scheduler.coalesce(self._key(messages, stop, kwargs), call)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        async def call():
+            return await self.scheduler.arun(
+                lambda: self.model.ainvoke(messages, stop=stop, **kwargs),
+                self._tokens(messages), self.priority, self.queue_timeout,
+            )
+        message = await self.scheduler.acoalesce(self._key(messages, stop, kwargs), call)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for attempt in range(self.scheduler.max_retries + 1):
+            started = False
+            with self.scheduler.slot(self._tokens(messages), self.priority, self.queue_timeout):
+                try:
+                    for chunk in self.model.stream(messages, stop=stop, **kwargs):
+                        started = True
+                        if run_manager and chunk.content:
+                            run_manager.on_llm_new_token(chunk.content)
+                        yield ChatGenerationChunk(message=chunk)
+                    return
+                except Exception as e:
+                    if started or not is_rate_limit_error(e) or attempt == self.scheduler.max_retries:
+                        self.scheduler.record_failure()
+                        raise
+                    self.scheduler.rate_limited(attempt)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        for attempt in range(self.scheduler.max_retries + 1):
+            started = False
+            async with self.scheduler.aslot(self._tokens(messages), self.priority, self.queue_timeout):
+                try:
+                    async for chunk in self.model.astream(messages, stop=stop, **kwargs):
+                        started = True
+                        if run_manager and chunk.content:
+                            await run_manager.on_llm_new_token(chunk.content)
+                        yield ChatGenerationChunk(message=chunk)
+                    return
+                except Exception as e:
+                    if started or not is_rate_limit_error(e) or attempt == self.scheduler.max_retries:
+                        self.scheduler.record_failure()
+                        raise
+                    self.scheduler.rate_limited(attempt)
@@ -1,12 +1,22 @@
-import asyncio
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
-from typing import Optional, Dict
+from typing import List, Optional
 import os
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 
 from child_journal_rag import ChildJournalRAG  # Import the previous RAG class
+from journal_loader import JournalLoadError
+from llm_scheduler import LLMOverloaded
+from rag_cache import RAGCache
+from concurrency import SingleFlight, load_executor, run_blocking
+from growth_engine import GrowthEngine
+from growth_curves import DEFAULT_POINTS, GrowthCurves
+from metrics import metrics_payload, register_stats, track_request
+from warmup import Readiness, startup_mode, warm_up
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,97 +26,133 @@ logger = logging.getLogger(__name__)
 class QueryRequest(BaseModel):
     child_id: str
     query: str
+    session_id: Optional[str] = None
 
 class QueryResponse(BaseModel):
     answer: str
     sources: list
     error: Optional[str] = None
 
+class GrowthMeasurement(BaseModel):
+    sex: str
+    age_days: float
+    weight_kg: Optional[float] = None
+    height_cm: Optional[float] = None
+
+class GrowthRequest(BaseModel):
+    measurements: List[GrowthMeasurement]
+
 # Global variables for storing initialized components
 rag_system: Optional[ChildJournalRAG] = None
-rag_chains: Dict = {}
+rag_chains = RAGCache.from_env(name="rag_chains")
+chain_loads = SingleFlight()
+growth_engine: Optional[GrowthEngine] = None
+growth_curves: Optional[GrowthCurves] = None
+readiness = Readiness()
+
+# Upper bound on measurements per /growth/zscores call
+MAX_GROWTH_MEASUREMENTS = int(os.getenv("MAX_GROWTH_MEASUREMENTS", 10000))
 
 # Startup and shutdown events
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Initialize RAG system on startup
-    global rag_system
+    global rag_system, growth_engine, growth_curves
     try:
         rag_system = ChildJournalRAG()
+        register_stats("sessions", rag_system.sessions.stats)
+        register_stats("journals", rag_system.journals.stats)
+        if rag_system.answer_cache is not None:
+            register_stats("semantic_answers", rag_system.answer_cache.stats)
+        if rag_system.shared_index is not None:
+            register_stats("shared_index", rag_system.shared_index.stats)
         logger.info("RAG system initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize RAG system: {e}")
         raise e
+
+    try:
+        growth_engine = GrowthEngine()
+        growth_curves = GrowthCurves(growth_engine)
+    except Exception as e:
+        # Journal queries still work without the WHO tables
+        logger.error(f"Failed to load WHO growth tables: {e}")
+
+    # Load models and hot children without holding up liveness, unless asked to
+    warmup = asyncio.create_task(warm_up(rag_system, get_child_rag_chain, readiness))
+    if startup_mode() == "eager":
+        await warmup
     
     yield
     
     # Cleanup on shutdown
+    warmup.cancel()
     rag_chains.clear()
+    if rag_system.shared_index is not None:
+        rag_system.shared_index.close()
+    load_executor.shutdown(wait=False)
     logger.info("Cleaned up RAG chains")
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+app.middleware("http")(track_request)
+
+register_stats("rag_chains", rag_chains.stats)
 
 # Helper function to initialize or get RAG chain for a child
-async def get_child_rag_chain(child_id: str) -> tuple:
-    """Initialize or retrieve RAG chain for a specific child."""
-    if child_id not in rag_chains:
-        try:
-            # Load journal data
-            journal_data = rag_system.load_journal_from_s3(child_id)
-            if not journal_data:
-                raise HTTPException(status_code=404, detail="Child journal not found")
-            
-            # Prepare documents and create vector store
-            print("\n\n\n")
-            documents = rag_system.prepare_documents(journal_data)
-            vector_store = rag_system.create_vector_store(documents)
-            # Setup RAG chain
-            chain = rag_system.setup_rag_chain(vector_store)
-            print("\n\n\n")
-
-            print("\nchain", chain)
-
-            rag_chains[child_id] = chain
-            logger.info(f"Initialized RAG chain for child {child_id}")
-            
-        except Exception as e:
-            logger.error(f"Error initializing RAG chain for child {child_id}: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
+async def get_child_rag_chain(child_id: str):
+    """Initialize or retrieve RAG chain for a specific child.
     
-    return rag_chains[child_id]
+    Concurrent first requests for the same child wait on a single load.
+    """
+    chain = rag_chains.get(child_id)
+    if chain is None:
+        chain = await chain_loads.do(child_id, lambda: load_child_rag_chain(child_id))
+    return chain
 
-# Background task to clean up old RAG chains
-async def cleanup_old_chains(child_id: str):
-    """Remove RAG chain after some time to free up memory."""
-    await asyncio.sleep(3600)  # Keep chain for 1 hour
-    if child_id in rag_chains:
-        del rag_chains[child_id]
-        logger.info(f"Cleaned up RAG chain for child {child_id}")
+async def load_child_rag_chain(child_id: str):
+    """Build a child's RAG chain with the blocking work on the load executor."""
+    try:
+        # Load the persisted index, or build it from the journal
+        vector_store = await run_blocking(load_executor, rag_system.get_vector_store, child_id)
+        if vector_store is None:
+            raise HTTPException(status_code=404, detail="Child journal not found")
+        
+        # Setup RAG chain
+        chain = rag_system.setup_rag_chain(vector_store)
+        rag_chains.put(child_id, chain)
+        logger.info(f"Initialized RAG chain for child {child_id}")
+        return chain
+        
+    except HTTPException:
+        raise
+    except JournalLoadError as e:
+        # S3 is failing, which is not the same as the child having no journal
+        logger.error(f"Could not load journal of child {child_id}: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        logger.error(f"Error initializing RAG chain for child {child_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/query", response_model=QueryResponse)
-async def query_journal(
-    request: QueryRequest,
-    background_tasks: BackgroundTasks
-):
+async def query_journal(request: QueryRequest):
     """
     Query a child's journal with a specific question.
     
     Args:
         request: QueryRequest containing child_id and query
-        background_tasks: FastAPI BackgroundTasks for cleanup
     
     Returns:
         QueryResponse containing the answer and sources
     """
     try:
-        # Get or initialize RAG chain
+        # Get or initialize RAG chain; idle chains expire via the cache TTL
         chain = await get_child_rag_chain(request.child_id)
         
-        # Schedule cleanup
-        background_tasks.add_task(cleanup_old_chains, request.child_id)
-        
         # Process query
-        result = rag_system.query_journal(chain, request.query)
+        # Requests without a session id are answered as standalone questions
+        session = rag_system.sessions.get(request.child_id, request.session_id) if request.session_id else None
+        result = await rag_system.aquery_journal(chain, request.query, session, request.child_id)
         
         return QueryResponse(
             answer=result["answer"],
@@ -116,11 +162,131 @@ async def query_journal(
         
     except HTTPException as he:
         raise he
+    except LLMOverloaded as e:
+        # Shed before waiting on a saturated model; clients should retry later
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Error processing query: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.delete("/cache/{child_id}")
+async def invalidate_child(child_id: str):
+    """Drop a child's cached RAG chain and answers, e.g. after their journal changed."""
+    rag_system.invalidate_child(child_id)
+    return {"child_id": child_id, "invalidated": rag_chains.invalidate(child_id)}
+
+@app.post("/growth/zscores")
+def growth_zscores(request: GrowthRequest):
+    """
+    Compute WHO z-scores and percentiles for a batch of measurements.
+
+    Each measurement gets weight-for-age, length/height-for-age, BMI-for-age
+    and weight-for-length (under two years) or weight-for-height; indicators
+    that are missing inputs or out of the WHO range are null.
+
+    Args:
+        request: GrowthRequest with sex ('male'/'female'), age in days, weight and height per measurement
+
+    Returns:
+        One result per measurement, in order
+    """
+    if growth_engine is None:
+        raise HTTPException(status_code=503, detail="Growth tables not loaded")
+    measurements = request.measurements
+    if len(measurements) > MAX_GROWTH_MEASUREMENTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_GROWTH_MEASUREMENTS} measurements per call")
+
+    nan = float("nan")
+    try:
+        results = growth_engine.assess(
+            sex=[m.sex for m in measurements],
+            age_days=[m.age_days for m in measurements],
+            weight_kg=[nan if m.weight_kg is None else m.weight_kg for m in measurements],
+            height_cm=[nan if m.height_cm is None else m.height_cm for m in measurements],
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # NaN is not valid JSON; convert whole columns before building rows
+    columns = {
+        indicator: (
+            [None if z != z else round(z, 3) for z in values["z"].tolist()],
+            [None if p != p else round(p, 2) for p in values["percentile"].tolist()],
+        )
+        for indicator, values in results.items()
+    }
+    return {
+        "results": [
+            {indicator: {"z": zs[i], "percentile": ps[i]} for indicator, (zs, ps) in columns.items()}
+            for i in range(len(measurements))
+        ]
+    }
+
+@app.get("/growth/curves/{indicator}/{sex}")
+def growth_curve(
+    indicator: str,
+    sex: str,
+    request: Request,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    points: int = DEFAULT_POINTS
+):
+    """
+    Serve WHO SD3neg..SD3 reference curves for a growth chart.
+
+    Args:
+        indicator: wfa, lhfa, bmi (x in days) or wfl, wfh (x in cm)
+        sex: 'male' or 'female'
+        start: First x of the window, defaults to the start of the table
+        end: Last x of the window, defaults to the end of the table
+        points: Most points per curve, the window is downsampled to fit
+
+    Returns:
+        Columnar JSON with an ETag; a matching If-None-Match gets 304
+    """
+    if growth_curves is None:
+        raise HTTPException(status_code=503, detail="Growth tables not loaded")
+    try:
+        etag, body = growth_curves.get(indicator, sex, start, end, points)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # The curves only change with a redeploy of the WHO tables
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/metrics")
+async def metrics():
+    """Expose stage latencies, request latencies and cache counters to Prometheus."""
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process is up and serving requests."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_probe():
+    """Readiness probe: 200 once the models and hot children are loaded, 503 before."""
+    return JSONResponse(readiness.snapshot(), status_code=200 if readiness.ready else 503)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {"status": "healthy", "rag_system": rag_system is not None}
\ No newline at end of file
+    return {
+        "status": "healthy",
+        "readiness": readiness.snapshot(),
+        "rag_system": rag_system is not None,
+        "growth_engine": growth_engine is not None,
+        "growth_curves": growth_curves.stats() if growth_curves else None,
+        "cache": rag_chains.stats(),
+        "embeddings": rag_system.embeddings.stats() if rag_system else None,
+        "sessions": rag_system.sessions.stats() if rag_system else None,
+        "answer_cache": rag_system.answer_cache.stats() if rag_system and rag_system.answer_cache else None,
+        "llm_scheduler": rag_system.llm_scheduler.stats() if rag_system and rag_system.llm_scheduler else None
+    }
\ No newline at end of file
@@ -0,0 +1,189 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # Tracing is optional
+    otel_trace = None
+
+logger = logging.getLogger(__name__)
+
+# From a cached FAISS search (~1 ms) to a cold index build or a slow LLM call
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds",
+    "Time spent in one stage of loading a journal or answering a question",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "rag_http_request_seconds",
+    "HTTP request latency until the response starts",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+CACHE_LOOKUPS = Counter(
+    "rag_lookups_total",
+    "Lookups in caches without their own counters, by result",
+    ["cache", "result"],
+)
+
+LLM_QUEUE_SECONDS = Histogram(
+    "rag_llm_queue_seconds",
+    "Time LLM calls waited for a slot in the scheduler",
+    buckets=LATENCY_BUCKETS,
+)
+LLM_CALLS = Counter(
+    "rag_llm_calls_total",
+    "LLM calls seen by the scheduler, by outcome",
+    ["outcome"],
+)
+LLM_QUEUE_DEPTH = Gauge("rag_llm_queue_depth", "LLM calls waiting for a slot")
+LLM_IN_FLIGHT = Gauge("rag_llm_in_flight", "LLM calls currently running")
+
+TRACING_ENABLED = otel_trace is not None and os.getenv("RAG_TRACING", "false").lower() in ("1", "true", "yes")
+_tracer = otel_trace.get_tracer("child_journal_rag") if TRACING_ENABLED else None
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Time a block into rag_stage_seconds and, with RAG_TRACING, a trace span.
+
+    Spans come from OpenTelemetry's global tracer provider, so they nest under
+    whatever span is current and go wherever the provider exports them.
+    """
+    span = _tracer.start_as_current_span(name, attributes=attributes) if _tracer else nullcontext()
+    started = time.perf_counter()
+    with span:
+        try:
+            yield
+        finally:
+            STAGE_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+def record_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+class StageTimingCallback(BaseCallbackHandler):
+    """LangChain callback timing the retrieval and LLM calls inside a chain."""
+
+    run_inline = True
+
+    def __init__(self):
+        self._runs: Dict[UUID, Tuple[str, float, Any]] = {}
+
+    def _start(self, name: str, run_id: UUID):
+        span = _tracer.start_span(name) if _tracer else None
+        self._runs[run_id] = (name, time.perf_counter(), span)
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        name, started, span = run
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - started)
+        if span is not None:
+            if error is not None:
+                span.record_exception(error)
+            span.end()
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start("retrieval", run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start("llm", run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start("llm", run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+class _StatsCollector:
+    """Export the stats() counters of the in-process caches at scrape time."""
+
+    def __init__(self):
+        self._sources: Dict[str, Callable[[], Dict]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, stats: Callable[[], Dict]):
+        with self._lock:
+            self._sources[name] = stats
+
+    def collect(self):
+        hits = CounterMetricFamily("rag_cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("rag_cache_misses", "Cache misses", labels=["cache"])
+        evictions = CounterMetricFamily("rag_cache_evictions", "Entries evicted to stay within bounds", labels=["cache"])
+        entries = GaugeMetricFamily("rag_cache_entries", "Entries currently cached", labels=["cache"])
+        size = GaugeMetricFamily("rag_cache_bytes", "Estimated bytes currently cached", labels=["cache"])
+        with self._lock:
+            sources = list(self._sources.items())
+        for name, stats_fn in sources:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                logger.warning(f"Could not read stats of {name}: {e}")
+                continue
+            if "hits" in stats:
+                hits.add_metric([name], stats["hits"])
+                # The semantic cache counts lookups rather than misses
+                misses.add_metric([name], stats.get("misses", stats.get("lookups", 0) - stats["hits"]))
+            if "evictions" in stats:
+                evictions.add_metric([name], stats["evictions"])
+            if "entries" in stats:
+                entries.add_metric([name], stats["entries"])
+            if "bytes" in stats:
+                size.add_metric([name], stats["bytes"])
+        return [hits, misses, evictions, entries, size]
+
+
+_collector = _StatsCollector()
+REGISTRY.register(_collector)
+
+
+def register_stats(name: str, stats: Callable[[], Dict]):
+    """Export a cache's stats() (hits, misses, evictions, entries, bytes) on /metrics."""
+    _collector.register(name, stats)
+
+
+async def track_request(request, call_next):
+    """HTTP middleware observing rag_http_request_seconds per route template."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_SECONDS.labels(
+            request.method,
+            getattr(route, "path", "unmatched"),
+            str(status),
+        ).observe(time.perf_counter() - started)
+
+
+def metrics_payload() -> Tuple[bytes, str]:
+    """Return the Prometheus exposition of every metric and its content type."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,301 @@
+"""ONNX Runtime embeddings for sentence-transformers models, plus export and parity tools.
+
+Export MiniLM to ONNX and quantize it to int8 (needs torch and transformers):
+
+    python onnx_embeddings.py export --model all-MiniLM-L6-v2 --out onnx_models/all-MiniLM-L6-v2
+
+Compare the exported model against the PyTorch reference before switching
+EMBEDDINGS_BACKEND to onnx:
+
+    python onnx_embeddings.py check --model-dir onnx_models/all-MiniLM-L6-v2
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+
+# Thresholds for calling a backend interchangeable with the reference
+MIN_COSINE = 0.99
+MIN_RECALL = 0.95
+
+
+def default_model_dir(model_name: str) -> Path:
+    return Path(os.getenv("ONNX_MODEL_DIR", Path("onnx_models") / model_name.split("/")[-1]))
+
+
+def resolve_model_file(model_dir: Path, model_file: Optional[str] = None) -> str:
+    """Model file OnnxEmbeddings loads from model_dir: model_file, ONNX_MODEL_FILE, else int8 if exported."""
+    model_file = model_file or os.getenv("ONNX_MODEL_FILE")
+    if model_file is None:
+        model_file = INT8_FILE if (model_dir / INT8_FILE).exists() else FP32_FILE
+    return model_file
+
+
+def model_identifier(model_dir: Path, model_file: Optional[str] = None) -> str:
+    """Identify the vectors of an exported model; int8 and fp32 files differ slightly."""
+    return f"onnx:{model_dir.name}/{resolve_model_file(model_dir, model_file)}"
+
+
+class OnnxEmbeddings(Embeddings):
+    def __init__(
+        self,
+        model_dir: Optional[str] = None,
+        model_file: Optional[str] = None,
+        intra_op_threads: Optional[int] = None,
+        max_length: int = 256,
+        batch_size: int = 32,
+        normalize: bool = True,
+    ):
+        """Sentence embeddings computed with ONNX Runtime on the CPU.
+
+        Runs the transformer exported by export_onnx and applies the same
+        mean pooling and L2 normalization as the sentence-transformers
+        MiniLM pipeline, so vectors are interchangeable with
+        HuggingFaceEmbeddings up to quantization error.
+
+        Args:
+            model_dir: Directory with the ONNX model and tokenizer.json, defaults to ONNX_MODEL_DIR
+            model_file: Model file in model_dir, defaults to ONNX_MODEL_FILE, else the int8 model if present
+            intra_op_threads: Threads per inference, defaults to ONNX_INTRA_OP_THREADS or all cores
+            max_length: Longest token sequence; MiniLM was trained on 256
+            batch_size: Texts per inference call
+            normalize: L2-normalize the embeddings
+        """
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("The onnx embeddings backend needs onnxruntime and tokenizers installed") from e
+
+        self.model_dir = Path(model_dir) if model_dir else default_model_dir("all-MiniLM-L6-v2")
+        self.model_path = self.model_dir / resolve_model_file(self.model_dir, model_file)
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.normalize = normalize
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        threads = intra_op_threads if intra_op_threads is not None else int(os.getenv("ONNX_INTRA_OP_THREADS", 0))
+        options.intra_op_num_threads = threads
+        # Parallelism comes from batching and intra-op threads, not concurrent runs
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(self.model_path), options, providers=["CPUExecutionProvider"])
+        self.input_names = {node.name for node in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(str(self.model_dir / TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        logger.info(f"Loaded ONNX embeddings from {self.model_path} with {threads or 'default'} intra-op threads")
+
+    @property
+    def identifier(self) -> str:
+        return model_identifier(self.model_dir, self.model_path.name)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # Batch texts of similar length together to keep padding small
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            embedded = self._embed_batch([texts[i] for i in batch])
+            if vectors.shape[1] == 0:
+                vectors = np.empty((len(texts), embedded.shape[1]), dtype=np.float32)
+            vectors[batch] = embedded
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feed["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        output = self.session.run(None, {name: value for name, value in feed.items() if name in self.input_names})[0]
+        if output.ndim == 3:
+            # Mean pooling over real tokens, as in the sentence-transformers Pooling layer
+            mask = attention_mask[..., None].astype(np.float32)
+            output = (output * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            output = output / np.clip(np.linalg.norm(output, axis=1, keepdims=True), 1e-12, None)
+        return output.astype(np.float32)
+
+
+def export_onnx(model_name: str, out_dir: str, quantize: bool = True, opset: int = 14) -> Path:
+    """Export a sentence-transformers model to ONNX and optionally quantize it to int8.
+
+    Args:
+        model_name: Model id, e.g. all-MiniLM-L6-v2 or sentence-transformers/all-MiniLM-L6-v2
+        out_dir: Directory for model.onnx, model.int8.onnx and the tokenizer
+        quantize: Also write a dynamically quantized int8 model
+        opset: ONNX opset to export with
+
+    Returns:
+        Path of the model OnnxEmbeddings will pick up from out_dir
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    if "/" not in model_name:
+        model_name = f"sentence-transformers/{model_name}"
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    dummy = tokenizer(["An example journal entry."], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+    axes = {0: "batch", 1: "sequence"}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(dummy[name] for name in input_names),
+            str(out / FP32_FILE),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={**{name: axes for name in input_names}, "last_hidden_state": axes},
+            opset_version=opset,
+        )
+    tokenizer.save_pretrained(str(out))
+    print(f"Exported {model_name} to {out / FP32_FILE}")
+
+    if not quantize:
+        return out / FP32_FILE
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(str(out / FP32_FILE), str(out / INT8_FILE), weight_type=QuantType.QInt8)
+    print(f"Quantized to {out / INT8_FILE}")
+    return out / INT8_FILE
+
+
+def parity_check(
+    candidate: Embeddings,
+    reference: Embeddings,
+    documents: List[str],
+    queries: List[str],
+    k: int = 3,
+) -> Dict[str, float]:
+    """Measure how closely a candidate backend reproduces the reference embeddings.
+
+    Compares the vectors directly (cosine similarity per text) and through
+    retrieval: the share of each query's top-k documents under the reference
+    that the candidate also ranks in its top k.
+    """
+    def embed(embeddings, texts):
+        started = time.perf_counter()
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True), time.perf_counter() - started
+
+    ref_docs, ref_seconds = embed(reference, documents)
+    cand_docs, cand_seconds = embed(candidate, documents)
+    ref_queries, _ = embed(reference, queries)
+    cand_queries, _ = embed(candidate, queries)
+
+    cosines = (ref_docs * cand_docs).sum(axis=1)
+    k = min(k, len(documents))
+    ref_top = np.argsort(-ref_queries @ ref_docs.T, axis=1)[:, :k]
+    cand_top = np.argsort(-cand_queries @ cand_docs.T, axis=1)[:, :k]
+    recall = np.mean([len(set(r) & set(c)) / k for r, c in zip(ref_top, cand_top)])
+
+    return {
+        "documents": len(documents),
+        "queries": len(queries),
+        "mean_cosine": float(cosines.mean()),
+        "min_cosine": float(cosines.min()),
+        f"recall_at_{k}": float(recall),
+        "reference_texts_per_second": len(documents) / ref_seconds,
+        "candidate_texts_per_second": len(documents) / cand_seconds,
+    }
+
+
+def parity_passes(report: Dict[str, float], min_cosine: float = MIN_COSINE, min_recall: float = MIN_RECALL) -> bool:
+    recall = next(value for key, value in report.items() if key.startswith("recall_at_"))
+    return report["min_cosine"] >= min_cosine and recall >= min_recall
+
+
+SAMPLE_DOCUMENTS = [
+    "She started walking without support and now climbs the stairs holding the rail.",
+    "We read picture books every evening; his favourite is the one about the hungry caterpillar.",
+    "He had a mild fever for two days after the vaccination and slept a lot.",
+    "She learned to count to ten and likes counting the steps at the park.",
+    "Tried broccoli and carrots at dinner, refused the broccoli but ate all the carrots.",
+    "He began saying short sentences like 'more milk please' and 'daddy gone'.",
+    "Slept through the night for the first time this month, from eight until six.",
+    "Drew circles and lines with crayons and asked us to hang the drawing on the fridge.",
+    "Visited the grandparents for a week and played in the garden every day.",
+    "Built towers from blocks, up to seven blocks high before knocking them over.",
+    "Sang songs from daycare at bath time, mostly the one about the wheels on the bus.",
+    "Her height was 92 cm and weight 13.4 kg at the check-up; the doctor was happy.",
+]
+SAMPLE_QUERIES = [
+    "How is her walking coming along?",
+    "What books does he like?",
+    "Was the child ill recently?",
+    "What does she eat?",
+    "How is his speech developing?",
+    "How is the child sleeping?",
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or check ONNX embeddings")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Export a model to ONNX and quantize it")
+    export.add_argument("--model", default="all-MiniLM-L6-v2")
+    export.add_argument("--out", default=None)
+    export.add_argument("--no-quantize", action="store_true")
+
+    check = commands.add_parser("check", help="Compare an ONNX model against the PyTorch reference")
+    check.add_argument("--model", default="all-MiniLM-L6-v2")
+    check.add_argument("--model-dir", default=None)
+    check.add_argument("--model-file", default=None)
+    check.add_argument("--journal", default=None, help="JSON journal ([{summary: ...}]) to use as documents")
+    check.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        export_onnx(args.model, args.out or str(default_model_dir(args.model)), quantize=not args.no_quantize)
+        return 0
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    documents = SAMPLE_DOCUMENTS
+    if args.journal:
+        with open(args.journal) as f:
+            documents = [entry["summary"] for entry in json.load(f)]
+    candidate = OnnxEmbeddings(
+        model_dir=args.model_dir or str(default_model_dir(args.model)),
+        model_file=args.model_file,
+        intra_op_threads=args.threads,
+    )
+    reference = HuggingFaceEmbeddings(model_name=args.model)
+    report = parity_check(candidate, reference, documents, SAMPLE_QUERIES)
+    print(json.dumps(report, indent=2))
+    passed = parity_passes(report)
+    print("PASS" if passed else f"FAIL: needs min_cosine >= {MIN_COSINE} and recall >= {MIN_RECALL}")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Rough per-chunk overhead of a Document object and its metadata dict
+DOCUMENT_OVERHEAD_BYTES = 512
+
+
+def estimate_size(value: Any) -> int:
+    """Estimate the memory held by a cached vector store or RAG chain.
+
+    Args:
+        value: A FAISS vector store, a retrieval chain wrapping one, or any object
+
+    Returns:
+        Approximate size in bytes
+    """
+    # Chains keep their vector store behind the retriever
+    retriever = getattr(value, "retriever", None)
+    if retriever is not None:
+        # VectorStoreRetriever calls it vectorstore, TimeAwareRetriever vector_store
+        value = getattr(retriever, "vectorstore", None) or getattr(retriever, "vector_store", value)
+
+    index = getattr(value, "index", None)
+    if index is not None and hasattr(index, "ntotal"):
+        size = index.ntotal * index.d * 4
+        docstore = getattr(value, "docstore", None)
+        for doc in getattr(docstore, "_dict", {}).values():
+            size += len(doc.page_content) + DOCUMENT_OVERHEAD_BYTES
+        return size
+
+    return sys.getsizeof(value)
+
+
+class RAGCache:
+    def __init__(
+        self,
+        max_bytes: int = 512 * 1024 * 1024,
+        max_entries: int = 1000,
+        ttl_seconds: float = 3600,
+        sizeof: Callable[[Any], int] = estimate_size,
+        name: str = "rag",
+    ):
+        """Thread-safe LRU cache with a byte budget and per-entry TTL.
+
+        Args:
+            max_bytes: Total estimated size the cache may hold
+            max_entries: Maximum number of entries regardless of size
+            ttl_seconds: Lifetime of an entry after it was stored
+            sizeof: Callable estimating the size of a value in bytes
+            name: Label used in log messages and stats
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.sizeof = sizeof
+        self.name = name
+
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+        self._rejections = 0
+
+    @classmethod
+    def from_env(cls, name: str = "rag", **kwargs) -> "RAGCache":
+        """Create a cache configured from RAG_CACHE_* environment variables."""
+        return cls(
+            max_bytes=int(os.getenv("RAG_CACHE_MAX_BYTES", 512 * 1024 * 1024)),
+            max_entries=int(os.getenv("RAG_CACHE_MAX_ENTRIES", 1000)),
+            ttl_seconds=float(os.getenv("RAG_CACHE_TTL_SECONDS", 3600)),
+            name=name,
+            **kwargs,
+        )
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            value, size, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self._expirations += 1
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> bool:
+        """Store a value, evicting expired and least recently used entries.
+
+        Returns:
+            False if the value alone exceeds the byte budget and was not cached
+        """
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            if size > self.max_bytes:
+                self._rejections += 1
+                logger.warning(
+                    f"[{self.name}] Not caching {key}: {size} bytes exceeds budget of {self.max_bytes}"
+                )
+                return False
+
+            self._entries[key] = (value, size, time.monotonic() + self.ttl_seconds)
+            self._bytes += size
+            self._evict()
+            return True
+
+    def invalidate(self, key: Hashable) -> bool:
+        """Drop a single entry. Returns True if it was cached."""
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            self._invalidations += 1
+            return True
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+
+    def purge_expired(self) -> int:
+        """Remove all expired entries and return how many were dropped."""
+        with self._lock:
+            return self._purge_expired()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return counters describing cache usage."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+                "rejections": self._rejections,
+            }
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[2] > time.monotonic()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _purge_expired(self) -> int:
+        now = time.monotonic()
+        expired = [key for key, (_, _, expires_at) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            self._remove(key)
+        self._expirations += len(expired)
+        return len(expired)
+
+    def _evict(self):
+        if self._bytes <= self.max_bytes and len(self._entries) <= self.max_entries:
+            return
+
+        self._purge_expired()
+        while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            key, (_, size, _) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._evictions += 1
+            logger.info(f"[{self.name}] Evicted {key}")
@@ -0,0 +1,63 @@
+import contextlib
+from contextvars import ContextVar
+from typing import Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from pydantic import ConfigDict
+
+# Question and embedding already computed for the current request, e.g. for the answer cache
+_known_query_embedding: ContextVar[Optional[Tuple[str, List[float]]]] = ContextVar("known_query_embedding", default=None)
+
+
+@contextlib.contextmanager
+def known_query_embedding(query: str, embedding: Optional[List[float]]) -> Iterator[None]:
+    """Let retrievers running inside the block reuse an embedding of query instead of computing it again."""
+    token = _known_query_embedding.set((query, embedding) if embedding is not None else None)
+    try:
+        yield
+    finally:
+        _known_query_embedding.reset(token)
+
+
+def _known(query: str) -> Optional[List[float]]:
+    known = _known_query_embedding.get()
+    return known[1] if known is not None and known[0] == query else None
+
+
+class MMRRetriever(BaseRetriever):
+    """MMR search over a vector store, by vector.
+
+    Same results as vector_store.as_retriever(search_type="mmr"), but a
+    query embedded earlier in the request (see known_query_embedding) is
+    searched with directly rather than embedded a second time.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_store: VectorStore
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+
+    def embed_query(self, query: str) -> List[float]:
+        embedding = _known(query)
+        return embedding if embedding is not None else self.vector_store.embeddings.embed_query(query)
+
+    async def aembed_query(self, query: str) -> List[float]:
+        embedding = _known(query)
+        return embedding if embedding is not None else await self.vector_store.embeddings.aembed_query(query)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.vector_store.max_marginal_relevance_search_by_vector(
+            self.embed_query(query), k=self.k, fetch_k=self.fetch_k, lambda_mult=self.lambda_mult
+        )
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return await self.vector_store.amax_marginal_relevance_search_by_vector(
+            await self.aembed_query(query), k=self.k, fetch_k=self.fetch_k, lambda_mult=self.lambda_mult
+        )
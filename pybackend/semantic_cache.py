@@ -0,0 +1,134 @@
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from rag_cache import RAGCache
+
+
+class _ChildAnswers:
+    __slots__ = ("version", "vectors", "answers")
+
+    def __init__(self, version: Optional[str]):
+        self.version = version
+        self.vectors: Optional[np.ndarray] = None
+        self.answers: List[Dict] = []
+
+    @property
+    def nbytes(self) -> int:
+        return (self.vectors.nbytes if self.vectors is not None else 0) + 4096 * len(self.answers)
+
+
+class SemanticAnswerCache:
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        max_answers_per_child: int = 256,
+        max_children: int = 10000,
+        ttl_seconds: float = 3600,
+    ):
+        """Per-child cache of answers keyed by the embedding of the question.
+
+        A question is answered from the cache when its cosine similarity to a
+        previously answered question of the same child reaches threshold.
+        Every child's answers are tied to the journal version (S3 ETag) they
+        were produced from and dropped as soon as a different version is seen.
+
+        Args:
+            threshold: Minimum cosine similarity for a hit
+            max_answers_per_child: Oldest answers are dropped beyond this
+            max_children: Least recently used children are dropped beyond this
+            ttl_seconds: Lifetime of a child's answers
+        """
+        self.threshold = threshold
+        self.max_answers_per_child = max_answers_per_child
+        self._children = RAGCache(
+            max_bytes=max_children * max_answers_per_child * 4096,
+            max_entries=max_children,
+            ttl_seconds=ttl_seconds,
+            sizeof=lambda bucket: bucket.nbytes,
+            name="semantic_answers",
+        )
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._hits = 0
+        self._stores = 0
+        self._version_changes = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["SemanticAnswerCache"]:
+        """Create a cache from SEMANTIC_CACHE_* settings, or None if disabled."""
+        if os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92)),
+            max_answers_per_child=int(os.getenv("SEMANTIC_CACHE_MAX_ANSWERS", 256)),
+            ttl_seconds=float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 3600)),
+        )
+
+    def set_version(self, child_id: str, version: Optional[str]):
+        """Record the journal version now served for a child, dropping stale answers.
+
+        The version is kept in the child's bucket, so it is evicted together
+        with the answers instead of being remembered for every child ever seen.
+        """
+        if version is None:
+            return
+        with self._lock:
+            bucket = self._children.get(child_id)
+            if bucket is not None and bucket.version == version:
+                return
+            if bucket is not None and bucket.version is not None:
+                self._version_changes += 1
+            # Also replaces answers stored while the version was unknown
+            self._children.put(child_id, _ChildAnswers(version))
+
+    def lookup(self, child_id: str, embedding: List[float]) -> Optional[Dict]:
+        """Return the cached answer of the most similar earlier question, if close enough."""
+        vector = self._normalize(embedding)
+        with self._lock:
+            self._lookups += 1
+            bucket = self._children.get(child_id)
+            if bucket is None or not bucket.answers:
+                return None
+
+            similarities = bucket.vectors @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            self._hits += 1
+            return bucket.answers[best]
+
+    def store(self, child_id: str, embedding: List[float], answer: Dict):
+        """Remember the answer to a question."""
+        vector = self._normalize(embedding)
+        with self._lock:
+            bucket = self._children.get(child_id) or _ChildAnswers(None)
+            vectors = vector[None, :] if bucket.vectors is None else np.vstack([bucket.vectors, vector[None, :]])
+            bucket.vectors = vectors[-self.max_answers_per_child:]
+            bucket.answers = (bucket.answers + [answer])[-self.max_answers_per_child:]
+            self._children.put(child_id, bucket)
+            self._stores += 1
+
+    def invalidate(self, child_id: str) -> bool:
+        with self._lock:
+            return self._children.invalidate(child_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                "lookups": self._lookups,
+                "hits": self._hits,
+                "hit_rate": self._hits / self._lookups if self._lookups else 0.0,
+                "stores": self._stores,
+                "version_changes": self._version_changes,
+                "children": self._children.stats(),
+            }
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
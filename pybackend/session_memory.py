@@ -0,0 +1,167 @@
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+from rag_cache import RAGCache
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("human", """Progressively summarize a parent's conversation about their child's journal.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+Return the updated summary in a few sentences, keeping names, dates and facts the parent asked about.""")
+])
+
+
+def session_summaries_enabled() -> bool:
+    """Whether SESSION_SUMMARIZE asks for dropped turns to be summarized."""
+    return os.getenv("SESSION_SUMMARIZE", "false").lower() in ("1", "true", "yes")
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count; about four characters per token for English text."""
+    return len(text) // 4 + 1
+
+
+class SessionHistory:
+    def __init__(self, max_turns: int, max_tokens: int, summarizer: Optional[BaseChatModel] = None):
+        """Chat history of one parent session, bounded by turns and tokens.
+
+        Turns falling out of the window are either dropped or, when a
+        summarizer is given, folded into a running summary.
+
+        Args:
+            max_turns: Most question/answer pairs kept verbatim
+            max_tokens: Token budget for the summary plus the kept turns
+            summarizer: Chat model used to summarize dropped turns
+        """
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+        self.summary = ""
+        self.turns: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+
+    def messages(self) -> List[BaseMessage]:
+        """Return the history as chat messages for the condense-question step."""
+        with self._lock:
+            messages: List[BaseMessage] = []
+            if self.summary:
+                messages.append(AIMessage(content=SUMMARY_PREFIX + self.summary))
+            for question, answer in self.turns:
+                messages.append(HumanMessage(content=question))
+                messages.append(AIMessage(content=answer))
+            return messages
+
+    def tokens(self) -> int:
+        with self._lock:
+            return self._tokens()
+
+    def add_turn(self, question: str, answer: str):
+        """Record a turn, summarizing overflow with a blocking LLM call."""
+        dropped = self._append(question, answer)
+        if dropped and self.summarizer is not None:
+            result = self.summarizer.invoke(self._summary_messages(dropped))
+            self._set_summary(result.content)
+
+    async def aadd_turn(self, question: str, answer: str):
+        """Record a turn, summarizing overflow with an async LLM call."""
+        dropped = self._append(question, answer)
+        if dropped and self.summarizer is not None:
+            result = await self.summarizer.ainvoke(self._summary_messages(dropped))
+            self._set_summary(result.content)
+
+    def _append(self, question: str, answer: str) -> List[Tuple[str, str]]:
+        with self._lock:
+            self.turns.append((question, answer))
+            dropped = []
+            while self.turns and (len(self.turns) > self.max_turns or self._tokens() > self.max_tokens):
+                dropped.append(self.turns.pop(0))
+            return dropped
+
+    def _tokens(self) -> int:
+        return count_tokens(self.summary) + sum(
+            count_tokens(question) + count_tokens(answer) for question, answer in self.turns
+        )
+
+    def _summary_messages(self, dropped: List[Tuple[str, str]]) -> List[BaseMessage]:
+        lines = "\n".join(f"Parent: {question}\nAssistant: {answer}" for question, answer in dropped)
+        return SUMMARY_PROMPT.format_messages(summary=self.summary or "(none)", lines=lines)
+
+    def _set_summary(self, summary: str):
+        # Keep the summary itself within half the budget
+        limit = self.max_tokens * 2
+        with self._lock:
+            self.summary = summary[-limit:]
+
+
+class SessionMemoryStore:
+    def __init__(
+        self,
+        max_turns: int = 10,
+        max_tokens: int = 2000,
+        idle_seconds: float = 1800,
+        max_sessions: int = 10000,
+        summarizer: Optional[BaseChatModel] = None,
+    ):
+        """Conversation histories keyed by child and session id.
+
+        Sessions are held in a RAGCache, so idle ones expire after
+        idle_seconds and the least recently used are evicted beyond
+        max_sessions.
+        """
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+        self._sessions = RAGCache(
+            max_bytes=max_sessions * max_tokens * 4,
+            max_entries=max_sessions,
+            ttl_seconds=idle_seconds,
+            sizeof=lambda session: session.max_tokens * 4,
+            name="sessions",
+        )
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, summarizer: Optional[BaseChatModel] = None) -> "SessionMemoryStore":
+        """Create a store configured from SESSION_* environment variables.
+
+        The summarizer is only used when SESSION_SUMMARIZE is enabled.
+        """
+        return cls(
+            max_turns=int(os.getenv("SESSION_MAX_TURNS", 10)),
+            max_tokens=int(os.getenv("SESSION_MAX_TOKENS", 2000)),
+            idle_seconds=float(os.getenv("SESSION_IDLE_SECONDS", 1800)),
+            max_sessions=int(os.getenv("SESSION_MAX", 10000)),
+            summarizer=summarizer if session_summaries_enabled() else None,
+        )
+
+    def get(self, child_id: str, session_id: str) -> SessionHistory:
+        """Return the history for a session, starting a new one if needed.
+
+        Each access refreshes the session's idle timer.
+        """
+        key = (child_id, session_id)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = SessionHistory(self.max_turns, self.max_tokens, self.summarizer)
+            # Re-store to restart the idle TTL
+            self._sessions.put(key, session)
+            return session
+
+    def end(self, child_id: str, session_id: str) -> bool:
+        return self._sessions.invalidate((child_id, session_id))
+
+    def stats(self) -> Dict:
+        return self._sessions.stats()
@@ -0,0 +1,533 @@
+import os
+import json
+import time
+import zlib
+import fcntl
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+from time_retrieval import metadata_period
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+VECTORS_FILE = "vectors.f32"
+CHUNKS_FILE = "chunks.sqlite"
+LOCK_FILE = "shard.lock"
+
+# Rewrite a shard's vector file once removed rows outnumber live ones
+COMPACT_GARBAGE_RATIO = 0.5
+COMPACT_MIN_ROWS = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    row INTEGER PRIMARY KEY,
+    child_id TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    entry_key TEXT,
+    period INTEGER,
+    content TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    UNIQUE (child_id, doc_id)
+);
+CREATE INDEX IF NOT EXISTS chunks_child ON chunks (child_id, entry_key);
+CREATE INDEX IF NOT EXISTS chunks_child_period ON chunks (child_id, period);
+CREATE TABLE IF NOT EXISTS children (
+    child_id TEXT PRIMARY KEY,
+    etag TEXT,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class IndexShard:
+    def __init__(self, path: Path, dim: int):
+        """One shard of the shared index.
+
+        Vectors are appended to a flat float32 file that is read through a
+        memory map, so only the pages of children being searched are paged
+        in. Chunk text and metadata live in SQLite, indexed by child, and map
+        each chunk to its row in the vector file. Removing chunks only
+        deletes their metadata; the vector rows are reclaimed by compact().
+
+        Several processes may open the same shard, e.g. uvicorn workers and
+        build_indexes.py: writes hold an exclusive flock on the shard's lock
+        file and reads a shared one, so rows are never allocated twice or
+        renumbered under a reader in another process.
+
+        Args:
+            path: Directory of the shard
+            dim: Dimension of the embeddings
+        """
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self.vectors_path = path / VECTORS_FILE
+        self.vectors_path.touch(exist_ok=True)
+
+        # One connection per shard; the lock serializes its use within the
+        # process, the lock file's flock across processes
+        self._lock = threading.Lock()
+        self._lock_file = open(path / LOCK_FILE, "a+")
+        self._db = sqlite3.connect(str(path / CHUNKS_FILE), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._mmap: Optional[np.memmap] = None
+        self._mmap_inode: Optional[int] = None
+
+    @contextmanager
+    def _locked(self, exclusive: bool) -> Iterator[None]:
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _rows_on_disk(self) -> int:
+        return self.vectors_path.stat().st_size // self.row_bytes
+
+    def _vectors(self) -> np.ndarray:
+        stat = self.vectors_path.stat()
+        rows = stat.st_size // self.row_bytes
+        # Another process may have appended to or compacted (replaced) the file
+        if self._mmap is None or len(self._mmap) != rows or self._mmap_inode != stat.st_ino:
+            if rows == 0:
+                return np.empty((0, self.dim), dtype=np.float32)
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            self._mmap_inode = stat.st_ino
+        return self._mmap
+
+    def add(self, child_id: str, documents: Sequence[Document], vectors: np.ndarray):
+        """Append a child's chunks, replacing chunks with the same ids."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(documents), self.dim)
+        with self._locked(exclusive=True):
+            with open(self.vectors_path, "ab") as f:
+                # Counted under the lock: other processes append to the same file.
+                # A torn write from an earlier crash must not shift the rows
+                first_row = self._rows_on_disk()
+                f.truncate(first_row * self.row_bytes)
+                f.write(vectors.tobytes())
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO chunks (row, child_id, doc_id, entry_key, period, content, metadata) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            first_row + i, child_id, doc.id, doc.metadata.get("entry_key"),
+                            metadata_period(doc.metadata), doc.page_content, json.dumps(doc.metadata),
+                        )
+                        for i, doc in enumerate(documents)
+                    ],
+                )
+                self._touch(child_id)
+
+    def remove(self, child_id: str, doc_ids: Optional[Iterable[str]] = None, entry_keys: Optional[Iterable[str]] = None) -> int:
+        """Remove a child's chunks by id or by journal entry, or all of them."""
+        with self._locked(exclusive=True):
+            with self._db:
+                if doc_ids is None and entry_keys is None:
+                    removed = self._db.execute("DELETE FROM chunks WHERE child_id = ?", (child_id,)).rowcount
+                    self._db.execute("DELETE FROM children WHERE child_id = ?", (child_id,))
+                else:
+                    column, values = ("doc_id", doc_ids) if doc_ids is not None else ("entry_key", entry_keys)
+                    removed = sum(
+                        self._db.execute(
+                            f"DELETE FROM chunks WHERE child_id = ? AND {column} = ?", (child_id, value)
+                        ).rowcount
+                        for value in values
+                    )
+                    self._touch(child_id)
+            self._maybe_compact()
+        return removed
+
+    def _touch(self, child_id: str):
+        self._db.execute(
+            "INSERT INTO children (child_id, etag, updated_at) VALUES (?, NULL, ?) "
+            "ON CONFLICT (child_id) DO UPDATE SET updated_at = excluded.updated_at",
+            (child_id, time.time()),
+        )
+
+    def version(self, child_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT etag FROM children WHERE child_id = ?", (child_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_version(self, child_id: str, etag: Optional[str]):
+        with self._locked(exclusive=True):
+            self._db.execute(
+                "INSERT INTO children (child_id, etag, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (child_id) DO UPDATE SET etag = excluded.etag, updated_at = excluded.updated_at",
+                (child_id, etag, time.time()),
+            )
+
+    def entry_keys(self, child_id: str) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT entry_key FROM chunks WHERE child_id = ?", (child_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def recent_children(self, limit: int) -> List[Tuple[float, str]]:
+        """(last sync time, child id) of the children synced most recently."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT updated_at, child_id FROM children ORDER BY updated_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [(updated_at, child_id) for updated_at, child_id in rows]
+
+    def chunks(self, child_id: str, periods: Optional[Tuple[int, int]] = None) -> Tuple[List[Document], np.ndarray]:
+        """Return a child's chunks, optionally of a range of months, and a copy of their vectors."""
+        query = "SELECT row, doc_id, content, metadata FROM chunks WHERE child_id = ?"
+        params: tuple = (child_id,)
+        if periods is not None:
+            query += " AND period BETWEEN ? AND ?"
+            params += tuple(periods)
+        with self._locked(exclusive=False):
+            rows = self._db.execute(query + " ORDER BY row", params).fetchall()
+            # Gathered under the lock, so compaction cannot renumber rows in between
+            vectors = np.array(self._vectors()[[row[0] for row in rows]]) if rows else np.empty((0, self.dim), np.float32)
+        documents = [
+            Document(id=doc_id, page_content=content, metadata=json.loads(metadata))
+            for _, doc_id, content, metadata in rows
+        ]
+        return documents, vectors
+
+    def _maybe_compact(self):
+        rows = self._rows_on_disk()
+        live = self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        if rows >= COMPACT_MIN_ROWS and rows - live > rows * COMPACT_GARBAGE_RATIO:
+            self._compact()
+
+    def compact(self):
+        """Rewrite the vector file without the rows of removed chunks."""
+        with self._locked(exclusive=True):
+            self._compact()
+
+    def _compact(self):
+        started = time.monotonic()
+        live_rows = [row[0] for row in self._db.execute("SELECT row FROM chunks ORDER BY row")]
+        vectors = self._vectors()
+        tmp_path = self.vectors_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            for start in range(0, len(live_rows), 4096):
+                f.write(np.ascontiguousarray(vectors[live_rows[start:start + 4096]]).tobytes())
+        with self._db:
+            # Renumber through negative rows so the primary key never collides
+            self._db.executemany("UPDATE chunks SET row = ? WHERE row = ?", [(-i - 1, row) for i, row in enumerate(live_rows)])
+            self._db.execute("UPDATE chunks SET row = -row - 1")
+            os.replace(tmp_path, self.vectors_path)
+        self._mmap = None
+        self._mmap_inode = None
+        logger.info(
+            f"Compacted shard {self.path.name}: {len(vectors) - len(live_rows)} rows reclaimed "
+            f"in {time.monotonic() - started:.2f}s"
+        )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            chunks = self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            children = self._db.execute("SELECT COUNT(*) FROM children").fetchone()[0]
+            rows = self._rows_on_disk()
+        return {"children": children, "chunks": chunks, "rows": rows, "bytes": rows * self.row_bytes}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+            self._lock_file.close()
+            self._mmap = None
+
+
+class SharedVectorIndex:
+    def __init__(self, root: Optional[str] = None, shards: int = 16, embeddings_id: Optional[str] = None):
+        """Vector index shared by all children, split into disk-backed shards.
+
+        A child's chunks all live in the shard chosen by a hash of their id,
+        and searches only read that child's rows, so search cost depends on
+        the child's journal rather than on the number of children, and the
+        memory held does not grow with them:
+
+            {root}/index.json
+            {root}/shard-{n:03d}/vectors.f32
+            {root}/shard-{n:03d}/chunks.sqlite
+
+        Any number of processes may read and write the same index directory;
+        each shard serializes its writers with a file lock.
+
+        Args:
+            root: Directory of the index, defaults to SHARED_INDEX_DIR or ./shared_index
+            shards: Number of shards for a new index; an existing index keeps its own
+            embeddings_id: Embeddings backend and model the vectors come from
+        """
+        self.root = Path(root or os.getenv("SHARED_INDEX_DIR", "./shared_index"))
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.embeddings_id = embeddings_id
+        self.num_shards = shards
+        self.dim: Optional[int] = None
+        self._shards: Dict[int, IndexShard] = {}
+        self._lock = threading.Lock()
+        self._load_info()
+
+    def _load_info(self):
+        """Adopt the shard count and dimension recorded in index.json, if it exists yet."""
+        info_path = self.root / INDEX_FILE
+        if not info_path.exists():
+            return
+        with open(info_path) as f:
+            info = json.load(f)
+        recorded = info.get("embeddings")
+        if self.embeddings_id and recorded and recorded != self.embeddings_id:
+            raise ValueError(
+                f"Shared index at {self.root} holds {recorded} embeddings, not {self.embeddings_id}; "
+                "rebuild it or use another SHARED_INDEX_DIR"
+            )
+        if info["shards"] != self.num_shards:
+            logger.warning(f"Shared index at {self.root} has {info['shards']} shards; ignoring shards={self.num_shards}")
+        self.num_shards = info["shards"]
+        self.dim = info["dim"]
+
+    @classmethod
+    def from_env(cls, embeddings_id: Optional[str] = None) -> "SharedVectorIndex":
+        return cls(shards=int(os.getenv("SHARED_INDEX_SHARDS", 16)), embeddings_id=embeddings_id)
+
+    def shard_for(self, child_id: str) -> Optional[IndexShard]:
+        """Return the child's shard, or None while the index is still empty."""
+        if self.dim is None:
+            # Another process may have written the first vectors since
+            with self._lock:
+                self._load_info()
+            if self.dim is None:
+                return None
+        return self._shard(zlib.crc32(child_id.encode("utf-8")) % self.num_shards)
+
+    def _shard(self, number: int) -> IndexShard:
+        with self._lock:
+            shard = self._shards.get(number)
+            if shard is None:
+                shard = self._shards[number] = IndexShard(self.root / f"shard-{number:03d}", self.dim)
+        return shard
+
+    def _init_dim(self, dim: int):
+        with self._lock, open(self.root / LOCK_FILE, "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if self.dim is None:
+                self._load_info()
+            if self.dim is None:
+                tmp_path = self.root / (INDEX_FILE + ".tmp")
+                with open(tmp_path, "w") as f:
+                    json.dump({"version": 1, "shards": self.num_shards, "dim": dim, "embeddings": self.embeddings_id}, f)
+                os.replace(tmp_path, self.root / INDEX_FILE)
+                self.dim = dim
+        if dim != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {dim}")
+
+    def add(self, child_id: str, documents: Sequence[Document], vectors: Sequence[Sequence[float]]):
+        """Add chunks with their embeddings to a child, replacing chunks with the same ids."""
+        if not documents:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self._init_dim(vectors.shape[1])
+        self.shard_for(child_id).add(child_id, documents, vectors)
+
+    def remove(self, child_id: str, doc_ids: Optional[Iterable[str]] = None, entry_keys: Optional[Iterable[str]] = None) -> int:
+        """Remove chunks of a child by id or journal entry; without either, remove the child.
+
+        Returns:
+            Number of chunks removed
+        """
+        shard = self.shard_for(child_id)
+        return shard.remove(child_id, doc_ids, entry_keys) if shard else 0
+
+    def version(self, child_id: str) -> Optional[str]:
+        """Return the journal ETag the child's chunks were last synced to."""
+        shard = self.shard_for(child_id)
+        return shard.version(child_id) if shard else None
+
+    def set_version(self, child_id: str, etag: Optional[str]):
+        shard = self.shard_for(child_id)
+        if shard:
+            shard.set_version(child_id, etag)
+
+    def entry_keys(self, child_id: str) -> List[str]:
+        shard = self.shard_for(child_id)
+        return shard.entry_keys(child_id) if shard else []
+
+    def recent_children(self, limit: int) -> List[str]:
+        """Return up to limit child ids whose chunks were synced most recently."""
+        if self.dim is None:
+            with self._lock:
+                self._load_info()
+        if self.dim is None or limit <= 0:
+            return []
+        synced = []
+        for number in range(self.num_shards):
+            if (self.root / f"shard-{number:03d}").exists():
+                synced.extend(self._shard(number).recent_children(limit))
+        synced.sort(reverse=True)
+        return [child_id for _, child_id in synced[:limit]]
+
+    def search(
+        self,
+        child_id: str,
+        embedding: Sequence[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: Optional[float] = None,
+        periods: Optional[Tuple[int, int]] = None,
+    ) -> List[Tuple[Document, float]]:
+        """Find a child's chunks nearest to an embedding.
+
+        Distances are squared Euclidean, like the per-child FAISS indexes. With
+        lambda_mult, the fetch_k nearest chunks are re-ranked by maximal
+        marginal relevance. With periods, an inclusive range of period keys
+        (see time_retrieval.period_key), only chunks of those months are read.
+
+        Returns:
+            (document, distance) pairs, nearest first unless re-ranked
+        """
+        shard = self.shard_for(child_id)
+        if shard is None:
+            return []
+        documents, vectors = shard.chunks(child_id, periods)
+        if not documents:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        nearest = np.argsort(distances)[:fetch_k if lambda_mult is not None else k]
+        if lambda_mult is not None:
+            selected = maximal_marginal_relevance(query, vectors[nearest], k=min(k, len(nearest)), lambda_mult=lambda_mult)
+            nearest = nearest[selected]
+        return [(documents[i], float(distances[i])) for i in nearest]
+
+    def compact(self):
+        """Reclaim the space of removed chunks in every shard."""
+        for shard in list(self._shards.values()):
+            shard.compact()
+
+    def stats(self) -> Dict[str, Any]:
+        shards = [shard.stats() for shard in list(self._shards.values())]
+        return {
+            "shards": self.num_shards,
+            "open_shards": len(shards),
+            "children": sum(s["children"] for s in shards),
+            "entries": sum(s["chunks"] for s in shards),
+            "rows": sum(s["rows"] for s in shards),
+            "bytes": sum(s["bytes"] for s in shards),
+        }
+
+    def close(self):
+        with self._lock:
+            for shard in self._shards.values():
+                shard.close()
+            self._shards.clear()
+
+
+class ChildVectorStore(VectorStore):
+    """A child's slice of a SharedVectorIndex, usable wherever a FAISS store is."""
+
+    def __init__(self, shared_index: SharedVectorIndex, child_id: str, embedding: Embeddings):
+        self.shared_index = shared_index
+        self.child_id = child_id
+        self.embedding = embedding
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [f"{self.child_id}:{time.time_ns()}:{i}" for i in range(len(texts))]
+        documents = [Document(id=i, page_content=t, metadata=m) for i, t, m in zip(ids, texts, metadatas)]
+        self.shared_index.add(self.child_id, documents, self.embedding.embed_documents(texts))
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        self.shared_index.remove(self.child_id, doc_ids=ids)
+        return True
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.shared_index.search(self.child_id, embedding, k=k)
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k)
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        return [doc for doc, _ in self.shared_index.search(self.child_id, embedding, k, fetch_k, lambda_mult)]
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(self.embedding.embed_query(query), k, fetch_k, lambda_mult)
+
+    async def amax_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        # Embedding goes through the batcher; the search itself reads a few pages
+        embedding = await self.embedding.aembed_query(query)
+        return self.max_marginal_relevance_search_by_vector(embedding, k, fetch_k, lambda_mult)
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        embedding = await self.embedding.aembed_query(query)
+        return self.similarity_search_by_vector(embedding, k)
+
+    def _select_relevance_score_fn(self):
+        return self._euclidean_relevance_score_fn
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        *,
+        shared_index: Optional[SharedVectorIndex] = None,
+        child_id: Optional[str] = None,
+        **kwargs: Any,
+    ) -> "ChildVectorStore":
+        if shared_index is None or child_id is None:
+            raise ValueError("ChildVectorStore.from_texts needs shared_index and child_id")
+        store = cls(shared_index, child_id, embedding)
+        store.add_texts(texts, metadatas, kwargs.get("ids"))
+        return store
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The services import their modules by name from pybackend/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
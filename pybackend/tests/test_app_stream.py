@@ -0,0 +1,139 @@
+import json
+import asyncio
+import importlib
+import threading
+from typing import List
+
+import httpx
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+from langchain_core.language_models import FakeListChatModel
+
+from embedding_batcher import BatchingEmbeddings
+
+ANSWER = "He is reading a lot more books this month."
+
+
+class GatedEmbeddings(Embeddings):
+    """Fake embeddings that block while the gate is closed."""
+
+    def __init__(self):
+        self.fake = DeterministicFakeEmbedding(size=16)
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.entered.set()
+        self.gate.wait(10)
+        return self.fake.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture
+def service(tmp_path):
+    with pytest.MonkeyPatch.context() as env:
+        for name, value in {
+            "GEMINI_API_KEY": "test", "AWS_BUCKET_NAME": "bucket", "AWS_REGION": "us-east-1",
+            "AWS_ACCESS_KEY": "test", "AWS_SECRET_ACCESS_KEY": "test", "FAISS_INDEX_DIR": str(tmp_path),
+        }.items():
+            env.setenv(name, value)
+        app = importlib.import_module("app")
+
+        model = GatedEmbeddings()
+        rag = app.rag
+        env.setattr(rag, "embeddings", BatchingEmbeddings(model, max_wait_ms=0))
+        env.setattr(rag, "_chat_model", FakeListChatModel(responses=[ANSWER], sleep=0.01))
+        rag.__dict__.pop("llm", None)
+
+        texts = ["Started reading picture books", "Learned to ride a bike"]
+        metadatas = [{"month": "January", "year": "2025"}, {"month": "February", "year": "2025"}]
+        app.vector_store_cache.put("c1", FAISS.from_texts(texts, rag.embeddings, metadatas=metadatas))
+        try:
+            yield app, model
+        finally:
+            model.gate.set()
+            rag.embeddings.close()
+            rag.__dict__.pop("llm", None)
+            app.vector_store_cache.clear()
+            if rag.answer_cache is not None:
+                rag.answer_cache.invalidate("c1")
+
+
+async def stream_then_disconnect(app, disconnect: asyncio.Event, chunks: List[str]):
+    """POST /query/stream straight to the ASGI app, reporting a disconnect once the event is set."""
+    body = json.dumps({"child_id": "c1", "query": "What is he reading?"}).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/query/stream", "raw_path": b"/query/stream", "query_string": b"",
+        "root_path": "", "headers": [(b"content-type", b"application/json")],
+        "client": ("testclient", 5000), "server": ("testserver", 80),
+    }
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if pending:
+            return pending.pop()
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks.append(message["body"].decode())
+
+    await asyncio.wait_for(app.app(scope, receive, send), 10)
+
+
+async def query(app) -> httpx.Response:
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        return await asyncio.wait_for(client.post("/query", json={"child_id": "c1", "query": "Any new skills?"}), 10)
+
+
+def test_disconnect_while_embedding_leaves_queries_working(service):
+    app, model = service
+    model.gate.clear()
+    model.entered.clear()
+
+    chunks: List[str] = []
+
+    async def scenario():
+        disconnect = asyncio.Event()
+        stream = asyncio.ensure_future(stream_then_disconnect(app, disconnect, chunks))
+        while not model.entered.is_set():
+            await asyncio.sleep(0.01)
+        # The client goes away while its question is still being embedded
+        disconnect.set()
+        await stream
+        model.gate.set()
+        return await query(app)
+
+    response = asyncio.run(scenario())
+    assert not any("event: token" in chunk for chunk in chunks)
+    assert response.status_code == 200
+    assert response.json()["answer"] == ANSWER
+
+
+def test_disconnect_mid_stream_stops_the_answer(service):
+    app, _ = service
+    chunks: List[str] = []
+
+    async def scenario():
+        disconnect = asyncio.Event()
+        stream = asyncio.ensure_future(stream_then_disconnect(app, disconnect, chunks))
+        while not any("event: token" in chunk for chunk in chunks) and not stream.done():
+            await asyncio.sleep(0.005)
+        disconnect.set()
+        await stream
+        return await query(app)
+
+    response = asyncio.run(scenario())
+    tokens = sum(chunk.count("event: token") for chunk in chunks)
+    assert 0 < tokens < len(ANSWER)
+    assert not any("event: done" in chunk for chunk in chunks)
+    assert app.rag.llm_scheduler.stats()["in_flight"] == 0
+    assert response.status_code == 200
+    assert response.json()["answer"] == ANSWER
@@ -0,0 +1,57 @@
+import json
+
+from build_indexes import read_checkpoint, todo_children
+
+HF = "huggingface:all-MiniLM-L6-v2"
+ONNX = "onnx:all-MiniLM-L6-v2/model.int8.onnx"
+
+
+def write_checkpoint(path, *records):
+    with open(path, "w") as f:
+        for record in records:
+            f.write(json.dumps({"embeddings": HF, "index_mode": "per_child", "forced": False, **record}) + "\n")
+
+
+def todo(path, listed, embeddings_id=HF, force=False):
+    done = read_checkpoint(path, embeddings_id, "per_child", force)
+    return [child_id for child_id, _ in todo_children(listed, done)]
+
+
+def test_resume_skips_children_built_with_the_same_settings(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    write_checkpoint(path, {"child_id": "a", "etag": "1", "status": "built"}, {"child_id": "b", "etag": "1", "status": "current"})
+    assert todo(path, [("a", "1"), ("b", "1"), ("c", "1")]) == ["c"]
+
+
+def test_changed_journal_is_rebuilt(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    write_checkpoint(path, {"child_id": "a", "etag": "1", "status": "built"})
+    assert todo(path, [("a", "2")]) == ["a"]
+
+
+def test_changed_embeddings_are_rebuilt(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    write_checkpoint(path, {"child_id": "a", "etag": "1", "status": "built"})
+    assert todo(path, [("a", "1")], embeddings_id=ONNX) == ["a"]
+
+
+def test_force_only_resumes_forced_runs(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    write_checkpoint(
+        path,
+        {"child_id": "a", "etag": "1", "status": "current"},
+        {"child_id": "b", "etag": "1", "status": "built", "forced": True},
+    )
+    assert todo(path, [("a", "1"), ("b", "1")], force=True) == ["a"]
+
+
+def test_later_failure_makes_child_due_again(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    write_checkpoint(
+        path,
+        {"child_id": "a", "etag": "1", "status": "built"},
+        {"child_id": "a", "etag": "1", "status": "failed: boom"},
+    )
+    with open(path, "a") as f:
+        f.write('{"child_id": "b", "etag"')
+    assert todo(path, [("a", "1")]) == ["a"]
@@ -0,0 +1,72 @@
+import importlib
+import uuid
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+pytest.importorskip("chromadb")
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as env:
+        # The server keeps its data in ./chroma_data
+        env.chdir(tmp_path_factory.mktemp("chroma"))
+        chroma_server = importlib.import_module("chroma_server")
+        env.setattr(chroma_server.embeddings.embeddings, "_embeddings", DeterministicFakeEmbedding(size=16))
+        yield chroma_server
+        chroma_server.embeddings.close()
+
+
+def journal(*summaries):
+    return [{"month": str(i + 1), "year": "2024", "summary": summary} for i, summary in enumerate(summaries)]
+
+
+def add(server, collection, documents, child_id=None):
+    body = {"collection": collection, "documents": documents}
+    if child_id:
+        body["child_id"] = child_id
+    return server.app.test_client().post("/add_documents", json=body)
+
+
+def test_resending_replaces_copies_under_legacy_ids(server):
+    name = f"childJournal-{uuid.uuid4().hex[:8]}"
+    server.SHARED_COLLECTIONS.add(name)
+    collection = server.get_collection(name)
+    # Written by the positional ids of earlier versions: this child's two summaries and another child's
+    collection.add(
+        ids=["doc_1_2024_0", "doc_2_2024_1", "doc_1_2024_2"],
+        documents=["Started walking", "First words", "Another child's January"],
+        metadatas=[{"month": "1", "year": "2024"}, {"month": "2", "year": "2024"}, {"month": "1", "year": "2024"}],
+    )
+
+    response = add(server, name, journal("Started walking", "First words"), child_id="c1")
+    assert response.status_code == 200
+    assert response.json["legacy_removed"] == 2
+    assert sorted(collection.get()["ids"]) == ["c1_1_2024", "c1_2_2024", "doc_1_2024_2"]
+
+    response = add(server, name, journal("Started walking", "First words"), child_id="c1")
+    assert response.json["upserted"] == 0
+    assert response.json["legacy_removed"] == 0
+    assert collection.count() == 3
+
+
+def test_shared_collection_requires_child_id(server):
+    name = f"childJournal-{uuid.uuid4().hex[:8]}"
+    server.SHARED_COLLECTIONS.add(name)
+    response = add(server, name, journal("Started walking"))
+    assert response.status_code == 400
+    assert server.get_collection(name).count() == 0
+
+
+def test_collection_with_child_records_requires_child_id(server):
+    name = f"notes-{uuid.uuid4().hex[:8]}"
+    assert add(server, name, journal("Started walking"), child_id="c1").status_code == 200
+    assert add(server, name, journal("Someone else's January")).status_code == 400
+
+
+def test_single_child_collection_accepts_summaries_without_child_id(server):
+    name = f"notes-{uuid.uuid4().hex[:8]}"
+    response = add(server, name, journal("Started walking", "First words"))
+    assert response.status_code == 200
+    assert sorted(server.get_collection(name).get()["ids"]) == ["doc_1_2024", "doc_2_2024"]
@@ -0,0 +1,122 @@
+import time
+import asyncio
+import threading
+from typing import List
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from embedding_batcher import BatchingEmbeddings
+
+
+class SlowEmbeddings(Embeddings):
+    """Embeds each text as [len(text)], blocking until released."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.entered = threading.Event()
+        self.batches: List[List[str]] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.entered.set()
+        self.release.wait(5)
+        self.batches.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def wait_for_queue(embeddings: BatchingEmbeddings, depth: int):
+    deadline = time.monotonic() + 5
+    while embeddings.stats()["queue_depth"] < depth and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def test_cancelled_query_does_not_stop_the_worker():
+    model = SlowEmbeddings()
+    embeddings = BatchingEmbeddings(model, max_batch_size=1, max_wait_ms=0)
+
+    async def scenario():
+        running = asyncio.ensure_future(embeddings.aembed_query("busy"))
+        queued = asyncio.ensure_future(embeddings.aembed_query("cancelled"))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        await asyncio.sleep(0.01)
+        model.release.set()
+        assert await running == [4.0]
+        return await asyncio.wait_for(embeddings.aembed_query("next"), 5)
+
+    try:
+        assert asyncio.run(scenario()) == [4.0]
+        assert embeddings._worker.is_alive()
+        assert embeddings.embed_query("sync") == [4.0]
+        assert ["cancelled"] not in model.batches
+        assert embeddings.stats()["cancelled"] == 1
+    finally:
+        model.release.set()
+        embeddings.close()
+
+
+def test_cancelled_while_batched_still_completes_the_batch():
+    model = SlowEmbeddings()
+    embeddings = BatchingEmbeddings(model, max_batch_size=8, max_wait_ms=0)
+
+    async def scenario():
+        task = asyncio.ensure_future(embeddings.aembed_query("gone"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        model.release.set()
+        return await asyncio.wait_for(embeddings.aembed_query("next"), 5)
+
+    try:
+        assert asyncio.run(scenario()) == [4.0]
+        assert embeddings._worker.is_alive()
+    finally:
+        model.release.set()
+        embeddings.close()
+
+
+def test_queries_go_before_queued_documents():
+    model = SlowEmbeddings()
+    embeddings = BatchingEmbeddings(model, max_batch_size=2, max_wait_ms=0)
+    try:
+        blocker = threading.Thread(target=embeddings.embed_query, args=("first",))
+        blocker.start()
+        assert model.entered.wait(5)
+        build = threading.Thread(target=embeddings.embed_documents, args=([f"chunk {i}" for i in range(6)],))
+        build.start()
+        wait_for_queue(embeddings, 3)
+        query = threading.Thread(target=embeddings.embed_query, args=("question",))
+        query.start()
+        wait_for_queue(embeddings, 4)
+
+        model.release.set()
+        for thread in (blocker, build, query):
+            thread.join(5)
+        assert model.batches[1] == ["question"]
+    finally:
+        model.release.set()
+        embeddings.close()
+
+
+def test_failed_batch_reaches_callers_and_worker_keeps_going():
+    class FailingOnce(Embeddings):
+        calls = 0
+
+        def embed_documents(self, texts):
+            self.calls += 1
+            if self.calls == 1:
+                raise RuntimeError("model crashed")
+            return [[1.0] for _ in texts]
+
+        def embed_query(self, text):
+            return self.embed_documents([text])[0]
+
+    embeddings = BatchingEmbeddings(FailingOnce(), max_wait_ms=0)
+    try:
+        with pytest.raises(RuntimeError):
+            embeddings.embed_query("a")
+        assert embeddings.embed_query("b") == [1.0]
+    finally:
+        embeddings.close()
@@ -0,0 +1,23 @@
+from child_journal_rag import embeddings_identifier
+
+
+def test_onnx_identifier_tells_quantizations_apart(tmp_path, monkeypatch):
+    model_dir = tmp_path / "all-MiniLM-L6-v2"
+    model_dir.mkdir()
+    (model_dir / "model.onnx").touch()
+    monkeypatch.setenv("ONNX_MODEL_DIR", str(model_dir))
+    monkeypatch.delenv("ONNX_MODEL_FILE", raising=False)
+    fp32 = embeddings_identifier("onnx", "all-MiniLM-L6-v2")
+
+    # Exporting the int8 model switches the default file, and with it the indexes
+    (model_dir / "model.int8.onnx").touch()
+    int8 = embeddings_identifier("onnx", "all-MiniLM-L6-v2")
+    assert fp32 == "onnx:all-MiniLM-L6-v2/model.onnx"
+    assert int8 == "onnx:all-MiniLM-L6-v2/model.int8.onnx"
+
+    monkeypatch.setenv("ONNX_MODEL_FILE", "model.onnx")
+    assert embeddings_identifier("onnx", "all-MiniLM-L6-v2") == fp32
+
+
+def test_huggingface_identifier_names_the_model():
+    assert embeddings_identifier("huggingface", "all-MiniLM-L6-v2") == "huggingface:all-MiniLM-L6-v2"
@@ -0,0 +1,124 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from llm_scheduler import LLMScheduler, ScheduledChatModel
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class FakeChatModel(BaseChatModel):
+    """Answers after a delay, failing the first rate_limited calls with a 429."""
+
+    latency: float = 0.05
+    rate_limited: int = 0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _answer(self, messages: List[BaseMessage], call: int) -> ChatResult:
+        if call <= self.rate_limited:
+            raise RateLimitError("429 Too Many Requests")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"answer to {messages[-1].content}"))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self.calls += 1
+        call = self.calls
+        time.sleep(self.latency)
+        return self._answer(messages, call)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(self.latency)
+        return self._answer(messages, call)
+
+
+def scheduled(model: FakeChatModel, **kwargs) -> ScheduledChatModel:
+    return ScheduledChatModel(model=model, scheduler=LLMScheduler(backoff_seconds=0.01, **kwargs))
+
+
+def test_coalesced_call_survives_leader_cancellation():
+    model = FakeChatModel(latency=0.1)
+    llm = scheduled(model)
+
+    async def scenario():
+        leader = asyncio.create_task(llm.ainvoke("hi"))
+        await asyncio.sleep(0.02)
+        follower = asyncio.create_task(llm.ainvoke("hi"))
+        await asyncio.sleep(0.02)
+        leader.cancel()
+        answer = await follower
+        return leader, answer
+
+    leader, answer = asyncio.run(scenario())
+    assert leader.cancelled()
+    assert answer.content == "answer to hi"
+    assert model.calls == 1
+    assert llm.scheduler.stats()["coalesced"] == 1
+
+
+def test_cancelled_follower_leaves_leader_running():
+    llm = scheduled(FakeChatModel(latency=0.1))
+
+    async def scenario():
+        leader = asyncio.create_task(llm.ainvoke("hi"))
+        await asyncio.sleep(0.02)
+        follower = asyncio.create_task(llm.ainvoke("hi"))
+        await asyncio.sleep(0.02)
+        follower.cancel()
+        return await leader
+
+    assert asyncio.run(scenario()).content == "answer to hi"
+
+
+def test_rate_limited_call_is_retried():
+    model = FakeChatModel(rate_limited=2)
+    llm = scheduled(model, max_retries=3)
+
+    async def scenario():
+        return await asyncio.wait_for(asyncio.gather(llm.ainvoke("hi"), llm.ainvoke("hi")), 5)
+
+    answers = asyncio.run(scenario())
+    assert [answer.content for answer in answers] == ["answer to hi"] * 2
+    assert model.calls == 3
+    stats = llm.scheduler.stats()
+    assert stats["rate_limited"] == 2
+    assert stats["in_flight"] == 0
+
+
+def test_rate_limit_error_reaches_every_caller_after_last_retry():
+    model = FakeChatModel(rate_limited=10)
+    llm = scheduled(model, max_retries=1)
+
+    async def scenario():
+        return await asyncio.gather(llm.ainvoke("hi"), llm.ainvoke("hi"), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RateLimitError) for result in results)
+    assert model.calls == 2
+    assert llm.scheduler.stats()["failed"] == 1
+
+
+def test_sync_calls_are_coalesced_and_retried():
+    model = FakeChatModel(latency=0.1, rate_limited=1)
+    llm = scheduled(model, max_retries=2)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        answers = list(pool.map(lambda _: llm.invoke("hi"), range(3)))
+
+    assert [answer.content for answer in answers] == ["answer to hi"] * 3
+    assert model.calls == 2
+    stats = llm.scheduler.stats()
+    assert stats["rate_limited"] == 1
+    assert stats["coalesced"] == 2
+    assert stats["in_flight"] == 0
@@ -0,0 +1,83 @@
+import multiprocessing
+
+import numpy as np
+from langchain_core.documents import Document
+
+from shared_index import SharedVectorIndex
+
+DIM = 8
+
+
+def vector_for(child: int, chunk: int) -> np.ndarray:
+    return np.full(DIM, child * 1000 + chunk, dtype=np.float32)
+
+
+def write_children(root: str, first_child: int, children: int, chunks: int):
+    index = SharedVectorIndex(root, shards=1)
+    for child in range(first_child, first_child + children):
+        documents = [Document(id=f"{child}:{i}", page_content=f"{child}:{i}") for i in range(chunks)]
+        index.add(f"c{child}", documents, [vector_for(child, i) for i in range(chunks)])
+        if child % 3 == 0:
+            # Removing and compacting renumbers rows under the other writers
+            index.remove(f"c{child}")
+            index.compact()
+    index.close()
+
+
+def assert_rows_match(index: SharedVectorIndex, child: int, chunks: int):
+    documents, vectors = index.shard_for(f"c{child}").chunks(f"c{child}")
+    assert len(documents) == chunks
+    for document, vector in zip(documents, vectors):
+        owner, chunk = map(int, document.page_content.split(":"))
+        np.testing.assert_array_equal(vector, vector_for(owner, chunk))
+
+
+def test_concurrent_processes_keep_rows_consistent(tmp_path):
+    root = str(tmp_path / "shared")
+    chunks = 20
+    context = multiprocessing.get_context("spawn")
+    writers = [context.Process(target=write_children, args=(root, 100 * w, 30, chunks)) for w in range(3)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join(60)
+        assert writer.exitcode == 0
+
+    index = SharedVectorIndex(root)
+    try:
+        for w in range(3):
+            for child in range(100 * w, 100 * w + 30):
+                assert_rows_match(index, child, 0 if child % 3 == 0 else chunks)
+    finally:
+        index.close()
+
+
+def test_reader_sees_vectors_written_by_another_process(tmp_path):
+    root = str(tmp_path / "shared")
+    reader = SharedVectorIndex(root, shards=1)
+    assert reader.shard_for("c1") is None
+
+    writer = multiprocessing.get_context("spawn").Process(target=write_children, args=(root, 1, 2, 5))
+    writer.start()
+    writer.join(60)
+    assert writer.exitcode == 0
+
+    try:
+        assert_rows_match(reader, 1, 5)
+        assert_rows_match(reader, 2, 5)
+    finally:
+        reader.close()
+
+
+def test_recent_children_spans_shards_newest_first(tmp_path):
+    index = SharedVectorIndex(str(tmp_path / "shared"), shards=4)
+    try:
+        assert index.recent_children(5) == []
+        for child in range(6):
+            index.add(f"c{child}", [Document(id=f"{child}:0", page_content="x")], [vector_for(child, 0)])
+        index.set_version("c0", "etag-2")
+        assert len({index.shard_for(f"c{child}").path for child in range(6)}) > 1
+        assert index.recent_children(3) == ["c0", "c5", "c4"]
+        assert sorted(index.recent_children(10)) == [f"c{child}" for child in range(6)]
+    finally:
+        index.close()
@@ -0,0 +1,111 @@
+import asyncio
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from child_journal_rag import ChildJournalRAG
+from index_store import FAISSIndexStore
+from time_retrieval import TimeAwareRetriever, parse_date_range, period_index, period_key
+
+TODAY = date(2025, 3, 15)
+
+
+def months(question):
+    date_range = parse_date_range(question, TODAY)
+    return None if date_range is None else (date_range.months()[0], date_range.months()[-1])
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("What happened in January 2025?", ((2025, 1), (2025, 1))),
+    ("How did she do in December?", ((2024, 12), (2024, 12))),
+    ("between March and June 2024", ((2024, 3), (2024, 6))),
+    ("January to March 2025", ((2025, 1), (2025, 3))),
+    ("In 2024, how was March?", ((2024, 3), (2024, 3))),
+    ("what did he do in 2023", ((2023, 1), (2023, 12))),
+    ("progress in 11/2024", ((2024, 11), (2024, 11))),
+    ("May 2024 milestones", ((2024, 5), (2024, 5))),
+    ("what happened in may", ((2024, 5), (2024, 5))),
+    ("since October 2024 how is speech?", ((2024, 10), (2025, 3))),
+    ("over the past 3 months", ((2025, 1), (2025, 3))),
+    ("in the last month", ((2025, 2), (2025, 2))),
+    ("what happened in 2023 and 2024", ((2023, 1), (2024, 12))),
+    ("in 2021, 2022 or 2023", ((2021, 1), (2023, 12))),
+    ("Jan to Mar 2024", ((2024, 1), (2024, 3))),
+    ("from Jan to Mar", ((2025, 1), (2025, 3))),
+    ("Sept. 2024", ((2024, 9), (2024, 9))),
+])
+def test_parses_dates(question, expected):
+    assert months(question) == expected
+
+
+@pytest.mark.parametrize("question", [
+    "He was sick and may need rest",
+    "She drinks 2000 ml of milk a day",
+    "Is 1990 calories too much?",
+    "The kids march on the playground",
+    "He weighed 12.2020 kg",
+    "What may help with sleep?",
+    "He walked 2024 steps today",
+    "How is his speech?",
+    "Pictures from our trip to Jan's",
+    "He met Jan and Dec at the park",
+    "How was Dec?",
+])
+def test_ignores_non_dates(question):
+    assert parse_date_range(question, TODAY) is None
+
+
+def journal_store():
+    texts = ["Started walking", "First words", "Slept through the night"]
+    metadatas = [{"month": "January", "year": "2025"}, {"month": "02", "year": 2025}, {"month": "March", "year": "2025"}]
+    return FAISS.from_texts(texts, DeterministicFakeEmbedding(size=16), metadatas=metadatas)
+
+
+def test_searches_only_the_named_months():
+    retriever = TimeAwareRetriever(vector_store=journal_store(), k=3, today=TODAY)
+    docs = retriever.invoke("What happened in February 2025?")
+    assert [doc.page_content for doc in docs] == ["First words"]
+
+
+def test_falls_back_to_whole_journal_for_months_without_chunks():
+    retriever = TimeAwareRetriever(vector_store=journal_store(), k=3, today=TODAY)
+    docs = retriever.invoke("What happened in June 2023?")
+    assert len(docs) == 3
+
+
+def test_async_falls_back_to_whole_journal():
+    retriever = TimeAwareRetriever(vector_store=journal_store(), k=3, today=TODAY)
+    docs = asyncio.run(retriever.ainvoke("What happened in June 2023?"))
+    assert len(docs) == 3
+
+
+def test_period_index_is_shared_per_store_and_rebuilt_after_updates():
+    store = journal_store()
+    first = period_index(store)
+    assert period_index(store) is first
+    assert first[period_key(2025, 2)] == [1]
+
+    store.add_texts(["Second tooth"], metadatas=[{"month": "April", "year": "2025"}])
+    assert period_key(2025, 4) in period_index(store)
+
+
+def test_period_index_follows_incremental_updates(tmp_path):
+    rag = ChildJournalRAG(
+        embeddings=DeterministicFakeEmbedding(size=16),
+        journal_loader=SimpleNamespace(s3=None, bucket_name="bucket"),
+        index_store=FAISSIndexStore(str(tmp_path)),
+    )
+    january = {"month": "January", "year": "2025", "summary": "Started walking"}
+    february = {"month": "February", "year": "2025", "summary": "First words"}
+    march = {"month": "March", "year": "2025", "summary": "Slept through the night"}
+    store = FAISS.from_documents(rag.prepare_documents([january, february]), rag.embeddings)
+    assert set(period_index(store)) == {period_key(2025, 1), period_key(2025, 2)}
+
+    # Same number of chunks, but January's is deleted and the rest renumbered
+    rag.update_vector_store(store, [february, march])
+    assert period_index(store) == {period_key(2025, 2): [0], period_key(2025, 3): [1]}
+    retriever = TimeAwareRetriever(vector_store=store, k=3, today=TODAY)
+    assert [doc.page_content for doc in retriever.invoke("How did he sleep in March 2025?")] == [march["summary"]]
@@ -0,0 +1,298 @@
+import re
+import threading
+import weakref
+from datetime import date
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+from retrievers import MMRRetriever
+
+MONTHS = {
+    "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6,
+    "july": 7, "august": 8, "september": 9, "october": 10, "november": 11, "december": 12,
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "jun": 6, "jul": 7, "aug": 8,
+    "sep": 9, "sept": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+}
+
+# Quantities such as "2000 ml" or "12.2020 kg" are not dates
+UNITS = (
+    "kg|kgs|g|gr|grams?|lbs?|pounds?|oz|ounces?|cm|mm|m|meters?|metres?|inch(?:es)?|ml|l|liters?|litres?|"
+    "cal|kcal|calories|hours?|hrs?|minutes?|mins?|seconds?|secs?|steps|words|times|percent"
+)
+_NOT_QUANTITY = r"(?!\s*(?:(?:to|-|and)\s*\d+(?:\.\d+)?\s*)?(?:%|(?:" + UNITS + r")\b))"
+_MONTH = r"(?P<month>" + "|".join(sorted(MONTHS, key=len, reverse=True)) + r")\b\.?"
+_YEAR = r"(?P<year>(?:19|20)\d{2})\b" + _NOT_QUANTITY
+MONTH_YEAR_RE = re.compile(
+    r"(?P<prefix>\b(?P<word>in|of|during|since|from|until|till|to|between|and|through|around|after)\s+)?"
+    r"\b" + _MONTH + r"(?:,?\s+(?:of\s+)?" + _YEAR + r")?"
+)
+NUMERIC_RE = re.compile(
+    r"\b(?:(?P<y1>(?:19|20)\d{2})[-/.](?P<m1>0?[1-9]|1[0-2])|(?P<m2>0?[1-9]|1[0-2])[-/.](?P<y2>(?:19|20)\d{2}))\b"
+    + _NOT_QUANTITY
+)
+# A bare year only counts as a date after words like "in" or "since", or as a range "from 2023 to 2024";
+# a list such as "in 2023 and 2024" dates every year in it
+YEAR_RE = re.compile(
+    r"\b(?:in|during|since|from|until|till|through|around|after|of|year)\s+(?:the\s+year\s+)?" + _YEAR
+    + r"(?:\s*(?:,|,?\s*and|,?\s*or|&)\s*(?:19|20)\d{2}\b" + _NOT_QUANTITY + r")*"
+)
+YEAR_DIGITS_RE = re.compile(r"(?:19|20)\d{2}")
+YEAR_RANGE_RE = re.compile(
+    r"\b(?:between|from)\s+(?P<start>(?:19|20)\d{2})\s*(?:and|to|until|till|-)\s*" + _YEAR
+)
+# Month names that are also common words; they only count with a year, a date
+# preposition or, for full names, a capital letter in mid-sentence
+AMBIGUOUS_MONTHS = {"may", "mar", "march"}
+# Abbreviations double as names ("Jan's"); they need a year or a date preposition
+ABBREVIATED_MONTHS = {name for name in MONTHS if len(name) <= 4 and name not in ("may", "june", "july")}
+# "and"/"to" only mark a month right after another month, as in "January to March"
+WEAK_PREFIXES = {"and", "to"}
+# "Jan to Mar 2024": the start of a range is dated by the year ending it
+DATE_AFTER_RE = re.compile(
+    r"\s*(?:-|(?:to|and|through|until|till)\s)\s*(?:(?:" + "|".join(MONTHS) + r")\b\.?,?\s+)?(?:19|20)\d{2}\b"
+)
+SINCE_RE = re.compile(r"\b(?:since|after)\s+$")
+LAST_N_MONTHS_RE = re.compile(r"\b(?:last|past|previous)\s+(?P<n>\d{1,2}|" + "|".join(NUMBER_WORDS) + r")\s+months?\b")
+
+
+def period_key(year: int, month: int) -> int:
+    """Sortable integer for a (year, month) pair."""
+    return year * 12 + month - 1
+
+
+def month_number(value: Any) -> Optional[int]:
+    """Month as 1-12 from 1, '01', 'Jan' or 'January'; None if unrecognized."""
+    text = str(value).strip().lower().rstrip(".")
+    if text.isdigit():
+        month = int(text)
+        return month if 1 <= month <= 12 else None
+    return MONTHS.get(text)
+
+
+def metadata_period(metadata: Dict) -> Optional[int]:
+    """Period key of a chunk from its month/year metadata, if both are readable."""
+    month = month_number(metadata.get("month", ""))
+    year = str(metadata.get("year", "")).strip()
+    if month is None or not year.isdigit():
+        return None
+    return period_key(int(year), month)
+
+
+class DateRange(NamedTuple):
+    """Inclusive range of period keys."""
+    start: int
+    end: int
+
+    def months(self) -> List[Tuple[int, int]]:
+        return [(key // 12, key % 12 + 1) for key in range(self.start, self.end + 1)]
+
+
+def parse_date_range(question: str, today: Optional[date] = None) -> Optional[DateRange]:
+    """Find the months a question explicitly asks about.
+
+    Understands month names with or without a year ("January 2025", "in
+    March"), numeric months ("2025-01", "01/2025"), bare years ("in 2024"),
+    "since <month>" and relative phrases ("last month", "this year", "the
+    past 3 months"). A month without a year takes a year mentioned
+    elsewhere in the question, else its most recent occurrence. Several
+    mentions are merged into the range spanning them.
+
+    Returns:
+        DateRange of the months asked about, or None if the question names no date
+    """
+    today = today or date.today()
+    current = period_key(today.year, today.month)
+    text = question.lower()
+    ranges: List[DateRange] = []
+
+    match = LAST_N_MONTHS_RE.search(text)
+    if match:
+        n = match.group("n")
+        n = int(n) if n.isdigit() else NUMBER_WORDS[n]
+        # The current month counts as one of them
+        ranges.append(DateRange(current - max(n, 1) + 1, current))
+    if re.search(r"\b(?:last|previous)\s+month\b", text):
+        ranges.append(DateRange(current - 1, current - 1))
+    if re.search(r"\bthis\s+month\b", text):
+        ranges.append(DateRange(current, current))
+    if re.search(r"\blast\s+year\b", text):
+        ranges.append(DateRange(period_key(today.year - 1, 1), period_key(today.year - 1, 12)))
+    if re.search(r"\bthis\s+year\b", text):
+        ranges.append(DateRange(period_key(today.year, 1), current))
+
+    # Years that qualify a month rather than standing for the whole year
+    claimed_years = set()
+    for match in NUMERIC_RE.finditer(text):
+        year = int(match.group("y1") or match.group("y2"))
+        month = int(match.group("m1") or match.group("m2"))
+        claimed_years.add(year)
+        ranges.append(DateRange(period_key(year, month), period_key(year, month)))
+
+    for match in YEAR_RANGE_RE.finditer(text):
+        start, end = sorted((int(match.group("start")), int(match.group("year"))))
+        ranges.append(DateRange(period_key(start, 1), period_key(end, 12)))
+
+    year_mentions = [
+        (match.start() + year.start(), int(year.group()))
+        for match in YEAR_RE.finditer(text)
+        for year in YEAR_DIGITS_RE.finditer(match.group())
+    ]
+    mentioned_years = [year for _, year in year_mentions]
+    # A month without a year takes the last year written anywhere as a date
+    dated_years = sorted(
+        year_mentions
+        + [(m.start(), int(m.group("year"))) for m in MONTH_YEAR_RE.finditer(text) if m.group("year")]
+    )
+    # Where accepted month mentions end, so "and"/"to" after them mark the next month
+    month_ends = set()
+    for match in MONTH_YEAR_RE.finditer(text):
+        word = match.group("month")
+        prefix = match.group("word")
+        if prefix in WEAK_PREFIXES:
+            before = text[:match.start()].rstrip(" ,.")
+            if len(before) not in month_ends:
+                prefix = None
+        # "may", "march" and "mar" are usually not months unless a year, a
+        # preposition or a capital letter in mid-sentence says so
+        if word in AMBIGUOUS_MONTHS and not (match.group("year") or prefix or _capitalized(question, match.start("month"))):
+            continue
+        if word in ABBREVIATED_MONTHS and not (
+            (match.group("year") or prefix or DATE_AFTER_RE.match(text, match.end()))
+            and not text.startswith(("'s", "\u2019s"), match.end("month"))
+        ):
+            continue
+        month_ends.add(len(text[:match.end()].rstrip(" ,.")))
+        month = MONTHS[word]
+        if match.group("year"):
+            year = int(match.group("year"))
+            claimed_years.add(year)
+        elif dated_years:
+            year = dated_years[-1][1]
+            claimed_years.add(year)
+        else:
+            year = today.year if period_key(today.year, month) <= current else today.year - 1
+        key = period_key(year, month)
+        if prefix and SINCE_RE.search(match.group("prefix")):
+            ranges.append(DateRange(key, max(key, current)))
+        else:
+            ranges.append(DateRange(key, key))
+
+    for year in set(mentioned_years) - claimed_years:
+        ranges.append(DateRange(period_key(year, 1), period_key(year, 12)))
+
+    if not ranges:
+        return None
+    return DateRange(min(r.start for r in ranges), max(r.end for r in ranges))
+
+
+# FAISS store -> (vectors indexed, period key -> positions); retrievers are
+# created per request, so the map lives as long as the store instead.
+# Whoever changes a store in place calls forget_period_index()
+_period_indexes: "weakref.WeakKeyDictionary[VectorStore, Tuple[int, Dict[int, List[int]]]]" = weakref.WeakKeyDictionary()
+_period_indexes_lock = threading.Lock()
+
+
+def period_index(store: VectorStore) -> Dict[int, List[int]]:
+    """Positions of a FAISS store's chunks per period key, built once per store."""
+    size = len(store.index_to_docstore_id)
+    cached = _period_indexes.get(store)
+    if cached is not None and cached[0] == size:
+        return cached[1]
+
+    periods: Dict[int, List[int]] = {}
+    for position, doc_id in store.index_to_docstore_id.items():
+        doc = store.docstore.search(doc_id)
+        key = metadata_period(doc.metadata) if isinstance(doc, Document) else None
+        if key is not None:
+            periods.setdefault(key, []).append(position)
+    with _period_indexes_lock:
+        # The size only guards against additions nobody reported
+        _period_indexes[store] = (size, periods)
+    return periods
+
+
+def forget_period_index(store: VectorStore):
+    """Drop a store's period index after chunks were deleted or added in place."""
+    with _period_indexes_lock:
+        _period_indexes.pop(store, None)
+
+
+def _capitalized(question: str, start: int) -> bool:
+    """Whether the word at start is capitalized other than for starting a sentence."""
+    before = question[:start].rstrip()
+    return question[start].isupper() and bool(before) and before[-1] not in ".!?\"'"
+
+
+class TimeAwareRetriever(MMRRetriever):
+    """Retriever restricting the search to the months a question names.
+
+    Questions naming a date are answered from the chunks of those months
+    only: their vectors are looked up through a (year, month) index, built
+    once per vector store, and re-ranked by MMR, so neither other months
+    nor the rest of the index are scanned. Questions without a date, or
+    naming months the journal has no chunks for, get the usual MMR search
+    over the whole index.
+    """
+
+    k: int = 3
+    today: Optional[date] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        date_range = parse_date_range(query, self.today)
+        if date_range is None:
+            return super()._get_relevant_documents(query, run_manager=run_manager)
+        embedding = self.embed_query(query)
+        return self._search_range(embedding, date_range) or self.vector_store.max_marginal_relevance_search_by_vector(
+            embedding, k=self.k, fetch_k=self.fetch_k, lambda_mult=self.lambda_mult
+        )
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        date_range = parse_date_range(query, self.today)
+        if date_range is None:
+            return await super()._aget_relevant_documents(query, run_manager=run_manager)
+        embedding = await self.aembed_query(query)
+        # Only the named months' vectors are read, so the search itself is cheap
+        documents = self._search_range(embedding, date_range)
+        if documents:
+            return documents
+        # Better an answer from the whole journal than none at all
+        return await self.vector_store.amax_marginal_relevance_search_by_vector(
+            embedding, k=self.k, fetch_k=self.fetch_k, lambda_mult=self.lambda_mult
+        )
+
+    def _search_range(self, embedding: List[float], date_range: DateRange) -> List[Document]:
+        shared_index = getattr(self.vector_store, "shared_index", None)
+        if shared_index is not None:
+            # The shared index filters on its own indexed period column
+            results = shared_index.search(
+                self.vector_store.child_id, embedding, self.k, self.fetch_k, self.lambda_mult, periods=date_range
+            )
+            return [doc for doc, _ in results]
+
+        periods = period_index(self.vector_store)
+        positions = [
+            position
+            for key in range(date_range.start, date_range.end + 1)
+            for position in periods.get(key, ())
+        ]
+        if not positions:
+            return []
+
+        store = self.vector_store
+        vectors = store.index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+        query = np.asarray(embedding, dtype=np.float32)
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        nearest = np.argsort(distances)[:self.fetch_k]
+        selected = maximal_marginal_relevance(query, vectors[nearest], k=min(self.k, len(nearest)), lambda_mult=self.lambda_mult)
+        return [store.docstore.search(store.index_to_docstore_id[positions[nearest[i]]]) for i in selected]
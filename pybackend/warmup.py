@@ -0,0 +1,81 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from concurrency import load_executor, run_blocking
+
+logger = logging.getLogger(__name__)
+
+
+def startup_mode() -> str:
+    """RAG_STARTUP_MODE: 'background' (default) warms up after startup, 'eager' before it."""
+    return os.getenv("RAG_STARTUP_MODE", "background").lower()
+
+
+class Readiness:
+    def __init__(self):
+        """Warm-up progress of a service, backing its liveness/readiness probes.
+
+        The service is live as soon as it answers; it is ready once the
+        embedding model is loaded and the hot children's indexes have been
+        attempted, so a load balancer only routes to warm pods.
+        """
+        self.model_loaded = False
+        self.hot_children = 0
+        self.hot_children_loaded = 0
+        self.finished = False
+        self.error = None
+        self.started_at = time.time()
+        self.seconds = None
+
+    @property
+    def ready(self) -> bool:
+        return self.model_loaded and self.finished and self.error is None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "model_loaded": self.model_loaded,
+            "hot_children": self.hot_children,
+            "hot_children_loaded": self.hot_children_loaded,
+            "warmup_finished": self.finished,
+            "warmup_seconds": self.seconds,
+            "error": self.error,
+        }
+
+
+async def warm_up(rag, load_child: Callable[[str], Awaitable[Any]], readiness: Readiness, top_n: Optional[int] = None):
+    """Load the models, then the indexes of the most recently used children.
+
+    Args:
+        rag: The service's ChildJournalRAG
+        load_child: Coroutine function loading a child into the service's cache
+        readiness: Progress is recorded here
+        top_n: Hot children to preload, defaults to WARMUP_HOT_CHILDREN or 20
+    """
+    top_n = int(os.getenv("WARMUP_HOT_CHILDREN", 20)) if top_n is None else top_n
+    started = time.monotonic()
+    try:
+        await run_blocking(load_executor, rag.warm_up)
+        readiness.model_loaded = True
+
+        children = await run_blocking(load_executor, rag.recent_children, top_n)
+        readiness.hot_children = len(children)
+        results = await asyncio.gather(*(load_child(child_id) for child_id in children), return_exceptions=True)
+        for child_id, result in zip(children, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"Could not preload child {child_id}: {result}")
+            else:
+                readiness.hot_children_loaded += 1
+    except Exception as e:
+        readiness.error = str(e)
+        logger.error(f"Warm-up failed: {e}")
+    finally:
+        readiness.finished = True
+        readiness.seconds = round(time.monotonic() - started, 3)
+        logger.info(
+            f"Warm-up finished in {readiness.seconds}s, "
+            f"{readiness.hot_children_loaded}/{readiness.hot_children} hot children loaded"
+        )
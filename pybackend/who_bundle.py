@@ -0,0 +1,115 @@
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUNDLE_DIR = Path(__file__).resolve().parent.parent / "dataset" / "bundle"
+MANIFEST_FILE = "manifest.json"
+SUPPORTED_VERSION = 1
+
+
+class WHOTable:
+    def __init__(self, name: str, data: np.ndarray, columns: List[str], x: str):
+        """One WHO table as read-only, column-major views into the bundle.
+
+        Args:
+            name: Canonical name, e.g. wfa/boys/z/expanded
+            data: (columns, rows) float64 view of the memory-mapped bundle
+            columns: Column names in data order
+            x: Name of the age or length/height column rows are sorted by
+        """
+        self.name = name
+        self.data = data
+        self.columns = columns
+        self.x_column = x
+        self._index = {column: i for i, column in enumerate(columns)}
+
+    def __contains__(self, column: str) -> bool:
+        return column in self._index
+
+    def __len__(self) -> int:
+        return self.data.shape[1]
+
+    def column(self, column: str) -> np.ndarray:
+        """Contiguous float64 view of a column; no data is copied."""
+        return self.data[self._index[column]]
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.column(self.x_column)
+
+
+class WHOBundle:
+    def __init__(self, bundle_dir: Optional[str] = None):
+        """Lazy reader of the bundle written by dataset/build_who_bundle.py.
+
+        Nothing is read until the first table is requested; the bundle is
+        then memory-mapped once and tables are handed out as views into it.
+
+        Args:
+            bundle_dir: Directory with manifest.json and the binary file, defaults to WHO_BUNDLE_DIR or dataset/bundle
+        """
+        self.bundle_dir = Path(bundle_dir or os.getenv("WHO_BUNDLE_DIR", DEFAULT_BUNDLE_DIR))
+        self._manifest: Optional[Dict] = None
+        self._data: Optional[np.memmap] = None
+        self._tables: Dict[str, WHOTable] = {}
+        self._lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return (self.bundle_dir / MANIFEST_FILE).exists()
+
+    @property
+    def manifest(self) -> Dict:
+        if self._manifest is None:
+            self._open()
+        return self._manifest
+
+    def names(self) -> List[str]:
+        return list(self.manifest["tables"])
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.manifest["tables"]
+
+    def table(self, name: str) -> WHOTable:
+        """Return a table by canonical name, e.g. bmi/girls/z/expanded."""
+        table = self._tables.get(name)
+        if table is not None:
+            return table
+
+        entry = self.manifest["tables"].get(name)
+        if entry is None:
+            raise KeyError(f"No table {name} in {self.bundle_dir}")
+        count = entry["rows"] * len(entry["columns"])
+        start = entry["offset"] // self._data.itemsize
+        data = self._data[start:start + count].reshape(len(entry["columns"]), entry["rows"])
+        table = WHOTable(name, data, entry["columns"], entry["x"])
+        self._tables[name] = table
+        return table
+
+    def _open(self):
+        with self._lock:
+            if self._manifest is not None:
+                return
+            for attempt in range(2):
+                with open(self.bundle_dir / MANIFEST_FILE, encoding="utf-8") as f:
+                    manifest = json.load(f)
+                if manifest.get("version") != SUPPORTED_VERSION:
+                    raise ValueError(f"Unsupported WHO bundle version {manifest.get('version')}, rebuild it")
+                try:
+                    data = np.memmap(self.bundle_dir / manifest["file"], dtype=np.dtype(manifest["dtype"]), mode="r")
+                    break
+                except FileNotFoundError:
+                    # A rebuild replaced the manifest and removed the file it named; read the new one
+                    if attempt:
+                        raise
+            if data.nbytes < manifest.get("size", 0):
+                raise ValueError(f"WHO bundle {manifest['file']} is shorter than its manifest says, rebuild it")
+            self._data = data
+            self._manifest = manifest
+            logger.info(f"Mapped WHO bundle with {len(manifest['tables'])} tables from {self.bundle_dir}")